@@ -88,7 +88,8 @@ class CylinderJob(ORLEJobBase):
         self.stride = round(end_time - start_time, 5)
 
         # Jet paramters
-        default_table = "table (({:g} (0.0 0.0 0.0)))".format(start_time)
+        # Action schedules as [time, velocity] rows, written to table files
+        default_table = [[start_time, [0.0, 0.0, 0.0]]]
         self.jet_tables = {"jet1": default_table, "jet2":default_table, "jet3": default_table, "jet4":default_table}
         self.jet_normals = {"jet1": [-1, 1, 0], "jet2":[1, 1, 0], \
                         "jet3": [1, -1, 0], "jet4":[-1, -1, 0]}
@@ -134,16 +135,16 @@ class CylinderJob(ORLEJobBase):
         if normal is None:
             normal = self.jet_normals[jet_name]
 
-        table = ""
+        table = []
         times = np.linspace(self.start_time, self.end_time, steps)
         mags = np.linspace(vmag_start, vmag_end, steps)
         for i in range(steps):
             mag0 = np.sqrt(mags[i]**2 / (normal[0]**2 + normal[1]**2 + normal[2]**2))
-            table += '({:.04f} ({:.04f} {:.04f} {:.04f}))'.format(
-                times[i], mag0*normal[0], mag0*normal[1], mag0*normal[2]
+            table.append(
+                [float(times[i]), [float(mag0*normal[0]), float(mag0*normal[1]), float(mag0*normal[2])]]
             )
 
-        self.jet_tables[jet_name] = "table ("+table+")"
+        self.jet_tables[jet_name] = table
         self.vmag_targets[jet_name] = vmag_end
         self.jet_normals[jet_name] = normal
 
@@ -180,14 +181,15 @@ class CylinderJob(ORLEJobBase):
         for jet, table in self.jet_tables.items():
             jet_boundaries.append(
                 {
-                'func': 'set_boundary', 
+                'func': 'set_boundary_table', 
                 'params':{ 
                     'field': 'U', 
                     'boundary': jet, 
                     'time_step': self.start_time,
+                    'entry': 'uniformValue',
+                    'table': table,
                     'props': {
-                        'type': 'uniformFixedValue',
-                        'uniformValue': table
+                        'type': 'uniformFixedValue'
                     }
                 }
                 }
@@ -9,7 +9,7 @@ sys.path.append('..')
 import os
 import logging
 
-from orle import Parser, WorldBuilder, OrleProcess
+from orle import Parser, WorldBuilder, OrleProcess, Autotuner, fit_surrogates
 
 if __name__ == '__main__':
 
@@ -28,6 +28,14 @@ if __name__ == '__main__':
     wrld_builder.setup_world(args.world_id, args.overwrite_world)
     wrld_config = wrld_builder.get_world_config(args.world_id)
 
+    # Optionally calibrate np of the world's meshes for jobs with np: auto
+    if args.autotune:
+        Autotuner(wrld_config, args.tune_np, args.tune_methods,
+                  args.tune_steps).tune(overwrite=True)
+    # Optionally refit the surrogate backend to the jobs run so far
+    if args.fit_surrogate:
+        fit_surrogates(wrld_config)
+
     # Create ORLE process and run it
     proc = OrleProcess(wrld_config)
     proc.start()
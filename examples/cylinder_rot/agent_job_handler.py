@@ -88,7 +88,8 @@ class CylinderJob(ORLEJobBase):
         self.stride = round(end_time - start_time, 5)
 
         # Jet paramters
-        default_table = "table (({:g} 0.0))".format(start_time)
+        # Action schedule as [time, omega] rows, written to a table file
+        default_table = [[start_time, 0.0]]
         self.omega_table = default_table
         self.omega_target = 0.0
 
@@ -128,15 +129,13 @@ class CylinderJob(ORLEJobBase):
         if omega_start is None:
             omega_start = self.omega_target
 
-        table = ""
+        table = []
         times = np.linspace(self.start_time, self.end_time, steps)
         mags = np.linspace(omega_start, omega_end, steps)
         for i in range(steps):
-            table += '({:.04f} {:.04f})'.format(
-                times[i], mags[i]
-            )
+            table.append([float(times[i]), float(mags[i])])
 
-        self.omega_table = "table ("+table+")"
+        self.omega_table = table
         self.omega_target = omega_end
 
     def write(
@@ -169,16 +168,17 @@ class CylinderJob(ORLEJobBase):
         }
 
         omega_dict = {
-            'func': 'set_boundary', 
+            'func': 'set_boundary_table', 
             'params':{ 
                 'field': 'U', 
                 'boundary': 'cylinder', 
                 'time_step': self.start_time,
+                'entry': 'omega',
+                'table': self.omega_table,
                 'props': {
                     'type': 'rotatingWallVelocity',
                     'origin': '(0 0 0.005)',
-                    'axis': '(0 0 1)',
-                    'omega': self.omega_table
+                    'axis': '(0 0 1)'
                 }
             }
         }
@@ -1,5 +1,9 @@
-__all__ = ["Parser", "WorldBuilder", "OrleProcess"]
+__all__ = [
+    "Parser", "WorldBuilder", "OrleProcess", "Autotuner", "fit_surrogates"
+]
 
 from .args import Parser
 from .builders import WorldBuilder
-from .process import OrleProcess
\ No newline at end of file
+from .process import OrleProcess
+from .surrogate import fit_surrogates
+from .tuning import Autotuner
\ No newline at end of file
@@ -0,0 +1,256 @@
+import glob
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Tuple, Union
+
+from filelock import FileLock
+
+from .jlogger import getLogger
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+CPU_DIR = '/sys/devices/system/cpu'
+# Node wide registry of the cores held by running jobs, shared by every
+# process (set ORLE_CORE_REGISTRY to move it)
+CORE_REGISTRY = 'orle.cores.json'
+_ALLOCATOR = None
+_ALLOCATOR_LOCK = threading.Lock()
+
+
+def cpu_topology(cpu_dir: str = CPU_DIR) -> List[Dict]:
+    """Physical cores this process may run on, with their hardware threads,
+    socket and NUMA node. Falls back to one core per CPU if the topology is
+    not available.
+
+    Args:
+        cpu_dir (str, optional): sysfs CPU folder. Defaults to CPU_DIR.
+
+    Returns:
+        List[Dict]: cores with keys cpus, package and node, sorted by node, package and first CPU
+    """
+    def read_int(path: str, default: int = 0) -> int:
+        try:
+            with open(path, 'r') as file:
+                return int(file.read().strip())
+        except (OSError, ValueError):
+            return default
+
+    cores = {}
+    for cpu in sorted(os.sched_getaffinity(0)):
+        topology = os.path.join(cpu_dir, 'cpu{:d}'.format(cpu), 'topology')
+        package = read_int(os.path.join(topology, 'physical_package_id'))
+        core = read_int(os.path.join(topology, 'core_id'), cpu)
+        nodes = glob.glob(
+            os.path.join(cpu_dir, 'cpu{:d}'.format(cpu), 'node[0-9]*')
+        )
+        node = int(os.path.basename(nodes[0])[4:]) if len(nodes) > 0 else 0
+
+        key = (package, core)
+        if not key in cores:
+            cores[key] = {'cpus': [], 'package': package, 'node': node}
+        cores[key]['cpus'].append(cpu)
+
+    return sorted(
+        cores.values(), key=lambda c: (c['node'], c['package'], c['cpus'][0])
+    )
+
+
+class CoreAllocator(object):
+    """Assigns disjoint sets of CPUs to the running jobs of a node, so the
+    solvers of concurrent workers do not share cores. Jobs get one hardware
+    thread per physical core, packed on a single NUMA node when one has
+    enough free cores. Assignments are kept in a registry file shared by
+    all processes of the node, entries of exited processes are dropped.
+    Use get_allocator to get the allocator of this process.
+
+    Args:
+        registry (str, optional): Path to registry file. Defaults to CORE_REGISTRY in the temp folder.
+    """
+    def __init__(self, registry: str = None) -> None:
+        """Constructor
+        """
+        if registry is None:
+            registry = os.environ.get(
+                'ORLE_CORE_REGISTRY',
+                os.path.join(tempfile.gettempdir(), CORE_REGISTRY)
+            )
+        self.registry = registry
+        self.lock = FileLock(registry + '.lock')
+        self.cores = cpu_topology()
+
+    def acquire(self, owner: str, n: int) -> Union[List[int], None]:
+        """Assigns CPUs to a job, the CPUs it already holds are kept if they
+        are enough
+
+        Args:
+            owner (str): Name of the job holding the CPUs
+            n (int): Number of CPUs
+
+        Returns:
+            Union[List[int], None]: assigned CPUs, None if not enough are free
+        """
+        with self.lock:
+            entries = self._read()
+            if owner in entries and len(entries[owner]['cpus']) == n:
+                return list(entries[owner]['cpus'])
+            entries.pop(owner, None)
+
+            used = set(
+                cpu for entry in entries.values() for cpu in entry['cpus']
+            )
+            cpus = self._select(used, n)
+            if cpus is None:
+                logger.warning(
+                    'Only {:d} free CPUs for {:d} processes, not pinning.'.
+                    format(self._free_count(used), n)
+                )
+                return None
+
+            entries[owner] = {'pid': os.getpid(), 'cpus': cpus}
+            self._write(entries)
+        return list(cpus)
+
+    def release(self, owner: str) -> None:
+        """Frees the CPUs of a job
+
+        Args:
+            owner (str): Name of the job holding the CPUs
+        """
+        with self.lock:
+            entries = self._read()
+            if not entries.pop(owner, None) is None:
+                self._write(entries)
+
+    def free_cores(self) -> int:
+        """Number of physical cores not held by a job
+
+        Returns:
+            int: number of free cores
+        """
+        with self.lock:
+            entries = self._read()
+        used = set(cpu for entry in entries.values() for cpu in entry['cpus'])
+        return sum(
+            1 for core in self.cores
+            if not any(cpu in used for cpu in core['cpus'])
+        )
+
+    def _select(self, used: set, n: int) -> Union[List[int], None]:
+        """Picks free CPUs, preferring whole physical cores on one NUMA node
+
+        Args:
+            used (set): CPUs held by other jobs
+            n (int): Number of CPUs
+
+        Returns:
+            Union[List[int], None]: CPUs, None if not enough are free
+        """
+        free = [c for c in self.cores if not any(u in used for u in c['cpus'])]
+        nodes = {}
+        for core in free:
+            nodes.setdefault(core['node'], []).append(core)
+
+        # Smallest NUMA node that fits the job
+        fits = [cores for cores in nodes.values() if len(cores) >= n]
+        if len(fits) > 0:
+            cores = min(fits, key=len)
+            return [core['cpus'][0] for core in cores[:n]]
+
+        # Spread over nodes, fullest first
+        if len(free) >= n:
+            cores = [
+                core
+                for cores in sorted(nodes.values(), key=len, reverse=True)
+                for core in cores
+            ]
+            return [core['cpus'][0] for core in cores[:n]]
+
+        # Not enough physical cores, share them between hardware threads
+        threads = [
+            cpu for core in self.cores for cpu in core['cpus']
+            if not cpu in used
+        ]
+        if len(threads) >= n:
+            return threads[:n]
+        return None
+
+    def _free_count(self, used: set) -> int:
+        """Number of CPUs not held by a job
+
+        Args:
+            used (set): CPUs held by jobs
+
+        Returns:
+            int: number of free CPUs
+        """
+        return sum(
+            1 for core in self.cores for cpu in core['cpus'] if not cpu in used
+        )
+
+    def _read(self) -> Dict:
+        """Reads the registry, dropping entries of exited processes
+
+        Returns:
+            Dict: CPUs and process of each owner
+        """
+        if not os.path.exists(self.registry):
+            return {}
+        try:
+            with open(self.registry, 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+        def running(pid: int) -> bool:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+            return True
+
+        return {k: v for k, v in entries.items() if running(v['pid'])}
+
+    def _write(self, entries: Dict) -> None:
+        """Writes the registry
+
+        Args:
+            entries (Dict): CPUs and process of each owner
+        """
+        tmp_file = '{:s}.{:d}.tmp'.format(self.registry, os.getpid())
+        with open(tmp_file, 'w') as file:
+            json.dump(entries, file)
+        os.replace(tmp_file, self.registry)
+
+
+def get_allocator() -> CoreAllocator:
+    """Core allocator of this process
+
+    Returns:
+        CoreAllocator: core allocator
+    """
+    global _ALLOCATOR
+    with _ALLOCATOR_LOCK:
+        if _ALLOCATOR is None:
+            _ALLOCATOR = CoreAllocator()
+        return _ALLOCATOR
+
+
+def binding_args(cpus: List[int]) -> List[str]:
+    """mpirun (Open MPI) options binding one rank to each CPU
+
+    Args:
+        cpus (List[int]): CPUs of the job
+
+    Returns:
+        List[str]: command line arguments
+    """
+    return [
+        '--cpu-set', ','.join(str(cpu) for cpu in cpus), '--bind-to',
+        'hwthread'
+    ]
@@ -21,6 +21,36 @@ class Parser(argparse.ArgumentParser):
             action='store_true',
             help="reinitialize environment folders"
         )
+        self.add_argument(
+            '--fit_surrogate',
+            action='store_true',
+            help="fit the surrogate backend of each environment to its archive"
+        )
+        self.add_argument(
+            '--autotune',
+            action='store_true',
+            help="calibrate np of the world's meshes for jobs with np: auto"
+        )
+        self.add_argument(
+            '--tune_np',
+            type=int,
+            nargs='+',
+            default=[1, 2, 4, 8],
+            help='numbers of processes to calibrate'
+        )
+        self.add_argument(
+            '--tune_methods',
+            type=str,
+            nargs='+',
+            default=['scotch'],
+            help='decomposition methods to calibrate'
+        )
+        self.add_argument(
+            '--tune_steps',
+            type=int,
+            default=20,
+            help='time-steps of each calibration window'
+        )
 
     def parse(self) -> object:
         """Parse program arguments
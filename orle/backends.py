@@ -0,0 +1,281 @@
+import json
+import os
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import yaml
+
+from .jlogger import getLogger
+from .post import FILE_NAMES
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Key of the data array in the output of each post function
+POST_KEYS = {'get_forces': 'forces', 'get_coeff': 'coeff', 'get_probes': 'probes'}
+
+
+def output_name(post: Config, job_hash: str) -> str:
+    """File name the output of a post function is saved under
+
+    Args:
+        post (Config): post function config
+        job_hash (str): hash of the job
+
+    Returns:
+        str: <outputname or default name>.<hash>.npy
+    """
+    if 'outputname' in post.keys():
+        name = post['outputname']
+    else:
+        name = FILE_NAMES[post['func']]
+    return '{:s}.{:s}.npy'.format(name, str(job_hash))
+
+
+def channel_key(post: Config) -> str:
+    """Identifies the output of a post function independent of its time
+
+    Args:
+        post (Config): post function config
+
+    Returns:
+        str: channel key
+    """
+    params = {k: v for k, v in post['params'].items() if k != 'time_step'}
+    return json.dumps([post['func'], params], sort_keys=True)
+
+
+def action_tables(config: Config) -> Dict[str, List]:
+    """Action schedules of a job, the tables set with set_boundary_table
+
+    Args:
+        config (Config): environment job config
+
+    Returns:
+        Dict[str, List]: [time, value] rows keyed by <field>.<boundary>
+    """
+    tables = {}
+    for mod in config.get('mods', []):
+        if mod['func'] == 'set_boundary_table':
+            params = mod['params']
+            tables['{:s}.{:s}'.format(params['field'], params['boundary'])
+                   ] = params['table']
+    return tables
+
+
+def table_at(table: List, times: np.ndarray) -> np.ndarray:
+    """Linearly interpolated values of an action table
+
+    Args:
+        table (List): [time, value] rows, values are scalars or vectors
+        times (np.ndarray): times to evaluate
+
+    Returns:
+        np.ndarray: values, [n_times, n_components]
+    """
+    table_times = np.array([row[0] for row in table], dtype=float)
+    values = np.array([np.ravel(row[1]) for row in table], dtype=float)
+    return np.stack([
+        np.interp(times, table_times, values[:, i])
+        for i in range(values.shape[1])
+    ],
+                    axis=1)
+
+
+def archive_jobs(
+    world_config: Config, env_id: int, seen: set = None
+) -> List[Dict]:
+    """Finished jobs of an environment that were run with OpenFOAM, from the
+    configs kept in the job folder and the records and outputs in the output
+    folder
+
+    Args:
+        world_config (Config): Initialized world configuration
+        env_id (int): Environment id
+        seen (set, optional): Config files to skip, files whose job is settled (archived or not archivable) are added to it. Defaults to None.
+
+    Returns:
+        List[Dict]: config, record and outputs (one per post function, None if missing) of each job, sorted by start time
+    """
+    jobs = []
+    if not os.path.exists(world_config['job_dir']):
+        return jobs
+
+    for filename in sorted(os.listdir(world_config['job_dir'])):
+        if not '.yml.old.' in filename or filename.endswith('.lock'):
+            continue
+        if not seen is None and filename in seen:
+            continue
+        with open(os.path.join(world_config['job_dir'], filename), 'r') as stream:
+            try:
+                config = yaml.safe_load(stream)
+            except yaml.YAMLError:
+                config = None
+        if not isinstance(config, dict) or config.get('id', None) != env_id \
+                or config['params'].get('backend', 'foam') != 'foam':
+            if not seen is None:
+                seen.add(filename)
+            continue
+
+        record_file = os.path.join(
+            world_config['output_dir'],
+            'output.{:s}.yml'.format(str(config['hash']))
+        )
+        if not os.path.exists(record_file):
+            continue
+        # Record is final once it exists
+        if not seen is None:
+            seen.add(filename)
+        with open(record_file, 'r') as stream:
+            record = yaml.safe_load(stream)
+        if record['status'] != 0 or record.get('state',
+                                               'completed') != 'completed':
+            continue
+
+        outputs = []
+        for post in config.get('post', []):
+            file_path = os.path.join(
+                world_config['output_dir'], output_name(post, config['hash'])
+            )
+            if os.path.exists(file_path):
+                outputs.append(np.load(file_path, allow_pickle=True)[()])
+            else:
+                outputs.append(None)
+        jobs.append({'config': config, 'record': record, 'outputs': outputs})
+
+    return sorted(jobs, key=lambda job: start_time(job['config']))
+
+
+def start_time(config: Config) -> float:
+    """Start time of a job, from the startTime its mods set
+
+    Args:
+        config (Config): environment job config
+
+    Returns:
+        float: start time, 0 if not set
+    """
+    for mod in config.get('mods', []):
+        if mod['func'] == 'set_control_dict' and 'startTime' in mod['params'
+                                                                    ]['props']:
+            return float(mod['params']['props']['startTime'])
+    return 0.
+
+
+def end_time(config: Config) -> Union[float, None]:
+    """End time of a job, from the endTime its mods set
+
+    Args:
+        config (Config): environment job config
+
+    Returns:
+        Union[float, None]: end time, None if not set
+    """
+    for mod in config.get('mods', []):
+        if mod['func'] == 'set_control_dict' and 'endTime' in mod['params'
+                                                                  ]['props']:
+            return float(mod['params']['props']['endTime'])
+    return None
+
+
+def _format_time(time_step: float) -> str:
+    """Time column of postProcessing files, without exponent
+
+    Args:
+        time_step (float): time
+
+    Returns:
+        str: formatted time
+    """
+    return np.format_float_positional(time_step, trim='-')
+
+
+def _format_nested(value) -> str:
+    """Formats a number or nested list of numbers with parentheses
+
+    Args:
+        value: number or nested list
+
+    Returns:
+        str: formatted value
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return '({:s})'.format(' '.join(_format_nested(v) for v in value))
+    return '{:.10g}'.format(float(value))
+
+
+def write_post(env_dir: str, post: Config, data: Dict) -> bool:
+    """Writes the output of a post function as the postProcessing file it
+    reads, so results of other backends go through the normal collector
+
+    Args:
+        env_dir (str): Path to OpenFOAM simulation folder
+        post (Config): post function config
+        data (Dict): output of the post function (times and data array)
+
+    Returns:
+        bool: Successful write
+    """
+    func, params = post['func'], post['params']
+    if not func in POST_KEYS:
+        logger.error('Post function {:s} can not be written.'.format(func))
+        return False
+
+    folder = os.path.join(
+        env_dir, 'postProcessing', params['function_name'],
+        '{:g}'.format(params['time_step'])
+    )
+    os.makedirs(folder, exist_ok=True)
+
+    values = np.asarray(data[POST_KEYS[func]])
+    lines = []
+    for time_step, row in zip(data['times'], values):
+        if func == 'get_coeff':
+            columns = ['{:.10g}'.format(v) for v in np.ravel(row)]
+        else:
+            columns = [_format_nested(v) for v in row]
+        lines.append(
+            '{:s}\t{:s}\n'.format(_format_time(time_step), '\t'.join(columns))
+        )
+
+    file_name = {
+        'get_forces': 'forces.dat',
+        'get_coeff': 'forceCoeffs.dat',
+        'get_probes': params.get('field', 'p')
+    }[func]
+    with open(os.path.join(folder, file_name), 'w') as file:
+        file.write('# Time\n')
+        file.writelines(lines)
+    return True
+
+
+class BackendRunner(object):
+    """Runner answering jobs without running OpenFOAM. Backends write the
+    postProcessing files of the job's post functions, which are collected
+    as usual.
+
+    Args:
+        config (Config): environment job config
+        foam_dir (str): directory path to OpenFOAM simulation
+        world_config (Config): Initialized world configuration
+    """
+    def __init__(
+        self, config: Config, foam_dir: str, world_config: Config
+    ) -> None:
+        """Constructor
+        """
+        self.config = config
+        self.dir = foam_dir
+        self.world_config = world_config
+        # Return code and log file of each stage, as for FOAMRunner
+        self.returncodes = {}
+        self.logs = []
+
+    def run(self) -> int:
+        """Answers the job
+
+        Returns:
+            int: return code, 0 on success
+        """
+        raise NotImplementedError("Run method of backend not overloaded")
@@ -1,13 +1,20 @@
 import os
-import re
 from distutils.dir_util import copy_tree
-from shutil import rmtree
+from fractions import Fraction
+from math import gcd
+from shutil import copytree, ignore_patterns, rmtree
 from typing import Dict, List, Tuple, Union
 
 import yaml
 
+from .casemeta import CaseMeta
+from .decomposition import DecompositionCache
+from .foam import FOAMRunner
+from .foamdict import DictTransaction
+from .foamfile import convert_case
 from .jlogger import getLogger
 from .mods import OpenFoamMods
+from .plans import ModPlan
 from .utils import clean_config, mkdirs
 
 logger = getLogger(__name__)
@@ -199,7 +206,14 @@ class WorldBuilder(object):
             )
 
     def build_world(self, world_config: Config) -> bool:
+        """Builds the world directory and its environments from the base files
 
+        Args:
+            world_config (Config): Configuration object of the world
+
+        Returns:
+            bool: World built without issues
+        """
         # Create world directory
         world_files = os.path.join(world_config['world_dir'], 'base_files')
         mkdirs(
@@ -213,6 +227,16 @@ class WorldBuilder(object):
             logger.info('Copying base files to local world folder.')
             copy_tree(world_config['base_files'], world_files, update=1)
 
+        # Optionally convert mesh and fields once so every environment starts
+        # from (and the solver writes) the requested format
+        if 'write_format' in world_config.keys():
+            fmt = world_config['write_format']
+            logger.info('Converting base files to {:s}.'.format(fmt))
+            converted = convert_case(world_files, fmt)
+            logger.info('Converted {:d} base files.'.format(converted))
+            OpenFoamMods.set_control_dict({'writeFormat': fmt},
+                                          env_dir=world_files)
+
         # Create each environment in the world
         cleared = 1
         for env in world_config['envs']:
@@ -240,17 +264,23 @@ class WorldBuilder(object):
                     )
 
             # Now run through modifications
-            for mod in env['mods']:
-                # Check mod is supported
-                if hasattr(OpenFoamMods, mod['func']):
-                    out = getattr(OpenFoamMods, mod['func']
-                                  )(**mod['params'], env_dir=env_dir)
-                    cleared = cleared * out
-                else:
-                    logger.error(
-                        'Function {:s} not supported.'.format(mod['func'])
-                    )
-                    cleared = 0
+            with DictTransaction():
+                for mod in env['mods']:
+                    # Check mod is supported
+                    if hasattr(OpenFoamMods, mod['func']):
+                        out = getattr(OpenFoamMods, mod['func']
+                                      )(**mod['params'], env_dir=env_dir)
+                        cleared = cleared * out
+                    else:
+                        logger.error(
+                            'Function {:s} not supported.'.
+                            format(mod['func'])
+                        )
+                        cleared = 0
+
+        # Decompose each mesh once for the environments to clone
+        if 'decompose_np' in world_config.keys():
+            self.cache_decompositions(world_config)
 
         if cleared:
             logger.info('Successfully set up environments.')
@@ -259,6 +289,51 @@ class WorldBuilder(object):
 
         return bool(cleared)
 
+    def cache_decompositions(self, world_config: Config) -> None:
+        """Decomposes each distinct mesh of the world's environments for
+        every number of processes in decompose_np and stores the processor
+        meshes in the world's decomposition cache
+
+        Args:
+            world_config (Config): Configuration object of the world
+        """
+        cache = DecompositionCache.of_world(world_config)
+        scratch = os.path.join(world_config['world_dir'], '.decomposing')
+        for env in world_config['envs']:
+            env_dir = os.path.join(world_config['world_dir'], env['name'])
+            for np in world_config['decompose_np']:
+                key = cache.key(env_dir, np)
+                if key is None or cache.has(key):
+                    continue
+
+                logger.info('Decomposing mesh {:s}.'.format(key))
+                if os.path.exists(scratch):
+                    rmtree(scratch)
+                copytree(
+                    env_dir,
+                    scratch,
+                    symlinks=True,
+                    ignore=ignore_patterns('processor*', 'logs', '.*')
+                )
+                config = {
+                    'hash': 'world',
+                    'params': {
+                        'solver': '',
+                        'np': np,
+                        'args': '',
+                        'decompose': True,
+                        'reconstruct': False
+                    }
+                }
+                runner = FOAMRunner(config, scratch, cache=cache)
+                if runner.decompose() != 0:
+                    logger.warning(
+                        'Failed to decompose mesh {:s}.'.format(key)
+                    )
+
+        if os.path.exists(scratch):
+            rmtree(scratch)
+
 
 class EnvironmentBuilder(object):
     """Builds environment for running
@@ -272,6 +347,8 @@ class EnvironmentBuilder(object):
         """
         self.config = self.parse_config(config_file_path)
         self.get_env_dir(world_config)
+        # Compiled mod plan, set when the config is validated
+        self.plan = None
 
     def parse_config(self, config_file_path: str) -> Config:
         """Parses the environment config file and returns a native python dictionary
@@ -316,6 +393,10 @@ class EnvironmentBuilder(object):
             if env['id'] == self.config['id']:
                 env_dir = os.path.join(world_config['world_dir'], env['name'])
                 self.env_dir = env_dir
+                # Folders the environment was built from, custom files first
+                self.base_dirs = [
+                    env[key] for key in ['env_files'] if key in env.keys()
+                ] + [os.path.join(world_config['world_dir'], 'base_files')]
 
         if self.env_dir is None:
             logger.error(
@@ -353,13 +434,10 @@ class EnvironmentBuilder(object):
                 )
                 return False
 
-        # Check mods
-        for mod in self.config['mods']:
-            if not hasattr(OpenFoamMods, mod['func']):
-                logger.error(
-                    'Mod {:s} not currently supported.'.format(mod['func'])
-                )
-                return False
+        # Compile mods, jobs of the same shape reuse the validated plan
+        self.plan = ModPlan.compile(self.config.get('mods', []))
+        if self.plan is None:
+            return False
 
         return True
 
@@ -369,12 +447,27 @@ class EnvironmentBuilder(object):
         Returns:
             bool: If setup was successful
         """
-        # Modify the environment files
-        mod = self.mod_env()
+        # Jobs using the serial case need the fields of the previous job
+        if self.runs_foam() and self.needs_serial(
+        ) and not self.reconstruct_start():
+            return False
+
+        # Modify the environment files, edits are flushed once per file
+        with DictTransaction() as transaction:
+            mod = self.mod_env()
+            # Only write the time-steps the clean policy keeps
+            plan = self.plan_writes()
+        # Files whose contents did not change are not rewritten
+        logger.add_stat(
+            'mod_files', {
+                'written': transaction.written,
+                'unchanged': transaction.unchanged
+            }
+        )
         # Validate environment
         valid = self.validate_env()
 
-        return (mod and valid)
+        return (mod and plan and valid)
 
     def mod_env(self) -> bool:
         """Setup the environment for simulation by updating 
@@ -385,21 +478,184 @@ class EnvironmentBuilder(object):
         if not 'mods' in self.config.keys():
             logger.info('No mods listed. Continuing.')
             return True
-        # Run each modification function for this environment
-        cleared = 1
-        for mod in self.config['mods']:
-            # Check mod is supported
-            if hasattr(OpenFoamMods, mod['func']):
-                out = getattr(OpenFoamMods, mod['func']
-                              )(**mod['params'], env_dir=self.env_dir)
-                cleared = cleared * out
-            else:
-                logger.error(
-                    'Function {:s} not supported.'.format(mod['func'])
-                )
-                cleared = 0
+        if self.plan is None:
+            self.plan = ModPlan.compile(self.config['mods'])
+            if self.plan is None:
+                return False
+        # Run each modification function for this environment. Mods are
+        # applied in memory and each edited file is written once at the end.
+        # Parallel mods only edit the serial case when needed
+        with DictTransaction():
+            return self.plan.apply(
+                self.config['mods'], self.env_dir, self.needs_serial()
+            )
 
-        return bool(cleared)
+    def runs_foam(self) -> bool:
+        """Checks if the job is run with OpenFOAM, other backends (see
+        params/backend) do not use the case fields
+
+        Returns:
+            bool: Job runs OpenFOAM
+        """
+        return self.config['params'].get('backend', 'foam') == 'foam'
+
+    def reconstruct_start(self) -> bool:
+        """Reconstructs the start time-step from the processor folders if
+        the serial case does not have it, e.g. after a parallel job that
+        left its fields decomposed
+
+        Returns:
+            bool: Serial start time-step is available
+        """
+        runner = FOAMRunner(self.config, self.env_dir)
+        returncode = runner.reconstruct(runner.get_start_timestep())
+        if returncode != 0:
+            logger.error(
+                'Failed to reconstruct start time-step, return code {:d}.'.
+                format(returncode)
+            )
+            return False
+        return True
+
+    def needs_serial(self) -> bool:
+        """Checks if mods must edit the serial case, which is the case when
+        the job runs on one process, forces decomposition or the processor
+        folders do not match the requested number of processes.
+
+        Returns:
+            bool: Serial case is used by the job
+        """
+        params = self.config['params']
+        if params['np'] == 1 or params['decompose']:
+            return True
+
+        collated = params.get('file_handler', None) == 'collated'
+        return CaseMeta.get(self.env_dir).n_procs(collated) != params['np']
+
+    def plan_writes(self) -> bool:
+        """Sets the solver write settings in the controlDict from the clean
+        policy of the job, such that only the time-steps that are kept by
+        set_saved_field_times (and the end time for restarting) are written.
+        The write interval is only ever made longer than the one of the
+        controlDict and purgeWrite is left as is. Can be disabled with
+        params/write_plan.
+
+        Returns:
+            bool: Successful modification
+        """
+        if not self.config['params'].get('write_plan', True):
+            return True
+
+        cleans = [
+            clean for clean in self.config.get('clean', [])
+            if clean['func'] == 'set_saved_field_times'
+        ]
+        if len(cleans) == 0:
+            return True
+
+        runner = FOAMRunner(self.config, self.env_dir)
+        try:
+            # Macros ($dt) or #calc entries can not be planned
+            start_time = Fraction(str(runner.get_start_timestep()))
+            end_time = Fraction(str(runner.get_end_timestep()))
+            delta_t = Fraction(str(runner.get_control_prop('deltaT')))
+            # Interval the environment was built with, in simulation time.
+            # Earlier plans changed the one of the environment
+            base = CaseMeta.get(self.env_dir)
+            for base_dir in self.base_dirs:
+                if os.path.exists(
+                    os.path.join(base_dir, 'system', 'controlDict')
+                ):
+                    base = CaseMeta.get(base_dir)
+                    break
+            original = {
+                'writeControl': base.control_prop('writeControl'),
+                'writeInterval': base.control_prop('writeInterval')
+            }
+            write_control = original['writeControl']
+            current = Fraction(str(original['writeInterval']))
+            if write_control == 'timeStep':
+                current = current * delta_t
+            elif not write_control in ['runTime', 'adjustableRunTime']:
+                raise ValueError(write_control)
+        except (ValueError, TypeError):
+            logger.warning('Could not plan solver writes, using controlDict.')
+            return True
+        if end_time <= start_time or delta_t <= 0:
+            logger.warning('Could not plan solver writes, using controlDict.')
+            return True
+
+        # Time-steps in the simulation window that survive every clean
+        keep = None
+        for clean in cleans:
+            interval = Fraction(str(clean['params']['save_interval']))
+            times = set()
+            k = start_time // interval + 1
+            while k * interval <= end_time:
+                times.add(k * interval)
+                k += 1
+            save_times = clean['params'].get('save_times')
+            if not save_times is None:
+                for time in save_times:
+                    time = Fraction(str(time))
+                    if start_time < time <= end_time:
+                        times.add(time)
+            keep = times if keep is None else keep.intersection(times)
+        keep.add(end_time)
+
+        # Largest write interval hitting every kept time-step
+        offsets = [time - start_time for time in keep]
+        denom = 1
+        for offset in offsets:
+            denom = denom * offset.denominator // gcd(
+                denom, offset.denominator
+            )
+        numer = 0
+        for offset in offsets:
+            numer = gcd(numer, int(offset * denom))
+        interval = Fraction(numer, denom)
+        if interval <= current:
+            # Kept time-steps are not on a common longer interval, writing
+            # more often than the case asks for would only add I/O
+            logger.info(
+                'Kept time-steps need write interval {:g}, keeping {:g}.'.
+                format(float(interval), float(current))
+            )
+            return OpenFoamMods.set_control_dict(
+                original, env_dir=self.env_dir
+            )
+        writes = int((end_time - start_time) / interval)
+
+        adjustable = runner.get_control_prop('adjustTimeStep')
+        if adjustable in ['yes', 'on', 'true']:
+            props = {
+                'writeControl': 'adjustableRunTime',
+                'writeInterval': '{:g}'.format(float(interval))
+            }
+        elif (interval / delta_t).denominator == 1:
+            props = {
+                'writeControl': 'timeStep',
+                'writeInterval': int(interval / delta_t)
+            }
+        else:
+            props = {
+                'writeControl': 'runTime',
+                'writeInterval': '{:g}'.format(float(interval))
+            }
+
+        logger.info(
+            'Planned {:d} solver writes with {:s} interval {}.'.format(
+                writes, props['writeControl'], props['writeInterval']
+            )
+        )
+        logger.add_stat(
+            'write_plan', {
+                'writes': writes,
+                'writeControl': props['writeControl'],
+                'writeInterval': props['writeInterval']
+            }
+        )
+        return OpenFoamMods.set_control_dict(props, env_dir=self.env_dir)
 
     def validate_env(self) -> bool:
         """Runs validation checks of the environment folder
@@ -407,35 +663,18 @@ class EnvironmentBuilder(object):
         Returns:
             bool: Validation successful
         """
-        control_file = os.path.join(self.env_dir, 'system', 'controlDict')
-
-        if not os.path.exists(control_file):
-            logger.error('Could not find controlDict file to edit.')
+        meta = CaseMeta.get(self.env_dir)
+        if meta.control is None:
             return False
 
-        # Read in lines
-        with open(control_file, 'r') as file:
-            lines = file.readlines()
-
-        # Get start time
-        for line in lines:
-            if line.lstrip().startswith("startTime"):
-                start_time = float(re.findall(r'\d*\.?\d+', line)[0])
-                break
-
-        # Make sure start time folders exist
-        # Parallel
-        parallel = True
-        for i in range(self.config['params']['np']):
-            proc_folder = os.path.join(
-                self.env_dir, 'processor{:d}'.format(i),
-                '{:g}'.format(start_time)
-            )
-            if not os.path.exists(proc_folder):
-                parallel = False
-        # Serial
-        field_dir = os.path.join(self.env_dir, "{:g}".format(start_time))
-        if not os.path.exists(field_dir) and not parallel:
+        # Make sure start time folders exist, decomposed or serial
+        start_time = meta.start_time
+        parallel = meta.decomposed_at(
+            start_time, self.config['params']['np'],
+            self.config['params'].get('file_handler', None) == 'collated'
+        )
+        if not meta.has_time(start_time) and not parallel and self.runs_foam(
+        ):
             logger.error('Starting time-step fields do not exist.')
 
         return True
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import threading
+from typing import List, Union
+
+from .foamdict import FoamDict, read_dict
+from .jlogger import getLogger
+from .utils import get_collated_folders, get_proc_folders, get_time_folders
+
+logger = getLogger(__name__)
+
+# Files defining a mesh, with or without compression
+MESH_FILES = ['points', 'faces', 'owner', 'neighbour', 'boundary']
+
+# Shared metadata of each case folder, keyed by path
+_CASES = {}
+_CASES_LOCK = threading.Lock()
+
+
+class CaseMeta(object):
+    """Metadata of an OpenFOAM case: control times, time-step folders and
+    processor layout. Every value is cached and invalidated by the
+    modification time of the file or folder it is read from, so the setup,
+    run and clean stages of a job share a single scan of the case. Use
+    CaseMeta.get to obtain the shared instance of a case.
+
+    Args:
+        case_dir (str): path to OpenFOAM case
+    """
+    def __init__(self, case_dir: str) -> None:
+        """Constructor
+        """
+        self.dir = case_dir
+        self.control_file = os.path.join(case_dir, 'system', 'controlDict')
+        # Cached listings keyed by path, stored with the folder mtime
+        self._listings = {}
+        # Mesh hash stored with the stat of the mesh files it was read from
+        self._mesh = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, case_dir: str) -> 'CaseMeta':
+        """Gets the shared metadata of a case
+
+        Args:
+            case_dir (str): path to OpenFOAM case
+
+        Returns:
+            CaseMeta: case metadata
+        """
+        case_dir = os.path.normpath(case_dir)
+        with _CASES_LOCK:
+            if not case_dir in _CASES:
+                _CASES[case_dir] = cls(case_dir)
+            return _CASES[case_dir]
+
+    def _listing(self, key: str, path: str, scan) -> List[str]:
+        """Cached result of scanning a folder, rescanned when it changes
+
+        Args:
+            key (str): name of the listing
+            path (str): folder that is scanned
+            scan (Callable): function listing the folder
+
+        Returns:
+            List[str]: listing
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        with self._lock:
+            cached = self._listings.get((key, path), None)
+            if not cached is None and cached[0] == mtime:
+                return list(cached[1])
+
+        listing = scan(path)
+        with self._lock:
+            self._listings[(key, path)] = (mtime, listing)
+        return list(listing)
+
+    @property
+    def control(self) -> Union[FoamDict, None]:
+        """Parsed controlDict, None if not found
+        """
+        if not os.path.exists(self.control_file):
+            logger.error('Could not find controlDict file to read.')
+            return None
+        # Parses are cached until the file changes
+        return read_dict(self.control_file)
+
+    def control_prop(self, prop: str) -> Union[str, None]:
+        """Raw value of a top level entry in the controlDict
+
+        Args:
+            prop (str): Name of the entry
+
+        Returns:
+            Union[str, None]: Value of the entry, None if not found
+        """
+        control = self.control
+        if control is None:
+            return None
+        value = control.get(prop)
+        if isinstance(value, FoamDict):
+            return None
+        return value
+
+    @property
+    def start_time(self) -> float:
+        """Start time of the simulation
+        """
+        return float(self.control_prop('startTime') or 0)
+
+    @property
+    def end_time(self) -> float:
+        """End time of the simulation
+        """
+        return float(self.control_prop('endTime') or 0)
+
+    @property
+    def mesh_hash(self) -> Union[str, None]:
+        """Hash of the mesh in constant/polyMesh, shared by every case with
+        the same mesh. None if the case has no mesh.
+        """
+        mesh_dir = os.path.join(self.dir, 'constant', 'polyMesh')
+        if not os.path.isdir(mesh_dir):
+            return None
+
+        files = sorted(
+            f for f in os.listdir(mesh_dir)
+            if f.split('.')[0] in MESH_FILES
+            and os.path.isfile(os.path.join(mesh_dir, f))
+        )
+        key = []
+        for f in files:
+            stat = os.stat(os.path.join(mesh_dir, f))
+            key.append((f, stat.st_mtime_ns, stat.st_size))
+
+        with self._lock:
+            if not self._mesh is None and self._mesh[0] == key:
+                return self._mesh[1]
+
+        digest = hashlib.sha1()
+        for f in files:
+            digest.update(f.encode())
+            with open(os.path.join(mesh_dir, f), 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(chunk)
+        mesh_hash = digest.hexdigest()
+        with self._lock:
+            self._mesh = (key, mesh_hash)
+        return mesh_hash
+
+    def time_folders(self, case_dir: str = None) -> List[str]:
+        """Time-step folders sorted by numeric value
+
+        Args:
+            case_dir (str, optional): case or processor folder. Defaults to the case.
+
+        Returns:
+            List[str]: time-step folder names
+        """
+        case_dir = self.dir if case_dir is None else case_dir
+        return self._listing('times', case_dir, get_time_folders)
+
+    @property
+    def proc_folders(self) -> List[str]:
+        """Paths of the processorN folders sorted by processor index
+        """
+        return self._listing('procs', self.dir, get_proc_folders)
+
+    @property
+    def collated_folders(self) -> List[str]:
+        """Paths of the collated processors<N> folders
+        """
+        return self._listing('collated', self.dir, get_collated_folders)
+
+    def n_procs(self, collated: bool = False) -> int:
+        """Number of processors the case is currently decomposed for
+
+        Args:
+            collated (bool, optional): collated file handler. Defaults to False.
+
+        Returns:
+            int: number of processors, 0 if not decomposed
+        """
+        if collated:
+            folders = self.collated_folders
+            if len(folders) != 1:
+                return 0
+            return int(os.path.basename(folders[0])[len('processors'):])
+        return len(self.proc_folders)
+
+    def has_time(self, time_step: float, case_dir: str = None) -> bool:
+        """Checks if a time-step folder exists
+
+        Args:
+            time_step (float): time-step
+            case_dir (str, optional): case or processor folder. Defaults to the case.
+
+        Returns:
+            bool: time-step folder exists
+        """
+        return '{:g}'.format(time_step) in self.time_folders(case_dir)
+
+    def decomposed_at(
+        self, time_step: float, np: int, collated: bool = False
+    ) -> bool:
+        """Checks if the case is decomposed for np processors with the given
+        time-step present in every processor folder
+
+        Args:
+            time_step (float): time-step
+            np (int): number of processors
+            collated (bool, optional): collated file handler. Defaults to False.
+
+        Returns:
+            bool: decomposed time-step exists
+        """
+        if self.n_procs(collated) != np:
+            return False
+
+        if collated:
+            return self.has_time(time_step, self.collated_folders[0])
+
+        for proc_folder in self.proc_folders:
+            if not self.has_time(time_step, proc_folder):
+                return False
+        return True
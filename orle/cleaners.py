@@ -1,9 +1,7 @@
 from typing import Dict, List, Tuple, Union
 
-import numpy as np
-
 from .jlogger import getLogger
-from .mods import OpenFoamMods
+from .plans import ModPlan
 
 logger = getLogger(__name__)
 
@@ -37,18 +35,9 @@ class EnvironmentCleaner(object):
         if not 'clean' in self.config.keys():
             logger.info('No cleaning methods listed. Continuing.')
             return True
-        # Loop through each post processing function
-        cleared = 1
-        for clean in self.config['clean']:
-            # Check mod is supported
-            if hasattr(OpenFoamMods, clean['func']):
-                out = getattr(OpenFoamMods, clean['func']
-                              )(**clean['params'], env_dir=self.dir)
-                cleared = cleared * out
-            else:
-                logger.error(
-                    'Function {:s} not supported.'.format(clean['func'])
-                )
-                cleared = 0
-
-        return bool(cleared)
+        # Cleaning functions are mods, compiled once per job shape
+        plan = ModPlan.compile(self.config['clean'])
+        if plan is None:
+            return False
+        # Reconstructed fields live in the serial case, always clean it
+        return plan.apply(self.config['clean'], self.dir, serial=True)
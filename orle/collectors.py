@@ -1,10 +1,11 @@
 import os
-from typing import Dict, List, Tuple, Union
+from typing import Callable, Dict, List, Tuple, Union
 
 import numpy as np
 
+from .backends import output_name
 from .jlogger import getLogger
-from .post import FILE_NAMES, OpenFoamPost
+from .post import OpenFoamPost
 
 logger = getLogger(__name__)
 
@@ -18,13 +19,21 @@ class EnvironmentCollector(object):
     Args:
         config (Config): environment job config
         foam_dir (str): directory path to OpenFOAM simulation
+        reconstruct (Callable, optional): reconstructs serial fields of a time-step, see FOAMRunner.reconstruct. Defaults to None.
     """
-    def __init__(self, config: Config, foam_dir: str, output_dir: str) -> None:
+    def __init__(
+        self,
+        config: Config,
+        foam_dir: str,
+        output_dir: str,
+        reconstruct: Callable[[float, List[str]], int] = None
+    ) -> None:
         """Constructor
         """
         self.config = config
         self.dir = foam_dir
         self.output_dir = output_dir
+        self.reconstruct = reconstruct
 
     def collect(self, ) -> bool:
         """Collect post processing data
@@ -40,18 +49,18 @@ class EnvironmentCollector(object):
         for post in self.config['post']:
             # Check mod is supported
             if hasattr(OpenFoamPost, post['func']):
+                # Reconstruct the serial fields the function reads
+                serial_fields = getattr(
+                    getattr(OpenFoamPost, post['func']), 'serial_fields', None
+                )
+                if not self.reconstruct is None and not serial_fields is None:
+                    time_step, fields = serial_fields(post['params'])
+                    self.reconstruct(time_step, fields)
                 out = getattr(OpenFoamPost, post['func']
                               )(**post['params'], env_dir=self.dir)
                 cleared = cleared * (not out is None)
 
-                if 'outputname' in post.keys():
-                    file_name = post['outputname'] + '.' + str(
-                        self.config['hash']
-                    ) + '.npy'
-                else:
-                    file_name = FILE_NAMES[post['func']] + '.' + str(
-                        self.config['hash']
-                    ) + '.npy'
+                file_name = output_name(post, self.config['hash'])
                 file_path = os.path.join(self.output_dir, file_name)
                 if os.path.exists(file_path):
                     logger.warning(
@@ -0,0 +1,155 @@
+import os
+import uuid
+from shutil import copytree, rmtree
+from typing import Dict, List, Tuple, Union
+
+from .casemeta import CaseMeta
+from .foamdict import read_dict
+from .jlogger import getLogger
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Folder of the world holding the decomposed meshes
+CACHE_DIR = 'decomposed'
+
+
+class DecompositionCache(object):
+    """Decomposed meshes of a world, keyed by mesh hash, number of
+    subdomains and decomposition method. Each entry holds the constant
+    folder (processor mesh and addressing) of every processor folder, so a
+    case with the same mesh gets its processor folders by copying them and
+    only maps its fields with decomposePar -fields instead of partitioning
+    the mesh again.
+
+    Args:
+        cache_dir (str): Path to cache folder
+    """
+    def __init__(self, cache_dir: str) -> None:
+        """Constructor
+        """
+        self.dir = cache_dir
+
+    @classmethod
+    def of_world(cls, world_config: Config) -> 'DecompositionCache':
+        """Decomposition cache of a world, in <world_dir>/decomposed
+
+        Args:
+            world_config (Config): Initialized world configuration
+
+        Returns:
+            DecompositionCache: decomposition cache
+        """
+        return cls(os.path.join(world_config['world_dir'], CACHE_DIR))
+
+    def key(self, case_dir: str, np: int,
+            collated: bool = False) -> Union[str, None]:
+        """Key of the decomposition of a case with its current
+        decomposeParDict method
+
+        Args:
+            case_dir (str): Path to OpenFOAM case
+            np (int): Number of subdomains
+            collated (bool, optional): collated file handler. Defaults to False.
+
+        Returns:
+            Union[str, None]: <mesh hash>.<np>.<method>, None if the case has no mesh
+        """
+        mesh_hash = CaseMeta.get(case_dir).mesh_hash
+        if mesh_hash is None:
+            return None
+
+        method = 'scotch'
+        decompose_file = os.path.join(case_dir, 'system', 'decomposeParDict')
+        if os.path.exists(decompose_file):
+            method = str(read_dict(decompose_file).get('method', method))
+
+        key = '{:s}.{:d}.{:s}'.format(mesh_hash, np, method)
+        if collated:
+            key += '.collated'
+        return key
+
+    def has(self, key: str) -> bool:
+        """Checks if a decomposition is cached
+
+        Args:
+            key (str): Key of the decomposition
+
+        Returns:
+            bool: decomposition is cached
+        """
+        return not key is None and os.path.isdir(os.path.join(self.dir, key))
+
+    def store(self, key: str, case_dir: str, collated: bool = False) -> bool:
+        """Adds the processor meshes of a decomposed case to the cache. The
+        entry is built in a temporary folder and renamed, so other processes
+        never see a partial entry.
+
+        Args:
+            key (str): Key of the decomposition
+            case_dir (str): Path to decomposed OpenFOAM case
+            collated (bool, optional): collated file handler. Defaults to False.
+
+        Returns:
+            bool: decomposition was stored
+        """
+        if key is None or self.has(key):
+            return False
+
+        meta = CaseMeta.get(case_dir)
+        folders = meta.collated_folders if collated else meta.proc_folders
+        if len(folders) == 0:
+            return False
+
+        os.makedirs(self.dir, exist_ok=True)
+        tmp_dir = os.path.join(
+            self.dir, '.{:s}.{:s}'.format(key,
+                                          uuid.uuid4().hex[:8])
+        )
+        try:
+            for folder in folders:
+                copytree(
+                    os.path.join(folder, 'constant'),
+                    os.path.join(tmp_dir, os.path.basename(folder), 'constant'),
+                    symlinks=True
+                )
+            os.rename(tmp_dir, os.path.join(self.dir, key))
+        except OSError as e:
+            # Another process may have stored the same decomposition
+            if os.path.exists(tmp_dir):
+                rmtree(tmp_dir, ignore_errors=True)
+            if not self.has(key):
+                logger.warning(
+                    'Failed to cache decomposition {:s}: {}'.format(key, e)
+                )
+            return False
+
+        logger.info('Cached decomposition {:s}.'.format(key))
+        return True
+
+    def clone(self, key: str, case_dir: str) -> bool:
+        """Copies the processor meshes of a cached decomposition into a case
+        without processor folders
+
+        Args:
+            key (str): Key of the decomposition
+            case_dir (str): Path to OpenFOAM case
+
+        Returns:
+            bool: processor folders were created
+        """
+        entry_dir = os.path.join(self.dir, key)
+        try:
+            for folder in sorted(os.listdir(entry_dir)):
+                copytree(
+                    os.path.join(entry_dir, folder),
+                    os.path.join(case_dir, folder),
+                    symlinks=True
+                )
+        except OSError as e:
+            logger.warning(
+                'Failed to clone decomposition {:s}: {}'.format(key, e)
+            )
+            return False
+        return True
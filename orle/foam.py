@@ -1,15 +1,71 @@
+import gzip
+import json
 import os
-import re
+import shlex
+import signal
+import subprocess
+import threading
 import time
-from typing import Dict, List, Tuple, Union
+from collections import deque
+from typing import BinaryIO, Callable, Dict, List, Tuple, Union
 
+from .affinity import binding_args
+from .casemeta import CaseMeta
+from .foamdict import read_dict, write_dict
 from .jlogger import getLogger
 from .mods import OpenFoamMods
+from .pruners import get_reaper, move_to_trash
+from .utils import split_domains
 
 logger = getLogger(__name__)
 
 Config = Union[Dict, List, Tuple]
 
+# Seconds between checks of the job watch while a command runs
+WATCH_INTERVAL = 0.5
+# Return code of commands skipped or killed because the job was stopped
+STOPPED = -1
+# Bytes kept from the start and end of each command log
+LOG_HEAD = 64 * 1024
+LOG_TAIL = 256 * 1024
+# Record of the serial fields reconstructed from the processor folders
+RECONSTRUCT_RECORD = '.orle.reconstructed'
+
+# Environment OpenFOAM commands run with, keyed by the sourced bashrc
+_FOAM_ENVS = {}
+_FOAM_ENVS_LOCK = threading.Lock()
+
+
+def foam_env(bashrc: str = None) -> Dict[str, str]:
+    """Environment variables of OpenFOAM. If a bashrc is given (or set with
+    ORLE_FOAM_BASHRC) it is sourced once and the resulting environment is
+    reused by every command, otherwise the environment of this process is
+    used as is.
+
+    Args:
+        bashrc (str, optional): OpenFOAM bashrc to source. Defaults to None.
+
+    Returns:
+        Dict[str, str]: environment variables
+    """
+    if bashrc is None:
+        bashrc = os.environ.get('ORLE_FOAM_BASHRC', None)
+    if bashrc is None:
+        return dict(os.environ)
+
+    with _FOAM_ENVS_LOCK:
+        if not bashrc in _FOAM_ENVS:
+            logger.info('Capturing OpenFOAM environment from {:s}.'.format(bashrc))
+            output = subprocess.run(
+                ['bash', '-c', 'source "$0" > /dev/null 2>&1; env -0', bashrc],
+                stdout=subprocess.PIPE,
+                check=True
+            ).stdout.decode()
+            _FOAM_ENVS[bashrc] = dict(
+                line.split('=', 1) for line in output.split('\0') if '=' in line
+            )
+        return dict(_FOAM_ENVS[bashrc])
+
 
 class FOAMRunner(object):
     """Interfaces with OpenFOAM library
@@ -17,22 +73,188 @@ class FOAMRunner(object):
     Args:
         config (Config): environment job config
         foam_dir (str): directory path to OpenFOAM simulation
+        watch (Callable, optional): returns a reason to stop the job (e.g. timeout) or None. Defaults to None.
+        cache (DecompositionCache, optional): decomposed meshes of the world. Defaults to None.
     """
-    def __init__(self, config: Config, foam_dir: str) -> None:
+    def __init__(
+        self,
+        config: Config,
+        foam_dir: str,
+        watch: Callable[[], Union[str, None]] = None,
+        cache=None
+    ) -> None:
         """Constructor
         """
         self.config = config
         self.dir = foam_dir
+        self.watch = watch
+        self.cache = cache
+        # Reason the job was stopped, later commands are skipped
+        self.stopped = None
+        # Case metadata shared with the other stages of the job
+        self.meta = CaseMeta.get(foam_dir)
+        # Running command, the return code and log file of each stage
+        self.process = None
+        self.returncodes = {}
+        self.logs = []
+        # CPUs the solver is pinned to, None to leave placement to the OS
+        self.cpus = None
+
+    @property
+    def collated(self) -> bool:
+        """If the job uses OpenFOAM's collated file handler
+        """
+        return self.config['params'].get('file_handler', None) == 'collated'
+
+    def handler_args(self) -> List[str]:
+        """File handler arguments passed to OpenFOAM utilities
 
-    def decompose(self, force: bool = False) -> None:
+        Returns:
+            List[str]: command line arguments
+        """
+        if self.collated:
+            return ['-fileHandler', 'collated']
+        return []
+
+    def execute(self, stage: str, cmd: List[str]) -> int:
+        """Runs an OpenFOAM command in the case folder. The command runs in
+        its own process group without a shell and the working directory of
+        this process is left untouched.
+
+        Args:
+            stage (str): name of the stage (e.g. decompose, solve)
+            cmd (List[str]): command and arguments
+
+        Returns:
+            int: return code of the command, STOPPED if the job was stopped
+        """
+        if not self.stopped is None:
+            self.returncodes[stage] = STOPPED
+            return STOPPED
+
+        capture = None
+        try:
+            self.process, capture = self.spawn(stage, cmd)
+            returncode = None
+            while returncode is None:
+                try:
+                    returncode = self.process.wait(timeout=WATCH_INTERVAL)
+                except subprocess.TimeoutExpired:
+                    reason = None if self.watch is None else self.watch()
+                    if not reason is None:
+                        logger.warning(
+                            'Stopping {:s}, job {:s}.'.format(cmd[0], reason)
+                        )
+                        self.stopped = reason
+                        self.kill()
+                        self.process.wait()
+                        returncode = STOPPED
+        except OSError as e:
+            logger.error('Failed to start {:s}: {}'.format(cmd[0], e))
+            returncode = 127
+        finally:
+            self.process = None
+            if not capture is None:
+                self.logs.append(capture.finish())
+
+        self.returncodes[stage] = returncode
+        if not returncode in [0, STOPPED]:
+            logger.warning(
+                '{:s} exited with return code {:d}.'.format(cmd[0], returncode)
+            )
+        return returncode
+
+    def spawn(self, stage: str,
+              cmd: List[str]) -> Tuple[subprocess.Popen, 'LogCapture']:
+        """Starts an OpenFOAM command in the case folder in its own process
+        group, with its output streamed to the log of the stage
+
+        Args:
+            stage (str): name of the stage (e.g. decompose, solve)
+            cmd (List[str]): command and arguments
+
+        Raises:
+            OSError: If the command could not be started
+
+        Returns:
+            Tuple[subprocess.Popen, LogCapture]: process and its log capture
+        """
+        logger.info('Running {:s}.'.format(' '.join(cmd)))
+        process = subprocess.Popen(
+            cmd,
+            cwd=self.dir,
+            env=foam_env(self.config['params'].get('foam_bashrc', None)),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+        capture = LogCapture(
+            process.stdout, self.log_path(stage),
+            self.config['params'].get('log_head', LOG_HEAD),
+            self.config['params'].get('log_tail', LOG_TAIL)
+        )
+        capture.start()
+
+        # mpirun binds its ranks itself, other commands are pinned here
+        if not self.cpus is None and cmd[0] != 'mpirun':
+            try:
+                os.sched_setaffinity(process.pid, self.cpus)
+            except OSError as e:
+                logger.warning('Failed to pin {:s}: {}'.format(cmd[0], e))
+        return process, capture
+
+    def log_path(self, stage: str) -> str:
+        """Path of the log of a stage, <env>/logs/<hash>.<stage>.log with a
+        counter for stages that run more than once (e.g. restarts)
+
+        Args:
+            stage (str): name of the stage
+
+        Returns:
+            str: path to log file
+        """
+        log_dir = os.path.join(self.dir, 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        name = '{:s}.{:s}'.format(str(self.config.get('hash', 'job')), stage)
+        runs = sum(
+            1 for log in self.logs
+            if os.path.basename(log).startswith(name + '.')
+        )
+        if runs > 0:
+            name = '{:s}.{:d}'.format(name, runs)
+        return os.path.join(log_dir, name + '.log')
+
+    def kill(self, grace: float = 5.) -> None:
+        """Stops the running command and all processes of its group (e.g.
+        every MPI rank)
+
+        Args:
+            grace (float, optional): Seconds to wait after SIGTERM before SIGKILL. Defaults to 5.
+        """
+        process = self.process
+        if process is None or not process.poll() is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            try:
+                process.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def decompose(self, force: bool = False) -> int:
         """Decomposes fluid simulation domain into sub folders
 
         Args:
             force (bool, Optional) Force domain decompose. Defaults to False.
+
+        Returns:
+            int: return code of decomposePar, 0 if not needed
         """
         if self.config['params']['np'] == 1:
             logger.warning('Using only 1 process, no need to decompose.')
-            return
+            return 0
 
         # First get the start time from control dict
         start_time = self.get_start_timestep()
@@ -46,50 +268,122 @@ class FOAMRunner(object):
             logger.warning(
                 'Failed to successfully modify the decomposeParDict.'
             )
+        # Processor folders of another method are decomposed again
+        method = self.config['params'].get('decompose_method', None)
+        if not method is None and self.set_decompose_method(method):
+            force = True
 
         # Validate the existing processor folders
-        proc_folders = [os.path.join(self.dir, f) for f in os.listdir(self.dir) \
-                         if f.startswith('processor') and os.path.isdir(os.path.join(self.dir, f))]
-
-        folders = True
-        if not len(proc_folders) == self.config['params']['np']:
+        folders = self.meta.decomposed_at(
+            start_time, self.config['params']['np'], self.collated
+        )
+        if not folders:
             logger.warning(
-                'Inconsistent number of processor folders found, forcing decomposePar.'
+                'Processor folders missing or inconsistent with start time {:g}, forcing decomposePar.'
+                .format(start_time)
             )
-            folders = False
-        else:
-            # If consistent processor folders, check each for initial time-step folder
-            for i in range(self.config['params']['np']):
-                proc_folder = os.path.join(
-                    self.dir, 'processor{:d}'.format(i),
-                    '{:g}'.format(start_time)
-                )
-                if not os.path.exists(proc_folder):
-                    logger.warning(
-                        'Necessary process folder {:s} not found, forcing decomposePar.'
-                        .format(proc_folder)
-                    )
-                    folders = False
-                    break
 
         if not folders or self.config['params']['decompose'] or force:
             logger.warning('Decomposing domain.')
-            # Run openfoam command
-            owd = os.getcwd()
-            os.chdir(self.dir)
-            os.system("decomposePar -force -time '0, {:g}'".format(start_time))
-            os.chdir(owd)
+            # Cached processor meshes only need the fields mapped
+            key = None
+            returncode = None
+            if not self.cache is None:
+                key = self.cache.key(
+                    self.dir, self.config['params']['np'], self.collated
+                )
+                if self.cache.has(key):
+                    returncode = self.decompose_fields(key, start_time)
+                logger.add_stat('decompose_cache', returncode == 0)
+
+            if returncode != 0:
+                # Run openfoam command
+                returncode = self.execute(
+                    'decompose', [
+                        'decomposePar', '-force', '-time',
+                        '0, {:g}'.format(start_time)
+                    ] + self.handler_args()
+                )
+                if returncode == 0 and not self.cache is None:
+                    self.cache.store(key, self.dir, self.collated)
 
             time.sleep(0.1)
+            return returncode
+
+        return 0
+
+    def decompose_fields(self, key: str,
+                         start_time: float) -> Union[int, None]:
+        """Replaces the processor folders with a cached decomposition and
+        maps the fields onto it
+
+        Args:
+            key (str): Key of the cached decomposition
+            start_time (float): start time of the simulation
+
+        Returns:
+            Union[int, None]: return code of decomposePar, None if the cache could not be used
+        """
+        names = [
+            os.path.basename(folder)
+            for folder in self.meta.proc_folders + self.meta.collated_folders
+        ]
+        if len(names) > 0:
+            get_reaper().reap(move_to_trash(self.dir, names))
+        if not self.cache.clone(key, self.dir):
+            return None
+
+        logger.info('Using cached decomposition {:s}.'.format(key))
+        return self.execute(
+            'decompose', [
+                'decomposePar', '-fields', '-time',
+                '0, {:g}'.format(start_time)
+            ] + self.handler_args()
+        )
 
-    def run(self, ) -> None:
+    def set_decompose_method(self, method: str) -> bool:
+        """Sets the decomposition method, with an even split of the
+        subdomains for the simple and hierarchical methods
+
+        Args:
+            method (str): decomposition method (e.g. scotch, simple)
+
+        Returns:
+            bool: method changed
+        """
+        decompose_file = os.path.join(self.dir, 'system', 'decomposeParDict')
+        if not os.path.exists(decompose_file):
+            return False
+
+        decompose = read_dict(decompose_file)
+        changed = decompose.get('method') != method
+        decompose['method'] = method
+        if method in ['simple', 'hierarchical']:
+            decompose.set([method + 'Coeffs', 'n'], '({:d} {:d} {:d})'.format(
+                *split_domains(self.config['params']['np'])
+            ))
+        write_dict(decompose_file, decompose)
+        return changed
+
+    def run(self, ) -> int:
         """Runs the OpenFOAM simulation
+
+        Returns:
+            int: return code of the solver
         """
         # Set the control application field for consistency
         OpenFoamMods.set_control_dict(
             {'application': self.config['params']['solver']}, env_dir=self.dir
         )
 
+        return self.execute('solve', self.solver_cmd())
+
+    def solver_cmd(self) -> List[str]:
+        """Command running the solver, on a single thread or with mpirun
+
+        Returns:
+            List[str]: command and arguments
+        """
         # Single core
         if self.config['params']['np'] == 1:
             logger.warning(
@@ -97,73 +391,290 @@ class FOAMRunner(object):
                     self.config['params']['solver']
                 )
             )
-            owd = os.getcwd()
-            os.chdir(self.dir)
-            os.system(
-                "{:s} {:s}".format(
-                    self.config['params']['solver'],
-                    self.config['params']['args']
-                )
+            return [self.config['params']['solver']] + shlex.split(
+                self.config['params']['args']
             )
-            os.chdir(owd)
 
         # Parallel
-        else:
+        logger.warning(
+            'Running {:s} in parallel.'.format(self.config['params']['solver'])
+        )
+        cmd = ['mpirun']
+        if not self.cpus is None:
+            cmd += binding_args(self.cpus)
+        return cmd + [
+            '-np',
+            str(self.config['params']['np']), self.config['params']['solver'],
+            '-parallel'
+        ] + shlex.split(self.config['params']['args']) + self.handler_args()
+
+    def solve(
+        self,
+        retries: int = 0,
+        backoff: float = 5.,
+        returncode: int = None
+    ) -> int:
+        """Runs the OpenFOAM simulation and restarts it from the latest
+        complete time-step if it fails or leaves incomplete output, so only
+        the missing part of the time window is recomputed
+
+        Args:
+            retries (int, optional): Maximum number of restarts. Defaults to 0.
+            backoff (float, optional): Seconds to wait before the first restart, doubled for each later one. Defaults to 5.
+            returncode (int, optional): Return code of a run that already happened (e.g. a batch), only restarts are run. Defaults to None.
+
+        Returns:
+            int: return code of the last solver run
+        """
+        if returncode is None:
+            returncode = self.run()
+        start_from = self.get_control_prop('startFrom')
+        attempts = []
+        for attempt in range(retries):
+            if not self.stopped is None or (
+                returncode == 0 and self.is_complete()
+            ):
+                break
+
+            checkpoint = self.latest_checkpoint()
+            if checkpoint is None:
+                logger.warning('No complete time-step to restart from.')
+                break
             logger.warning(
-                'Running {:s} in parallel.'.format(
-                    self.config['params']['solver']
-                )
+                'Incomplete run, restarting from time-step {:g} in {:g} seconds.'
+                .format(checkpoint, backoff * 2**attempt)
             )
-            owd = os.getcwd()
-            os.chdir(self.dir)
-            os.system(
-                "mpirun -np {:d} {:s} -parallel {:s}".format(
-                    self.config['params']['np'],
-                    self.config['params']['solver'],
-                    self.config['params']['args']
-                )
+            time.sleep(backoff * 2**attempt)
+
+            self.restart_from(checkpoint)
+            returncode = self.run()
+            attempts.append({'start': checkpoint, 'returncode': returncode})
+
+        # Later jobs start from their own start time again
+        if len(attempts) > 0:
+            OpenFoamMods.set_control_dict(
+                {'startFrom': start_from}, env_dir=self.dir
             )
-            os.chdir(owd)
+            logger.add_stat('restarts', attempts)
+
+        if self.stopped is None and not self.is_complete():
+            logger.error('Simulation did not reach its end time.')
+        return returncode
+
+    def case_dirs(self) -> List[str]:
+        """Folders the solver writes time-steps to
 
-    def reconstruct(self) -> None:
-        """Reconstructs OpenFOAM field from parallel folders
+        Returns:
+            List[str]: case folder, processor folders or collated folder
         """
         if self.config['params']['np'] == 1:
-            logger.warning('Using only 1 process, no need to reconstruct.')
-            return
+            return [self.dir]
+        if self.collated:
+            return self.meta.collated_folders
+        return self.meta.proc_folders
+
+    def complete_times(self) -> List[float]:
+        """Time-steps the solver wrote completely after the start of the
+        simulation window, present in every case folder with every field the
+        solver writes. Fields only present in the start time-step (e.g.
+        inputs of laminar cases such as nut) and non-field files (*.csv,
+        uniform/) are not expected, and the start time-step itself is never
+        counted.
 
-        if self.config['params']['reconstruct'] == False:
-            return
+        Returns:
+            List[float]: sorted time-steps
+        """
+        start_time = self.get_start_timestep()
+        end_time = self.get_end_timestep()
+        case_dirs = self.case_dirs()
+        if len(case_dirs) == 0:
+            return []
+
+        def field_files(time_dir: str) -> set:
+            return set(
+                f for f in os.listdir(time_dir)
+                if os.path.isfile(os.path.join(time_dir, f))
+                and not f.startswith('.') and not f.endswith('.csv')
+            )
 
-        time = self.get_end_timestep()
+        complete = None
+        for case_dir in case_dirs:
+            written = [
+                t for t in self.meta.time_folders(case_dir)
+                if start_time < float(t) <= end_time
+            ]
+            # Fields the solver writes, from every time-step it wrote
+            fields = set()
+            for time_step in written:
+                fields |= field_files(os.path.join(case_dir, time_step))
+
+            times = set()
+            for time_step in written:
+                time_dir = os.path.join(case_dir, time_step)
+                if len(fields) > 0 and all(
+                    os.path.isfile(os.path.join(time_dir, f))
+                    and os.path.getsize(os.path.join(time_dir, f)) > 0
+                    for f in fields
+                ):
+                    times.add(float(time_step))
+            complete = times if complete is None else complete & times
+
+        return sorted(complete)
+
+    def latest_checkpoint(self) -> Union[float, None]:
+        """Latest complete time-step of the simulation window after its start
 
-        owd = os.getcwd()
-        os.chdir(self.dir)
-        os.system("reconstructPar -time {:g}".format(time))
-        os.chdir(owd)
+        Returns:
+            Union[float, None]: time-step, None if the solver wrote none
+        """
+        times = self.complete_times()
+        return times[-1] if len(times) > 0 else None
 
-    def get_start_timestep(self) -> float:
-        """Gets the starting timestep from controlDict
+    def is_complete(self) -> bool:
+        """Checks if the simulation reached its end time and its
+        postProcessing files are not truncated
 
         Returns:
-            float: Starting time-step
+            bool: simulation is complete
+        """
+        end_time = self.get_end_timestep()
+        times = self.complete_times()
+        if len(times) == 0 or abs(times[-1] - end_time) > 1e-8:
+            return False
+        return len(self.truncated_post()) == 0
+
+    def truncated_post(self) -> List[str]:
+        """Finds postProcessing files of this simulation window whose last
+        line was cut off, not ending with a new line or with fewer columns
+        than the line before
+
+        Returns:
+            List[str]: paths of truncated files
+        """
+        start_time = self.get_start_timestep()
+        post_dir = os.path.join(self.dir, 'postProcessing')
+        if not os.path.exists(post_dir):
+            return []
+
+        truncated = []
+        for fo in os.scandir(post_dir):
+            if not fo.is_dir():
+                continue
+            for time_step in self.meta.time_folders(fo.path):
+                if float(time_step) < start_time:
+                    continue
+                time_dir = os.path.join(fo.path, time_step)
+                for f in os.scandir(time_dir):
+                    if f.is_file() and _is_truncated(f.path):
+                        truncated.append(f.path)
+        return truncated
+
+    def restart_from(self, time_step: float) -> None:
+        """Prepares a restart from a time-step. Later time-steps are trashed,
+        cut off lines of postProcessing files are removed and the solver is
+        set to start from the latest time-step.
+
+        Args:
+            time_step (float): time-step to restart from
+        """
+        for case_dir in self.case_dirs():
+            later = [
+                f for f in self.meta.time_folders(case_dir)
+                if float(f) > time_step
+            ]
+            get_reaper().reap(move_to_trash(case_dir, later))
+
+        for file_path in self.truncated_post():
+            with open(file_path, 'rb+') as file:
+                data = file.read()
+                file.truncate(data.rfind(b'\n') + 1)
+
+        OpenFoamMods.set_control_dict(
+            {'startFrom': 'latestTime'}, env_dir=self.dir
+        )
+
+    def reconstruct(self, time_step: float, fields: List[str] = None) -> int:
+        """Reconstructs fields of a time-step from the processor folders on
+        demand. Only fields that are not already reconstructed are passed to
+        reconstructPar (-fields). Reconstructed fields are recorded with the
+        modification time of the processor data and reused until it changes,
+        serial fields without a record (e.g. initial conditions) are trusted.
+
+        Args:
+            time_step (float): time-step to reconstruct
+            fields (List[str], optional): Fields needed. Defaults to all fields of the processor folders.
+
+        Returns:
+            int: return code of reconstructPar, 0 if not needed
         """
-        control_file = os.path.join(self.dir, 'system', 'controlDict')
+        time_name = '{:g}'.format(time_step)
+        proc_dirs = [
+            os.path.join(folder, time_name)
+            for folder in (
+                self.meta.collated_folders
+                if self.collated else self.meta.proc_folders
+            )
+        ]
+        if len(proc_dirs) == 0 or not os.path.isdir(proc_dirs[0]):
+            return 0
 
-        if not os.path.exists(control_file):
-            logger.error('Could not find controlDict file to edit.')
+        proc_files = [
+            f for f in os.scandir(proc_dirs[0])
+            if f.is_file() and not f.name.startswith('.')
+        ]
+        available = sorted(f.name for f in proc_files)
+        wanted = available if fields is None else [
+            f for f in fields if f in available
+        ]
+        stamp = max((
+            os.stat(os.path.join(proc_dir, f)).st_mtime_ns
+            for proc_dir in proc_dirs if os.path.isdir(proc_dir)
+            for f in os.listdir(proc_dir)
+        ),
+                    default=0)
+
+        record_file = os.path.join(self.dir, RECONSTRUCT_RECORD)
+        record = {}
+        if os.path.exists(record_file):
+            with open(record_file, 'r') as file:
+                record = json.load(file)
+        entry = record.get(time_name, None)
+        done = [] if entry is None or entry['stamp'] != stamp else entry[
+            'fields']
+
+        serial_dir = os.path.join(self.dir, time_name)
+        missing = [
+            f for f in wanted
+            if not os.path.isfile(os.path.join(serial_dir, f)) or (
+                not entry is None and not f in done
+            )
+        ]
+        if len(missing) == 0:
             return 0
 
-        # Read in lines
-        with open(control_file, 'r') as file:
-            lines = file.readlines()
+        cmd = ['reconstructPar', '-time', time_name]
+        if len(missing) < len(available):
+            cmd += ['-fields', '({:s})'.format(' '.join(missing))]
+        returncode = self.execute('reconstruct', cmd + self.handler_args())
+        if returncode == 0:
+            reconstructed = logger.log.stats.get('reconstructed', {})
+            reconstructed[time_name] = missing
+            logger.add_stat('reconstructed', reconstructed)
+            record[time_name] = {
+                'stamp': stamp,
+                'fields': sorted(set(done) | set(missing))
+            }
+            with open(record_file, 'w') as file:
+                json.dump(record, file)
+        return returncode
 
-        for _, line in enumerate(lines):
-            if line.lstrip().startswith("startTime"):
-                start_time = float(re.findall(r'\d*\.?\d+', line)[0])
-                return start_time
+    def get_start_timestep(self) -> float:
+        """Gets the starting timestep from controlDict
 
-        return 0
+        Returns:
+            float: Starting time-step
+        """
+        return self.meta.start_time
 
     def get_end_timestep(self) -> float:
         """Gets the ending timestep from controlDict
@@ -171,19 +682,181 @@ class FOAMRunner(object):
         Returns:
             float: Ending time-step
         """
-        control_file = os.path.join(self.dir, 'system', 'controlDict')
+        return self.meta.end_time
 
-        if not os.path.exists(control_file):
-            logger.error('Could not find controlDict file to edit.')
-            return 0
+    def get_control_prop(self, prop: str) -> Union[str, None]:
+        """Gets the raw value of a top level entry in the controlDict
+
+        Args:
+            prop (str): Name of the entry
 
-        # Read in lines
-        with open(control_file, 'r') as file:
-            lines = file.readlines()
+        Returns:
+            Union[str, None]: Value of the entry, None if not found
+        """
+        return self.meta.control_prop(prop)
 
-        for _, line in enumerate(lines):
-            if line.lstrip().startswith("endTime"):
-                end_time = float(re.findall(r'\d*\.?\d+', line)[0])
-                return end_time
 
-        return 0
+def batch_cmd(runners: List[FOAMRunner]) -> List[str]:
+    """Single MPMD mpirun command running the solvers of several cases. Each
+    case is its own application of the command and gets its own MPI world
+    (OpenFOAM's -world option), so the ranks of different cases do not
+    communicate.
+
+    Args:
+        runners (List[FOAMRunner]): runners of the cases, all running in parallel
+
+    Returns:
+        List[str]: command and arguments
+    """
+    cmd = ['mpirun']
+    # Ranks are placed in order of the applications
+    if all(not runner.cpus is None for runner in runners):
+        cmd += binding_args([cpu for runner in runners for cpu in runner.cpus])
+    for i, runner in enumerate(runners):
+        if i > 0:
+            cmd.append(':')
+        cmd += [
+            '-np',
+            str(runner.config['params']['np']),
+            runner.config['params']['solver'], '-parallel', '-case',
+            os.path.abspath(runner.dir), '-world', 'orle{:d}'.format(i)
+        ] + shlex.split(runner.config['params']['args']
+                        ) + runner.handler_args()
+    return cmd
+
+
+def run_batch(
+    runners: List[FOAMRunner],
+    watch: Callable[[], Union[str, None]] = None
+) -> int:
+    """Runs the solvers of several cases in one mpirun, paying the launch
+    and MPI start up once for the batch. The command is run and logged by
+    the first runner, every runner gets its return code and log.
+
+    Args:
+        runners (List[FOAMRunner]): runners of the cases, all decomposed
+        watch (Callable, optional): returns a reason to stop the batch or None. Defaults to None.
+
+    Returns:
+        int: return code of the batch
+    """
+    for runner in runners:
+        OpenFoamMods.set_control_dict(
+            {'application': runner.config['params']['solver']},
+            env_dir=runner.dir
+        )
+
+    lead = runners[0]
+    n_logs = len(lead.logs)
+    lead_watch, lead.watch = lead.watch, watch
+    try:
+        returncode = lead.execute('solve', batch_cmd(runners))
+    finally:
+        lead.watch = lead_watch
+
+    for runner in runners[1:]:
+        runner.returncodes['solve'] = returncode
+        runner.stopped = lead.stopped
+        runner.logs += lead.logs[n_logs:]
+    return returncode
+
+
+class LogCapture(threading.Thread):
+    """Streams the output of a command to a log file. Only the first head
+    and last tail bytes are kept, so a long run can not fill the disk, and
+    the log is compressed once the command finishes.
+
+    Args:
+        stream (BinaryIO): output stream of the command
+        file_path (str): path to log file
+        head (int): bytes kept from the start of the output
+        tail (int): bytes kept from the end of the output
+    """
+    def __init__(
+        self, stream: BinaryIO, file_path: str, head: int, tail: int
+    ) -> None:
+        """Constructor
+        """
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.file_path = file_path
+        self.head = head
+        self.tail = tail
+        self._file = open(file_path, 'wb')
+        self._written = 0
+        self._chunks = deque()
+        self._buffered = 0
+        self._dropped = 0
+
+    def run(self) -> None:
+        """Thread activity, copies the stream until the command exits
+        """
+        for chunk in iter(lambda: self.stream.read1(65536), b''):
+            if self._written < self.head:
+                part = chunk[:self.head - self._written]
+                self._file.write(part)
+                self._written += len(part)
+                chunk = chunk[len(part):]
+            if len(chunk) == 0:
+                continue
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            # Drop the oldest output beyond the tail
+            while len(self._chunks) > 0 and self._buffered - len(
+                self._chunks[0]
+            ) >= self.tail:
+                self._buffered -= len(self._chunks[0])
+                self._dropped += len(self._chunks.popleft())
+
+    def finish(self) -> str:
+        """Writes the tail of the output and compresses the log
+
+        Returns:
+            str: path to compressed log
+        """
+        self.join()
+        self.stream.close()
+        tail = b''.join(self._chunks)
+        if len(tail) > self.tail:
+            self._dropped += len(tail) - self.tail
+            tail = tail[len(tail) - self.tail:]
+        if self._dropped > 0:
+            self._file.write(
+                '\n... {:d} bytes omitted ...\n'.format(self._dropped).encode()
+            )
+        self._file.write(tail)
+        self._file.close()
+
+        with open(self.file_path, 'rb') as src:
+            with gzip.open(self.file_path + '.gz', 'wb') as dst:
+                dst.write(src.read())
+        os.remove(self.file_path)
+        return self.file_path + '.gz'
+
+
+def _is_truncated(file_path: str) -> bool:
+    """Checks if the last line of a tabular output file was cut off
+
+    Args:
+        file_path (str): path to file
+
+    Returns:
+        bool: file is truncated
+    """
+    with open(file_path, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        file.seek(max(0, size - 4096))
+        tail = file.read()
+    if len(tail) == 0:
+        return False
+    if not tail.endswith(b'\n'):
+        return True
+
+    lines = [
+        line for line in tail.splitlines()[-3:]
+        if len(line.strip()) > 0 and not line.startswith(b'#')
+    ]
+    if len(lines) < 2:
+        return False
+    return len(lines[-1].split()) < len(lines[-2].split())
@@ -0,0 +1,659 @@
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple, Union
+
+from .foamfile import (
+    binary_spans, is_collated_file, parse_blocks, read_header, render_blocks
+)
+from .jlogger import getLogger
+
+logger = getLogger(__name__)
+
+Value = Union[str, int, float, bool, List, Dict, 'FoamDict']
+
+# White space and comments between tokens
+_TRIVIA = re.compile(r'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.S)
+# Dictionary keywords, quoted (regex) keys or plain words such as div(phi,U)
+_KEY = re.compile(r'"[^"]*"|[^\s{};"]+')
+# Tokens that can hide a ';' inside a primitive value
+_SKIP = re.compile(r'"[^"]*"|//[^\n]*|/\*.*?\*/|#\{.*?#\}|;', re.S)
+# First characters of those tokens
+_HIDING = '"/#'
+
+# Parsed files and content hashes keyed by path, invalidated by modification
+# time and size
+_CACHE = {}
+_MISSING = object()
+# Open transaction of each thread, see DictTransaction
+_LOCAL = threading.local()
+
+
+class _Entry(object):
+    """Single keyword entry of a dictionary, stores the surrounding white
+    space and comments so unedited parts of a file are written back as is.
+
+    Args:
+        prefix (str): white space and comments before the keyword
+        key (str): keyword
+        sep (str): white space between keyword and value
+        value (Union[str, FoamDict]): raw primitive value or sub-dictionary
+        directive (bool, optional): Entry is a # directive without ';'. Defaults to False.
+    """
+    __slots__ = ['prefix', 'key', 'sep', 'value', 'directive']
+
+    def __init__(
+        self,
+        prefix: str,
+        key: str,
+        sep: str,
+        value: Union[str, 'FoamDict'],
+        directive: bool = False
+    ) -> None:
+        """Constructor
+        """
+        self.prefix = prefix
+        self.key = key
+        self.sep = sep
+        self.value = value
+        self.directive = directive
+
+    def render(self) -> str:
+        if isinstance(self.value, FoamDict):
+            return self.prefix + self.key + self.sep + '{' + self.value.render(
+            ) + '}'
+        if self.directive:
+            return self.prefix + self.key + self.sep + self.value
+        return self.prefix + self.key + self.sep + self.value + ';'
+
+
+class FoamDict(object):
+    """Parsed OpenFOAM dictionary. Entries are accessed with paths such as
+    'boundaryField/jet1/type'. Primitive values are returned as their raw
+    text, sub-dictionaries as FoamDict objects. Formatting and comments of
+    entries that are not edited are preserved when rendering.
+
+    Args:
+        indent (str, optional): Indentation of the entries. Defaults to ''.
+    """
+    def __init__(self, indent: str = '') -> None:
+        """Constructor
+        """
+        self.indent = indent
+        self._entries = []
+        self._index = {}
+        self._trailing = ''
+
+    @classmethod
+    def parse(cls, text: str, binary: bool = None) -> 'FoamDict':
+        """Parses the text of an OpenFOAM dictionary or field file
+
+        Args:
+            text (str): file text (binary payloads latin-1 decoded)
+            binary (bool, optional): Format of the text, read from the header if None. Defaults to None.
+
+        Raises:
+            ValueError: If the dictionary structure is malformed
+
+        Returns:
+            FoamDict: parsed dictionary
+        """
+        spans = binary_spans(text, binary)
+        root, pos = cls._parse_body(text, 0, spans)
+        if pos < len(text):
+            raise ValueError('Unmatched closing bracket at {:d}.'.format(pos))
+        return root
+
+    @classmethod
+    def _parse_body(cls, text: str, pos: int,
+                    spans: List[Tuple[int, int]]) -> Tuple['FoamDict', int]:
+        """Parses dictionary entries until a closing bracket or end of text
+
+        Args:
+            text (str): file text
+            pos (int): index to start at
+            spans (List[Tuple[int, int]]): binary payloads to skip
+
+        Returns:
+            Tuple[FoamDict, int]: dictionary and index of the closing bracket
+        """
+        node = cls()
+        while True:
+            start = pos
+            pos = _TRIVIA.match(text, pos).end()
+            if pos >= len(text) or text[pos] == '}':
+                node._trailing = text[start:pos]
+                return node, pos
+
+            match = _KEY.match(text, pos)
+            if match is None:
+                raise ValueError(
+                    'Invalid keyword at {:d}: {:s}'.format(
+                        pos, text[pos:pos + 20]
+                    )
+                )
+            key = match.group(0)
+            value_start = _TRIVIA.match(text, match.end()).end()
+            sep = text[match.end():value_start]
+
+            if key.startswith('#'):
+                # Directives (#include, #remove) run to the end of the line
+                end = text.find('\n', value_start)
+                end = len(text) if end == -1 else end
+                entry = _Entry(
+                    text[start:pos], key, sep, text[value_start:end], True
+                )
+                pos = end
+            elif value_start < len(text) and text[value_start] == '{':
+                sub, end = cls._parse_body(text, value_start + 1, spans)
+                if end >= len(text):
+                    raise ValueError(
+                        'Missing closing bracket for {:s}.'.format(key)
+                    )
+                entry = _Entry(text[start:pos], key, sep, sub)
+                pos = end + 1
+            else:
+                end = cls._value_end(text, value_start, spans)
+                entry = _Entry(
+                    text[start:pos], key, sep, text[value_start:end]
+                )
+                pos = end + 1
+
+            if len(node._entries) == 0:
+                node.indent = entry.prefix[entry.prefix.rfind('\n') + 1:]
+            node._add(entry)
+
+    @staticmethod
+    def _value_end(text: str, pos: int, spans: List[Tuple[int, int]]) -> int:
+        """Finds the ';' ending a primitive value, skipping strings, comments,
+        verbatim code and binary payloads
+
+        Args:
+            text (str): file text
+            pos (int): start of value
+            spans (List[Tuple[int, int]]): binary payloads to skip
+
+        Returns:
+            int: index of the terminating ';'
+        """
+        # Most values (numbers, words, long ascii lists) end at the next ';'
+        # with nothing before it that could hide one, found without running
+        # the token pattern over the whole value
+        end = text.find(';', pos)
+        if end != -1 and not any(
+            text.find(token, pos, end) != -1 for token in _HIDING
+        ) and not any(s[0] < end and pos < s[1] for s in spans):
+            return end
+
+        while True:
+            match = _SKIP.search(text, pos)
+            if match is None:
+                raise ValueError('Missing ; after value at {:d}.'.format(pos))
+            # Jump over binary payloads the match falls in
+            span = [s for s in spans if s[0] <= match.start() < s[1]]
+            if len(span) > 0:
+                pos = span[0][1]
+                continue
+            if match.group(0) == ';':
+                return match.start()
+            pos = match.end()
+
+    def _add(self, entry: _Entry) -> None:
+        """Adds an entry, later duplicates override earlier ones as in OpenFOAM
+        """
+        key = entry.key.strip('"')
+        self._entries.append(entry)
+        self._index[key] = entry
+
+    def render(self) -> str:
+        """Renders the dictionary back to OpenFOAM text
+
+        Returns:
+            str: dictionary text
+        """
+        return ''.join([e.render() for e in self._entries]) + self._trailing
+
+    def _walk(self, path: Union[str, List[str]],
+              create: bool = False) -> Tuple['FoamDict', str]:
+        """Finds the dictionary holding the last key of a path
+
+        Args:
+            path (Union[str, List[str]]): '/' separated path or list of keys
+            create (bool, optional): Create missing sub-dictionaries. Defaults to False.
+
+        Returns:
+            Tuple[FoamDict, str]: parent dictionary (None if missing) and last key
+        """
+        keys = path.split('/') if isinstance(path, str) else list(path)
+        node = self
+        for key in keys[:-1]:
+            if not key in node._index or not isinstance(
+                node._index[key].value, FoamDict
+            ):
+                if not create:
+                    return None, keys[-1]
+                node.set(key, {})
+            node = node._index[key].value
+        return node, keys[-1]
+
+    def get(self, path: Union[str, List[str]], default=None) -> Value:
+        """Gets an entry by path
+
+        Args:
+            path (Union[str, List[str]]): '/' separated path or list of keys
+            default (optional): Returned if the entry does not exist. Defaults to None.
+
+        Returns:
+            Value: raw primitive text or sub-dictionary
+        """
+        node, key = self._walk(path)
+        if node is None or not key in node._index:
+            return default
+        value = node._index[key].value
+        return value if isinstance(value, FoamDict) else value.strip()
+
+    def set(self, path: Union[str, List[str]], value: Value) -> None:
+        """Sets an entry by path, creating it (and missing parents) if needed.
+        Mappings are written as sub-dictionaries, other values as text.
+
+        Args:
+            path (Union[str, List[str]]): '/' separated path or list of keys
+            value (Value): new value
+        """
+        node, key = self._walk(path, create=True)
+        inner = node.indent
+
+        if isinstance(value, (dict, FoamDict)):
+            value = FoamDict.from_mapping(value, inner + '    ', inner)
+        else:
+            value = format_value(value)
+
+        if key in node._index:
+            entry = node._index[key]
+            if isinstance(value, FoamDict) and not isinstance(
+                entry.value, FoamDict
+            ):
+                entry.sep = '\n' + inner
+            elif not isinstance(value, FoamDict) and isinstance(
+                entry.value, FoamDict
+            ):
+                entry.sep = ' ' * max(1, 16 - len(key))
+            entry.value = value
+            return
+
+        if isinstance(value, FoamDict):
+            sep = '\n' + inner
+        else:
+            sep = ' ' * max(1, 16 - len(key))
+        node._add(_Entry('\n' + inner, key, sep, value))
+
+    def remove(self, path: Union[str, List[str]]) -> bool:
+        """Removes an entry by path
+
+        Args:
+            path (Union[str, List[str]]): '/' separated path or list of keys
+
+        Returns:
+            bool: Entry existed
+        """
+        node, key = self._walk(path)
+        if node is None or not key in node._index:
+            return False
+        node._entries.remove(node._index.pop(key))
+        return True
+
+    @classmethod
+    def from_mapping(
+        cls,
+        mapping: Union[Dict, 'FoamDict'],
+        indent: str = '    ',
+        outer: str = ''
+    ) -> 'FoamDict':
+        """Builds a formatted dictionary from a mapping
+
+        Args:
+            mapping (Union[Dict, FoamDict]): entries
+            indent (str, optional): Indentation of the entries. Defaults to four spaces.
+            outer (str, optional): Indentation of the closing bracket. Defaults to ''.
+
+        Returns:
+            FoamDict: dictionary
+        """
+        node = cls(indent)
+        node._trailing = '\n' + outer
+        for k, v in mapping.items():
+            node.set(k, v)
+        return node
+
+    def copy(self) -> 'FoamDict':
+        """Copy of the dictionary that can be edited independently. Raw
+        values are immutable text and are shared, only the entries and
+        sub-dictionaries are copied.
+
+        Returns:
+            FoamDict: copy of the dictionary
+        """
+        node = FoamDict(self.indent)
+        node._trailing = self._trailing
+        for entry in self._entries:
+            value = entry.value.copy() if isinstance(
+                entry.value, FoamDict
+            ) else entry.value
+            node._add(
+                _Entry(
+                    entry.prefix, entry.key, entry.sep, value, entry.directive
+                )
+            )
+        return node
+
+    def items(self) -> List[Tuple[str, Value]]:
+        return [(k, self.get([k])) for k in self._index.keys()]
+
+    def keys(self) -> List[str]:
+        return list(self._index.keys())
+
+    def __getitem__(self, path: Union[str, List[str]]) -> Value:
+        value = self.get(path, _MISSING)
+        if value is _MISSING:
+            raise KeyError(path)
+        return value
+
+    def __setitem__(self, path: Union[str, List[str]], value: Value) -> None:
+        self.set(path, value)
+
+    def __contains__(self, path: Union[str, List[str]]) -> bool:
+        return not self.get(path, _MISSING) is _MISSING
+
+
+def format_value(value: Value) -> str:
+    """Formats a python value as OpenFOAM primitive text
+
+    Args:
+        value (Value): python value
+
+    Returns:
+        str: OpenFOAM text
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return '(' + ' '.join([format_value(v) for v in value]) + ')'
+    return str(value)
+
+
+class DictTransaction(object):
+    """Batches edits of OpenFOAM files. While a transaction is open every file
+    is parsed once, all edits are applied to the in-memory dictionaries and
+    each edited file is written once when the transaction closes. Nested
+    transactions join the outer one.
+
+    Example:
+        with DictTransaction():
+            OpenFoamMods.set_boundary(...)
+            OpenFoamMods.set_boundary(...)
+
+    Transactions are per thread, worker threads editing files for the
+    caller join its transaction with join_transaction.
+    """
+    def __init__(self) -> None:
+        """Constructor
+        """
+        self.files = {}
+        self.dirty = set()
+        self.written = 0
+        self.unchanged = 0
+        self.lock = threading.Lock()
+        self._outer = False
+
+    def __enter__(self) -> 'DictTransaction':
+        if active_transaction() is None:
+            _LOCAL.transaction = self
+            self._outer = True
+        return active_transaction()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if self._outer:
+            _LOCAL.transaction = None
+            if exc_type is None:
+                self.commit()
+        return False
+
+    def get(self, file_path: str, load: Callable) -> Union[FoamDict, Tuple]:
+        """Gets the pending contents of a file, loading it on first access
+
+        Args:
+            file_path (str): path to OpenFOAM file
+            load (Callable): function loading the file contents
+
+        Returns:
+            Union[FoamDict, Tuple]: dictionary or collated blocks
+        """
+        with self.lock:
+            if file_path in self.files:
+                return self.files[file_path]
+        contents = load(file_path)
+        with self.lock:
+            return self.files.setdefault(file_path, contents)
+
+    def put(self, file_path: str, contents: Union[FoamDict, Tuple]) -> None:
+        """Stores edited contents of a file to be written on commit
+
+        Args:
+            file_path (str): path to OpenFOAM file
+            contents (Union[FoamDict, Tuple]): dictionary or collated blocks
+        """
+        with self.lock:
+            self.files[file_path] = contents
+            self.dirty.add(file_path)
+
+    def commit(self) -> int:
+        """Writes every edited file once, skipping files whose contents did
+        not change
+
+        Returns:
+            int: Number of files written
+        """
+        with self.lock:
+            dirty = sorted(self.dirty)
+            self.dirty = set()
+
+        written = 0
+        for file_path in dirty:
+            written += int(_flush(file_path, self.files[file_path]))
+        self.written += written
+        self.unchanged += len(dirty) - written
+
+        if len(dirty) > 0:
+            logger.info(
+                'Flushed {:d} edited files, {:d} unchanged.'.format(
+                    written,
+                    len(dirty) - written
+                )
+            )
+        return written
+
+
+def active_transaction() -> Union[DictTransaction, None]:
+    """Transaction open in the calling thread
+
+    Returns:
+        Union[DictTransaction, None]: open transaction, None if there is none
+    """
+    return getattr(_LOCAL, 'transaction', None)
+
+
+@contextmanager
+def join_transaction(transaction: Union[DictTransaction, None]):
+    """Makes the calling thread edit files in another thread's transaction,
+    used by workers applying a mod for the thread that submitted it.
+
+    Args:
+        transaction (Union[DictTransaction, None]): transaction to join, None for none
+    """
+    previous = active_transaction()
+    _LOCAL.transaction = transaction
+    try:
+        yield transaction
+    finally:
+        _LOCAL.transaction = previous
+
+
+def _stat_key(file_path: str) -> Tuple[int, int]:
+    """Modification time and size identifying the on disk version of a file
+    """
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _load_dict(file_path: str) -> FoamDict:
+    """Parses an OpenFOAM file, using the parse cache if unchanged on disk
+
+    Args:
+        file_path (str): path to OpenFOAM file
+
+    Returns:
+        FoamDict: parsed dictionary (a copy owned by the caller)
+    """
+    key = _stat_key(file_path)
+    if file_path in _CACHE and _CACHE[file_path][0] == key and not _CACHE[
+        file_path][1] is None:
+        return _CACHE[file_path][1].copy()
+
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    foam_dict = FoamDict.parse(data.decode('latin-1'))
+    _CACHE[file_path] = (key, foam_dict, hashlib.sha1(data).digest())
+    return foam_dict.copy()
+
+
+def _load_collated(file_path: str) -> Tuple[bytes, List[FoamDict], bytes]:
+    """Parses the processor blocks of a collated file
+
+    Args:
+        file_path (str): path to collated file
+
+    Returns:
+        Tuple[bytes, List[FoamDict], bytes]: header, block dictionaries, trailer
+    """
+    key = _stat_key(file_path)
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    header, blocks, trailer = parse_blocks(data)
+    _CACHE[file_path] = (key, None, hashlib.sha1(data).digest())
+
+    binary = read_header(header.decode('latin-1')).get('format') == 'binary'
+    return header, [
+        FoamDict.parse(block.decode('latin-1'), binary) for block in blocks
+    ], trailer
+
+
+def _flush(file_path: str, contents: Union[FoamDict, Tuple]) -> bool:
+    """Writes a dictionary or collated blocks to disk. The write is skipped
+    if the file is unchanged on disk since it was last read or written and
+    the new contents hash the same, so mtimes of untouched files are kept.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+        contents (Union[FoamDict, Tuple]): dictionary or collated blocks
+
+    Returns:
+        bool: File was written
+    """
+    if isinstance(contents, tuple):
+        header, blocks, trailer = contents
+        data = render_blocks(
+            header, [block.render().encode('latin-1') for block in blocks],
+            trailer
+        )
+        parsed = None
+    else:
+        data = contents.render().encode('latin-1')
+        parsed = contents
+
+    digest = hashlib.sha1(data).digest()
+    cached = _CACHE.get(file_path, None)
+    if not cached is None and cached[2] == digest and os.path.exists(
+        file_path
+    ) and cached[0] == _stat_key(file_path):
+        logger.debug('Skipping unchanged file {:s}.'.format(file_path))
+        return False
+
+    # Replace atomically, a running solver may be reading the file
+    tmp_path = '{:s}.{:d}.tmp'.format(file_path, threading.get_ident())
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, file_path)
+
+    _CACHE[file_path] = (
+        _stat_key(file_path),
+        None if parsed is None else parsed.copy(), digest
+    )
+    return True
+
+
+def read_dict(file_path: str) -> FoamDict:
+    """Reads and parses an OpenFOAM file. Parsed files are cached until the
+    file changes on disk, so repeated reads in a job do not re-parse. Inside
+    a transaction the pending dictionary of the file is returned.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+
+    Returns:
+        FoamDict: parsed dictionary
+    """
+    transaction = active_transaction()
+    if not transaction is None:
+        return transaction.get(file_path, _load_dict)
+    return _load_dict(file_path)
+
+
+def write_dict(file_path: str, foam_dict: FoamDict) -> None:
+    """Writes a dictionary to an OpenFOAM file and updates the parse cache.
+    Inside a transaction the write is deferred until commit.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+        foam_dict (FoamDict): dictionary to write
+    """
+    transaction = active_transaction()
+    if not transaction is None:
+        transaction.put(file_path, foam_dict)
+        return
+    _flush(file_path, foam_dict)
+
+
+def edit_dict(file_path: str, edit: Callable[[FoamDict], bool]) -> bool:
+    """Parses an OpenFOAM file, applies an edit and writes it back. For
+    collated files the edit is applied to the dictionary of every processor
+    block.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+        edit (Callable): function editing a dictionary in place, returns success
+
+    Returns:
+        bool: Successful edit
+    """
+    if is_collated_file(file_path):
+        transaction = active_transaction()
+        if transaction is None:
+            contents = _load_collated(file_path)
+        else:
+            contents = transaction.get(file_path, _load_collated)
+        for block in contents[1]:
+            if not edit(block):
+                return False
+        if transaction is None:
+            _flush(file_path, contents)
+        else:
+            transaction.put(file_path, contents)
+        return True
+
+    foam_dict = read_dict(file_path)
+    if not edit(foam_dict):
+        return False
+    write_dict(file_path, foam_dict)
+    return True
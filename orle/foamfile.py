@@ -0,0 +1,553 @@
+import os
+import re
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from .jlogger import getLogger
+from .utils import get_time_folders
+
+logger = getLogger(__name__)
+
+N_COMPONENTS = {
+    'scalar': 1,
+    'vector': 3,
+    'sphericalTensor': 1,
+    'symmTensor': 6,
+    'tensor': 9
+}
+
+
+def is_collated_file(file_path: str) -> bool:
+    """Checks if a file was written by the collated file handler
+
+    Args:
+        file_path (str): path to OpenFOAM file
+
+    Returns:
+        bool: File holds decomposedBlockData
+    """
+    with open(file_path, 'rb') as file:
+        head = file.read(1024)
+    return b'decomposedBlockData' in head
+
+
+def _header_end(data: Union[str, bytes]) -> int:
+    """Index just after the FoamFile header dictionary of an OpenFOAM file
+
+    Args:
+        data (Union[str, bytes]): file contents
+
+    Returns:
+        int: end of header, 0 if the file has no header
+    """
+    key, close = ('FoamFile', '}') if isinstance(data, str) else (b'FoamFile', b'}')
+    start = data.find(key)
+    if start == -1:
+        return 0
+    return data.find(close, start) + 1
+
+
+def read_blocks(file_path: str) -> Tuple[bytes, List[bytes], bytes]:
+    """Reads the processor blocks of a collated (decomposedBlockData) file.
+    Each block holds the full contents the uncollated processor file would.
+
+    Args:
+        file_path (str): path to collated file
+
+    Raises:
+        ValueError: If the block structure is malformed
+
+    Returns:
+        Tuple[bytes, List[bytes], bytes]: file header, processor blocks, trailing comments
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+
+    try:
+        return parse_blocks(data)
+    except ValueError as e:
+        raise ValueError('{:s} in {:s}'.format(str(e), file_path))
+
+
+def parse_blocks(data: bytes) -> Tuple[bytes, List[bytes], bytes]:
+    """Splits the contents of a collated file into its processor blocks
+
+    Args:
+        data (bytes): collated file contents
+
+    Raises:
+        ValueError: If the block structure is malformed
+
+    Returns:
+        Tuple[bytes, List[bytes], bytes]: file header, processor blocks, trailing comments
+    """
+    header_end = _header_end(data)
+    blocks = []
+    pos = header_end
+    while pos < len(data):
+        # Skip white space and comment lines between blocks
+        if data[pos:pos + 1].isspace():
+            pos += 1
+        elif data.startswith(b'//', pos):
+            end = data.find(b'\n', pos)
+            pos = len(data) if end == -1 else end + 1
+        elif data[pos:pos + 1].isdigit():
+            match = re.compile(rb'(\d+)\s*\(').match(data, pos)
+            if match is None:
+                raise ValueError('Malformed block')
+            size = int(match.group(1))
+            start = match.end()
+            if data[start + size:start + size + 1] != b')':
+                raise ValueError('Block size mismatch')
+            blocks.append(data[start:start + size])
+            pos = start + size + 1
+        else:
+            break
+
+    # Keep whatever follows the last block (end of file comment)
+    trailer = data[pos:]
+    if len(blocks) > 0:
+        last = data.rfind(b')', header_end, pos) + 1
+        trailer = data[last:]
+
+    return data[:header_end], blocks, trailer
+
+
+def write_blocks(
+    file_path: str,
+    header: bytes,
+    blocks: List[bytes],
+    trailer: bytes = b'\n'
+) -> None:
+    """Writes processor blocks to a collated (decomposedBlockData) file
+
+    Args:
+        file_path (str): path to collated file
+        header (bytes): file header
+        blocks (List[bytes]): processor blocks
+        trailer (bytes, optional): trailing comments. Defaults to new line.
+    """
+    with open(file_path, 'wb') as file:
+        file.write(render_blocks(header, blocks, trailer))
+
+
+def render_blocks(
+    header: bytes,
+    blocks: List[bytes],
+    trailer: bytes = b'\n'
+) -> bytes:
+    """Renders processor blocks as the contents of a collated file
+
+    Args:
+        header (bytes): file header
+        blocks (List[bytes]): processor blocks
+        trailer (bytes, optional): trailing comments. Defaults to new line.
+
+    Returns:
+        bytes: collated file contents
+    """
+    data = [header]
+    for i, block in enumerate(blocks):
+        data.append(b'\n\n// Processor' + str(i).encode() + b'\n')
+        data.append(str(len(block)).encode() + b'\n(' + block + b')')
+    data.append(trailer)
+    return b''.join(data)
+
+
+def read_texts(file_path: str) -> List[str]:
+    """Reads an OpenFOAM file as text. Collated files return the text of
+    each processor block, regular files a single text.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+
+    Returns:
+        List[str]: file texts
+    """
+    if is_collated_file(file_path):
+        _, blocks, _ = read_blocks(file_path)
+        return [block.decode('latin-1') for block in blocks]
+
+    with open(file_path, 'rb') as file:
+        return [file.read().decode('latin-1')]
+
+
+def read_header(text: str) -> Dict[str, str]:
+    """Reads the entries of the FoamFile header
+
+    Args:
+        text (str): file text
+
+    Returns:
+        Dict[str, str]: header entries, empty if the file has no header
+    """
+    end = _header_end(text)
+    if end == 0:
+        return {}
+    start = text.find('{', text.find('FoamFile'))
+    return {
+        k: v.strip('"')
+        for k, v in re.findall(r'(\w+)\s+("[^"]*"|[^;]*);', text[start:end])
+    }
+
+
+def _arch_dtypes(header: Dict[str, str]) -> Tuple[np.dtype, np.dtype]:
+    """Label and scalar types of binary data from the header arch entry
+
+    Args:
+        header (Dict[str, str]): header entries
+
+    Returns:
+        Tuple[np.dtype, np.dtype]: label and scalar data types
+    """
+    arch = header.get('arch', 'LSB;label=32;scalar=64')
+    order = '>' if 'MSB' in arch else '<'
+    label = re.search(r'label=(\d+)', arch)
+    scalar = re.search(r'scalar=(\d+)', arch)
+    label = 32 if label is None else int(label.group(1))
+    scalar = 64 if scalar is None else int(scalar.group(1))
+    return (
+        np.dtype('{:s}i{:d}'.format(order, label // 8)),
+        np.dtype('{:s}f{:d}'.format(order, scalar // 8))
+    )
+
+
+def _list_type(type_name: str, header: Dict[str, str]) -> Tuple[np.dtype, int]:
+    """Data type and number of components of a list value type
+
+    Args:
+        type_name (str): OpenFOAM value type (e.g. vector)
+        header (Dict[str, str]): header entries
+
+    Returns:
+        Tuple[np.dtype, int]: data type and number of components
+    """
+    label, scalar = _arch_dtypes(header)
+    if type_name == 'label':
+        return label, 1
+    return scalar, N_COMPONENTS[type_name]
+
+
+def _parse_list(
+    text: str,
+    start: int,
+    binary: bool = False,
+    dtype: np.dtype = np.float64,
+    components: int = 1
+) -> Tuple[np.ndarray, int]:
+    """Parses an OpenFOAM list starting at the given index
+
+    Args:
+        text (str): file text
+        start (int): index of the list size
+        binary (bool, optional): List payload is binary. Defaults to False.
+        dtype (np.dtype, optional): Binary data type. Defaults to np.float64.
+        components (int, optional): Binary components per value. Defaults to 1.
+
+    Returns:
+        Tuple[np.ndarray, int]: [size, components] array of list values, index after the list
+    """
+    match = re.compile(r'\s*(\d+)\s*\(').match(text, start)
+    size = int(match.group(1))
+
+    if binary:
+        end = match.end() + size * components * dtype.itemsize
+        values = np.frombuffer(
+            text[match.end():end].encode('latin-1'), dtype=dtype
+        )
+        return values.reshape(size, components), end + 1
+
+    if size == 0:
+        return np.zeros((0, 1)), text.find(')', match.end()) + 1
+    end = text.find(';', match.end())
+    if end == -1:
+        end = len(text)
+    end = text.rfind(')', match.end(), end)
+    values = np.array(
+        text[match.end():end].replace('(', ' ').replace(')', ' ').split(),
+        dtype=np.float64
+    )
+    return values.reshape(size, -1), end + 1
+
+
+def _format_list(values: np.ndarray, binary: bool = False) -> str:
+    """Formats a [size, components] array as an OpenFOAM list
+
+    Args:
+        values (np.ndarray): list values
+        binary (bool, optional): Write a binary payload. Defaults to False.
+
+    Returns:
+        str: list text (binary payloads are latin-1 decoded)
+    """
+    if binary:
+        return '{:d}\n({:s})'.format(
+            len(values),
+            np.ascontiguousarray(values).tobytes().decode('latin-1')
+        )
+
+    if values.shape[1] == 1:
+        rows = ['{}'.format(v) for v in values[:, 0].tolist()]
+    else:
+        rows = [
+            '(' + ' '.join(['{}'.format(v) for v in row]) + ')'
+            for row in values.tolist()
+        ]
+    return '{:d}\n(\n{:s}\n)\n'.format(len(values), '\n'.join(rows))
+
+
+def binary_spans(text: str, binary: bool = None) -> List[Tuple[int, int]]:
+    """Locates the binary list payloads of a field file
+
+    Args:
+        text (str): field file text
+        binary (bool, optional): Format of the text, read from the header if None. Defaults to None.
+
+    Returns:
+        List[Tuple[int, int]]: start and end index of each binary payload
+    """
+    header = read_header(text)
+    if binary is None:
+        binary = header.get('format', 'ascii') == 'binary'
+    if not binary:
+        return []
+
+    spans = []
+    pattern = re.compile(r'List<(\w+)>\s*(\d+)\s*\(')
+    pos = _header_end(text)
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            break
+        dtype, components = _list_type(match.group(1), header)
+        pos = match.end() + int(match.group(2)) * components * dtype.itemsize
+        spans.append((match.end(), pos))
+
+    return spans
+
+
+def read_label_list(text: str) -> np.ndarray:
+    """Reads a labelList file (e.g. cellProcAddressing)
+
+    Args:
+        text (str): file text
+
+    Returns:
+        np.ndarray: list of labels
+    """
+    header = read_header(text)
+    start = re.compile(r'\d+\s*\(').search(text, _header_end(text)).start()
+    dtype, _ = _list_type('label', header)
+    values, _ = _parse_list(
+        text, start, header.get('format', 'ascii') == 'binary', dtype
+    )
+    return values.astype(np.int64).reshape(-1)
+
+
+def read_internal_field(text: str, n_cells: int = None) -> np.ndarray:
+    """Reads the internal field of a volume field file
+
+    Args:
+        text (str): field file text
+        n_cells (int, optional): Number of cells, required for uniform fields. Defaults to None.
+
+    Returns:
+        np.ndarray: [cells, components] array of field values
+    """
+    match = re.compile(r'internalField\s+(uniform|nonuniform)\s*').search(
+        text
+    )
+    if match is None:
+        raise ValueError('No internalField found.')
+
+    if match.group(1) == 'uniform':
+        end = text.find(';', match.end())
+        value = np.array(
+            text[match.end():end].replace('(', ' ').replace(')', ' ').split(),
+            dtype=np.float64
+        )
+        return np.tile(value, (n_cells, 1))
+
+    header = read_header(text)
+    match = re.compile(r'List<(\w+)>\s*').match(text, match.end())
+    dtype, components = _list_type(match.group(1), header)
+    values, _ = _parse_list(
+        text, match.end(),
+        header.get('format', 'ascii') == 'binary', dtype, components
+    )
+    return values.astype(np.float64)
+
+
+def read_n_cells(owner_text: str) -> int:
+    """Reads the number of cells from the note of a polyMesh owner file
+
+    Args:
+        owner_text (str): owner file text
+
+    Returns:
+        int: number of cells
+    """
+    match = re.search(r'nCells:\s*(\d+)', owner_text)
+    if match is None:
+        raise ValueError('Owner file has no cell count note.')
+    return int(match.group(1))
+
+
+def _set_format(text: str, fmt: str, cls: str = None) -> str:
+    """Sets the format (and optionally class) entry of the FoamFile header
+
+    Args:
+        text (str): file text
+        fmt (str): ascii or binary
+        cls (str, optional): New class of the file. Defaults to None.
+
+    Returns:
+        str: file text with updated header
+    """
+    end = _header_end(text)
+    header = re.sub(r'(format\s+)\w+;', r'\g<1>' + fmt + ';', text[:end])
+    if not cls is None:
+        header = re.sub(r'(class\s+)\w+;', r'\g<1>' + cls + ';', header)
+    if fmt == 'binary' and not 'arch' in header:
+        header = re.sub(
+            r'(format\s+binary;)', r'\g<1>\n    arch        "LSB;label=32;scalar=64";',
+            header
+        )
+    return header + text[end:]
+
+
+def _convert_fields(text: str, header: Dict[str, str], fmt: str) -> str:
+    """Converts the nonuniform lists of a field file
+
+    Args:
+        text (str): field file text
+        header (Dict[str, str]): header entries
+        fmt (str): target format, ascii or binary
+
+    Returns:
+        str: converted file text
+    """
+    binary = header.get('format', 'ascii') == 'binary'
+    pattern = re.compile(r'List<(\w+)>\s*')
+    out = []
+    pos = 0
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            break
+        dtype, components = _list_type(match.group(1), header)
+        values, end = _parse_list(
+            text, match.end(), binary, dtype, components
+        )
+        if fmt == 'binary':
+            values = values.astype(dtype).reshape(-1, components)
+        out.append(text[pos:match.end()])
+        out.append(_format_list(values, fmt == 'binary'))
+        pos = end
+    out.append(text[pos:])
+    return ''.join(out)
+
+
+def convert_file(file_path: str, fmt: str) -> bool:
+    """Converts an OpenFOAM mesh or field file between ascii and binary.
+    Supported are point, label and face lists of the polyMesh and the
+    nonuniform lists of field files. Other files are left unchanged.
+
+    Args:
+        file_path (str): path to OpenFOAM file
+        fmt (str): target format, ascii or binary
+
+    Returns:
+        bool: File was converted
+    """
+    with open(file_path, 'rb') as file:
+        text = file.read().decode('latin-1')
+
+    header = read_header(text)
+    cls = header.get('class', '')
+    if len(header) == 0 or header.get('format', 'ascii') == fmt:
+        return False
+
+    binary = header.get('format', 'ascii') == 'binary'
+    label, scalar = _arch_dtypes(header)
+    end = _header_end(text)
+    new_cls = None
+    if cls in ['vectorField', 'labelList']:
+        dtype, components = (scalar, 3) if cls == 'vectorField' else (label, 1)
+        start = re.compile(r'\d+\s*\(').search(text, end).start()
+        values, stop = _parse_list(text, start, binary, dtype, components)
+        if fmt == 'binary':
+            values = values.astype(dtype).reshape(-1, components)
+        text = text[:start] + _format_list(values, fmt == 'binary') + text[stop:]
+    elif cls == 'faceList' and fmt == 'binary':
+        # Binary faces are stored compact as offsets and flattened labels
+        match = re.compile(r'\d+\s*\(').search(text, end)
+        stop = text.rfind(')')
+        faces = re.findall(r'(\d+)\(([^)]*)\)', text[match.end():stop])
+        sizes = np.array([int(size) for size, _ in faces])
+        labels = np.array(
+            ' '.join([face for _, face in faces]).split(), dtype=label
+        )
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(label)
+        text = text[:match.start()] + \
+            _format_list(offsets.reshape(-1, 1), True) + '\n\n' + \
+            _format_list(labels.reshape(-1, 1), True) + '\n\n' + \
+            text[stop + 1:]
+        new_cls = 'faceCompactList'
+    elif cls == 'faceCompactList' and fmt == 'ascii':
+        start = re.compile(r'\d+\s*\(').search(text, end).start()
+        offsets, stop = _parse_list(text, start, binary, label)
+        start = re.compile(r'\d+\s*\(').search(text, stop).start()
+        labels, stop = _parse_list(text, start, binary, label)
+        offsets = offsets.reshape(-1)
+        labels = labels.reshape(-1).tolist()
+        faces = [
+            '{:d}({:s})'.format(
+                int(offsets[i + 1] - offsets[i]),
+                ' '.join([str(v) for v in labels[offsets[i]:offsets[i + 1]]])
+            ) for i in range(len(offsets) - 1)
+        ]
+        text = text[:end] + '\n\n\n{:d}\n(\n{:s}\n)\n'.format(
+            len(faces), '\n'.join(faces)
+        ) + text[stop:]
+        new_cls = 'faceList'
+    elif re.match(r'(vol|surface|point)\w*Field$', cls):
+        text = text[:end] + _convert_fields(text[end:], header, fmt)
+    else:
+        return False
+
+    text = _set_format(text, fmt, new_cls)
+    with open(file_path, 'wb') as file:
+        file.write(text.encode('latin-1'))
+    return True
+
+
+def convert_case(case_dir: str, fmt: str) -> int:
+    """Converts the polyMesh and time-step fields of an OpenFOAM case
+
+    Args:
+        case_dir (str): path to OpenFOAM case
+        fmt (str): target format, ascii or binary
+
+    Returns:
+        int: Number of converted files
+    """
+    files = [
+        os.path.join(case_dir, 'constant', 'polyMesh', f)
+        for f in ['points', 'faces', 'owner', 'neighbour']
+    ]
+    for time_step in get_time_folders(case_dir):
+        time_dir = os.path.join(case_dir, time_step)
+        files.extend([
+            os.path.join(time_dir, f) for f in sorted(os.listdir(time_dir))
+            if os.path.isfile(os.path.join(time_dir, f))
+        ])
+
+    converted = 0
+    for file_path in files:
+        if os.path.exists(file_path) and convert_file(file_path, fmt):
+            logger.info('Converted {:s} to {:s}.'.format(file_path, fmt))
+            converted += 1
+
+    return converted
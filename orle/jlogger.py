@@ -1,11 +1,16 @@
 import logging
 import os
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from typing import Union
 
 import yaml
 from filelock import FileLock, Timeout
 
 LOGS = {}
+# Per thread log override, see redirect
+_LOCAL = threading.local()
 
 
 @dataclass
@@ -14,6 +19,8 @@ class RootLog:
     warnings: list = field(default_factory=lambda: [])
     errors: list = field(default_factory=lambda: [])
     files: list = field(default_factory=lambda: [])
+    stats: dict = field(default_factory=lambda: {})
+    state: str = 'completed'
 
 
 class RootJobLogger(object):
@@ -25,7 +32,15 @@ class RootJobLogger(object):
         log (RootLog): log data class
     """
     def __init__(self, log: RootLog) -> None:
-        self.log = log
+        self.root_log = log
+
+    @property
+    def log(self) -> RootLog:
+        """Job log entries are added to, the redirected log of the calling
+        thread if set
+        """
+        log = getattr(_LOCAL, 'log', None)
+        return self.root_log if log is None else log
 
     def clean(self) -> None:
         """Resets job log
@@ -34,6 +49,8 @@ class RootJobLogger(object):
         self.log.warnings = []
         self.log.errors = []
         self.log.files = []
+        self.log.stats = {}
+        self.log.state = 'completed'
 
     def info(self, *args, **kwargs) -> None:
         raise NotImplementedError("Info method of root logger not overloaded")
@@ -83,6 +100,23 @@ class RootJobLogger(object):
         """
         self.log.files.append(file_name)
 
+    def add_stat(self, key: str, value) -> None:
+        """Adds a job statistic to the record (e.g. disk usage)
+
+        Args:
+            key (str): name of the statistic
+            value: yaml serializable value
+        """
+        self.log.stats[key] = value
+
+    def set_state(self, state: str) -> None:
+        """Sets how the job ended (e.g. completed, cancelled, timeout)
+
+        Args:
+            state (str): job end state
+        """
+        self.log.state = state
+
     def write(self, file_path: str) -> None:
         """Writes job log to file
 
@@ -93,7 +127,9 @@ class RootJobLogger(object):
             "status": self.log.status,
             "warnings": self.log.warnings,
             "errors": self.log.errors,
-            "files": self.log.files
+            "files": self.log.files,
+            "stats": self.log.stats,
+            "state": self.log.state
         }
 
         lock = FileLock(file_path + '.lock')
@@ -156,3 +192,28 @@ def getLogger(
         LOGS[root] = RootLog()
 
     return JobLogger(name, LOGS[root])
+
+
+def active_log() -> Union[RootLog, None]:
+    """Log the calling thread is redirected to
+
+    Returns:
+        Union[RootLog, None]: redirected log, None if not redirected
+    """
+    return getattr(_LOCAL, 'log', None)
+
+
+@contextmanager
+def redirect(log: Union[RootLog, None]):
+    """Redirects job log entries of the calling thread to another log, used
+    for work that runs in the background while other jobs are recorded.
+
+    Args:
+        log (Union[RootLog, None]): log to record to, None for the root log
+    """
+    previous = getattr(_LOCAL, 'log', None)
+    _LOCAL.log = log
+    try:
+        yield log
+    finally:
+        _LOCAL.log = previous
@@ -1,24 +1,66 @@
 import functools
+import inspect
 import os
-from decimal import Decimal
-from shutil import rmtree
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 
-from .jlogger import getLogger
+import numpy as np
+
+from .casemeta import CaseMeta
+from .foamdict import (
+    FoamDict, active_transaction, edit_dict, format_value, join_transaction,
+    read_dict, write_dict
+)
+from .jlogger import active_log, getLogger, redirect
+from .pruners import get_reaper, move_to_trash
+from .utils import get_time_folders
 
 logger = getLogger(__name__)
 
 FUNCTION_SUCCESS = True
 FUNCTION_ERROR = False
 
+# Bound on threads editing processor folders at once
+MAX_MOD_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+_POOL = None
+
+
+def _mod_pool() -> ThreadPoolExecutor:
+    """Shared thread pool used to edit processor folders concurrently
+
+    Returns:
+        ThreadPoolExecutor: thread pool
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = ThreadPoolExecutor(max_workers=MAX_MOD_WORKERS)
+    return _POOL
+
+
+def parallel_safe(func):
+    """Decorator marking mods that handle processor folders themselves and
+    accept the serial keyword of parallelmod
+    """
+    func.parallel = True
+    return func
+
 
 def parallelmod(func):
     """Decorator for mods to edit files in parallel folders if present
-    Removes requirement of decomposing/reconstructing domain between runs
+    Removes requirement of decomposing/reconstructing domain between runs.
+    Both processorN folders and collated processors<N> folders are edited,
+    concurrently on a bounded thread pool.
+
+    The wrapped mod accepts an extra keyword serial. The serial case is
+    edited if the environment is not decomposed, if serial is True (e.g.
+    the domain will be decomposed again) or if editing a processor folder
+    failed.
     """
     @functools.wraps(func)
     def parallel_mod_wrapper(
         *args,
+        serial: bool = False,
         **kwargs,
     ) -> bool:
         # Modify env_dir to sub process folders
@@ -29,14 +71,20 @@ def parallelmod(func):
             return FUNCTION_ERROR
 
         # Get process folders
-        proc_folders = [os.path.join(env_dir, f) for f in os.listdir(env_dir) \
-                         if f.startswith('processor') and os.path.isdir(os.path.join(env_dir, f))]
+        meta = CaseMeta.get(env_dir)
+        proc_folders = meta.proc_folders + meta.collated_folders
 
-        # Decomposed environment
-        output = FUNCTION_SUCCESS
-        if len(proc_folders) > 0:
-            # If process folders present loop through them
-            for proc_f in proc_folders:
+        if len(proc_folders) == 0:
+            # Non-decomposed environment
+            return func(*args, **kwargs)
+
+        # Workers record to the same job log and edit files in the same
+        # transaction as the caller
+        log = active_log()
+        transaction = active_transaction()
+
+        def proc_mod(proc_f: str) -> bool:
+            with redirect(log), join_transaction(transaction):
                 logger.info(
                     'Modifying process folder {:s}.'.format(
                         os.path.basename(os.path.normpath(proc_f))
@@ -44,23 +92,83 @@ def parallelmod(func):
                 )
                 mkwargs = kwargs.copy()
                 mkwargs['env_dir'] = proc_f
-
-                if not func(*args, **mkwargs):
-                    logger.warning(
-                        'Failed modding process folder {:s}.'.format(proc_f)
+                return func(*args, **mkwargs)
+
+        # Decomposed environment, edit process folders concurrently and
+        # collect failures of each folder
+        futures = {
+            proc_f: _mod_pool().submit(proc_mod, proc_f)
+            for proc_f in proc_folders
+        }
+        failed = []
+        for proc_f, future in futures.items():
+            try:
+                if not future.result():
+                    failed.append(proc_f)
+            except Exception as e:
+                logger.warning(
+                    'Exception modding process folder {:s}: {}'.format(
+                        proc_f, e
                     )
-                    output = FUNCTION_ERROR
+                )
+                failed.append(proc_f)
 
-        # Non-decomposed environment or failure, always try this in case of decompose force
-        output_serial = func(*args, **kwargs)
+        if len(failed) == 0 and not serial:
+            return FUNCTION_SUCCESS
 
-        if not output:
+        for proc_f in failed:
+            logger.warning('Failed modding process folder {:s}.'.format(proc_f))
+
+        if len(failed) > 0:
             logger.warning('Failed editting process folders.')
-            output = output_serial
 
-        return output
+        # Serial case is needed if decomposing again or for failures
+        return func(*args, **kwargs)
+
+    # Advertise the serial keyword in the signature of the wrapped mod
+    signature = inspect.signature(func)
+    parallel_mod_wrapper.__signature__ = signature.replace(
+        parameters=list(signature.parameters.values()) + [
+            inspect.Parameter(
+                'serial', inspect.Parameter.KEYWORD_ONLY, default=False
+            )
+        ]
+    )
+    return parallel_safe(parallel_mod_wrapper)
+
+
+def write_table(table_file: str, table: List) -> bool:
+    """Writes an OpenFOAM table file, a list of (time value) rows. The file
+    is left untouched if its contents would not change.
+
+    Args:
+        table_file (str): Path of table file
+        table (List): List of [time, value] rows, values are scalars or vectors
 
-    return parallel_mod_wrapper
+    Returns:
+        bool: File was written
+    """
+    rows = [
+        '    ({:.10g} {:s})'.format(
+            float(time), format_value(
+                [float(v) for v in value] if isinstance(value, (list, tuple))
+                else float(value)
+            )
+        ) for time, value in table
+    ]
+    data = '(\n' + '\n'.join(rows) + '\n)\n'
+
+    if os.path.exists(table_file):
+        with open(table_file, 'r') as file:
+            if file.read() == data:
+                return False
+
+    # Replaced atomically, a running solver may be reading the table
+    tmp_file = '{:s}.{:d}.tmp'.format(table_file, threading.get_ident())
+    with open(tmp_file, 'w') as file:
+        file.write(data)
+    os.replace(tmp_file, table_file)
+    return True
 
 
 class OpenFoamMods:
@@ -87,29 +195,20 @@ class OpenFoamMods:
             logger.error('Could not find controlDict file to edit.')
             return FUNCTION_ERROR
 
-        # Read in lines
-        with open(control_file, 'r') as file:
-            lines = file.readlines()
-
         # Edit props in control dict
+        control = read_dict(control_file)
         output = FUNCTION_SUCCESS
         for k, v in props.items():
-            edited = False
-            for i, line in enumerate(lines):
-                if line.lstrip().startswith(k):
-                    lines[i] = "{:s}\t\t\t{:s};\n".format(k, str(v))
-                    edited = True
-                    break
-
-            if not edited:
+            if not k in control.keys():
                 logger.warning(
                     'Prop {:s} not present in control dict.'.format(k)
                 )
                 output = FUNCTION_ERROR
+                continue
+            control[k] = v
 
         # Write to file
-        with open(control_file, 'w') as file:
-            file.writelines(lines)
+        write_dict(control_file, control)
 
         return output
 
@@ -134,29 +233,20 @@ class OpenFoamMods:
             logger.error('Could not find decomposeParDict file to edit.')
             return FUNCTION_ERROR
 
-        # Read in lines
-        with open(control_file, 'r') as file:
-            lines = file.readlines()
-
-        # Edit props in control dict
+        # Edit props in decompose dict
+        decompose = read_dict(control_file)
         output = FUNCTION_SUCCESS
         for k, v in props.items():
-            edited = False
-            for i, line in enumerate(lines):
-                if line.lstrip().startswith(k):
-                    lines[i] = "{:s}\t\t\t{:s};\n".format(k, str(v))
-                    edited = True
-                    break
-
-            if not edited:
+            if not k in decompose.keys():
                 logger.warning(
                     'Prop {:s} not present in decompose dict.'.format(k)
                 )
                 output = FUNCTION_ERROR
+                continue
+            decompose[k] = v
 
         # Write to file
-        with open(control_file, 'w') as file:
-            file.writelines(lines)
+        write_dict(control_file, decompose)
 
         return output
 
@@ -183,18 +273,18 @@ class OpenFoamMods:
             )
             return FUNCTION_ERROR
 
-        # Read in lines
-        with open(transport_file, 'r') as file:
-            lines = file.readlines()
+        transport = read_dict(transport_file)
+        if not 'nu' in transport.keys():
+            logger.error('Viscosity nu not present in transportProperties.')
+            return FUNCTION_ERROR
 
-        # Find one with viscosity setting (nu)
-        for i, line in enumerate(lines):
-            if 'nu' in line:
-                lines[i] = 'nu\t\t\t\t {:.08f};'.format(visc)
+        # Keep dimensions of old style entries (nu [0 2 -1 0 0 0 0] 0.01)
+        nu = transport['nu']
+        dims = nu[:nu.rfind(']') + 1] + ' ' if ']' in nu else ''
+        transport['nu'] = '{:s}{:.08f}'.format(dims, visc)
 
         # Write to file
-        with open(transport_file, 'w') as file:
-            file.writelines(lines)
+        write_dict(transport_file, transport)
 
         return FUNCTION_SUCCESS
 
@@ -229,45 +319,78 @@ class OpenFoamMods:
             )
             return FUNCTION_ERROR
 
-        # Read in text
-        with open(field_file, 'r') as file:
-            text = file.read()
+        def edit(field_dict: FoamDict) -> bool:
+            if not ['boundaryField', boundary] in field_dict:
+                logger.error('Boundary {:s} not valid.'.format(boundary))
+                return False
+            field_dict[['boundaryField', boundary]] = props
+            return True
 
-        # Find boundary to edit
-        start_index = text.find(boundary)
-        if start_index == -1:
-            logger.error('Boundary {:s} not valid.'.format(boundary))
+        # Collated files are edited block by block
+        if not edit_dict(field_file, edit):
             return FUNCTION_ERROR
 
-        # Search for closing curly bracket
-        curly_stack = 0
-        end_index = -1
-        for i in range(start_index, len(text)):
-            if text[i] == "{":
-                curly_stack += 1
-            elif text[i] == "}":
-                curly_stack -= 1
-                if curly_stack == 0:
-                    end_index = i
-                    break
-
-        if end_index == -1:
-            logger.error('Curly bracket problem detected.')
-            return FUNCTION_ERROR
+        return FUNCTION_SUCCESS
 
-        # Create editted prop string
-        new_prop = "{:s}\n\t{{\n".format(boundary)
-        for k, v in props.items():
-            new_prop += "\t\t{:s}\t\t{:s};\n".format(k, v)
-        new_prop += "\t}"
+    @classmethod
+    @parallel_safe
+    def set_boundary_table(
+        cls,
+        field: str,
+        boundary: str,
+        time_step: int,
+        entry: str,
+        table: List,
+        props: Dict = None,
+        out_of_bounds: str = 'clamp',
+        *,
+        env_dir: str,
+        serial: bool = False
+    ) -> bool:
+        """Sets a time-varying boundary entry from a table file. The table is
+        written once to constant/tables of the case and the boundary points
+        to it with tableFile, so updating the schedule only rewrites the
+        table regardless of the number of processors.
+
+        Args:
+            field (str): Name of the field to edit
+            boundary (str): Name of mesh region to edit
+            time_step (int): Time-step to edit
+            entry (str): Function1 entry of the boundary (e.g. uniformValue, omega)
+            table (List): List of [time, value] rows, values are scalars or vectors
+            props (Dict, optional): Other properties of the boundary (e.g. type). Defaults to None.
+            out_of_bounds (str, optional): Behaviour outside the table times. Defaults to 'clamp'.
+            env_dir (str): Path to OpenFOAM simulation folder. Forced keyword.
+            serial (bool, optional): Edit the serial case of decomposed environments. Defaults to False.
 
-        text = text[:start_index] + new_prop + text[end_index + 1:]
+        Returns:
+            bool: Successful modification
+        """
+        logger.info(
+            'Setting {:s} boundary {:s} table.'.format(field, boundary)
+        )
 
-        # Write text
-        with open(field_file, 'w') as file:
-            file.write(text)
+        if len(table) == 0:
+            logger.error('Boundary table needs at least one row.')
+            return FUNCTION_ERROR
 
-        return FUNCTION_SUCCESS
+        table_dir = os.path.join(env_dir, 'constant', 'tables')
+        table_name = '{:s}.{:s}'.format(field, boundary)
+        os.makedirs(table_dir, exist_ok=True)
+        write_table(os.path.join(table_dir, table_name), table)
+
+        # Solvers of decomposed cases resolve $FOAM_CASE to this folder
+        boundary_props = {} if props is None else dict(props)
+        boundary_props[entry] = 'tableFile'
+        boundary_props[entry + 'Coeffs'] = {
+            'file': '"$FOAM_CASE/constant/tables/{:s}"'.format(table_name),
+            'outOfBounds': out_of_bounds
+        }
+        # Unchanged field files are not rewritten
+        return cls.set_boundary(
+            field, boundary, time_step, boundary_props, env_dir=env_dir,
+            serial=serial
+        )
 
     @classmethod
     @parallelmod
@@ -290,34 +413,37 @@ class OpenFoamMods:
         """
         logger.info('Cleaning up current saved time-step folders.')
 
-        # Get saved time-steps
-        time_folders = [f for f in os.listdir(env_dir) if f.replace('.','',1).isnumeric() \
-                        and os.path.isdir(os.path.join(env_dir, f))]
-
-        # Sort and remove any time state are to be kept
-        time_folders.sort()
-        if not save_times is None:
-            for time in save_times:
-                try:
-                    time_folders.remove(str(time))
-                except ValueError:
-                    pass
-
-        # Loop through numeric folders and delete any not on desired interval
-        for time_step in time_folders:
-            if not Decimal(time_step) % Decimal(str(save_interval)) == 0:
-                folder_path = os.path.join(env_dir, time_step)
-                try:
-                    logger.info(
-                        'Deleting time-step folder {:s}.'.format(time_step)
-                    )
-                    rmtree(folder_path)
-                except OSError as e:
-                    logger.error(
-                        'Issue deleting time-step folder: {:s}'.format(
-                            e.strerror
-                        )
-                    )
-                    return FUNCTION_ERROR
+        time_folders = get_time_folders(env_dir)
+        if len(time_folders) == 0:
+            return FUNCTION_SUCCESS
+
+        # Keep time-steps on the save interval or listed in the save times,
+        # with a tolerance for the precision time folders are written with
+        times = np.array([float(f) for f in time_folders])
+        ratio = times / float(save_interval)
+        keep = np.isclose(ratio, np.round(ratio), rtol=0., atol=1e-6)
+        if not save_times is None and len(save_times) > 0:
+            keep |= np.isclose(
+                times[:, None],
+                np.array(save_times, dtype=float)[None, :],
+                rtol=0.,
+                atol=1e-8
+            ).any(axis=1)
+        doomed = [f for f, k in zip(time_folders, keep) if not k]
+
+        # Move folders out of the case now, delete them in the background
+        try:
+            trash_dir = move_to_trash(env_dir, doomed)
+        except OSError as e:
+            logger.error(
+                'Issue deleting time-step folder: {:s}'.format(e.strerror)
+            )
+            return FUNCTION_ERROR
+        get_reaper().reap(trash_dir)
+        logger.info(
+            'Deleting {:d} time-step folders: {:s}'.format(
+                len(doomed), ', '.join(doomed)
+            )
+        )
 
         return FUNCTION_SUCCESS
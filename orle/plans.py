@@ -0,0 +1,134 @@
+import hashlib
+import inspect
+import json
+import threading
+from typing import Dict, List, Tuple, Union
+
+from .jlogger import getLogger
+from .mods import OpenFoamMods
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Compiled plans keyed by the structural hash of their mod list
+_PLANS = {}
+_PLANS_LOCK = threading.Lock()
+
+
+def config_shape(config: Config) -> Config:
+    """Structure of a config with every value replaced by its type. Jobs of
+    an environment that only differ in numbers (times, actions, etc.) have
+    the same shape.
+
+    Args:
+        config (Config): config object
+
+    Returns:
+        Config: shape of config
+    """
+    if isinstance(config, dict):
+        return {str(k): config_shape(v) for k, v in config.items()}
+    if isinstance(config, (list, tuple)):
+        return 'list'
+    if isinstance(config, bool):
+        return 'bool'
+    if isinstance(config, (int, float)):
+        return 'number'
+    return type(config).__name__
+
+
+def shape_hash(mods: List) -> str:
+    """Structural hash of a mod list
+
+    Args:
+        mods (List): list of mod configs
+
+    Returns:
+        str: hash hex digest
+    """
+    # Function names are part of the structure, other values are not
+    shape = json.dumps(
+        [[mod['func'], config_shape(mod['params'])] for mod in mods],
+        sort_keys=True
+    )
+    return hashlib.sha1(shape.encode()).hexdigest()
+
+
+class ModPlan(object):
+    """A mod list compiled into resolved callables. Compiling checks that
+    every mod exists and that its params bind to the mod's signature, so
+    jobs with the same shape are validated once and later jobs only pass
+    their values to the precomputed steps. Use ModPlan.compile to get the
+    cached plan of a mod list.
+
+    Args:
+        steps (List[Tuple[str, Callable, bool]]): name, function and parallel flag of each mod
+    """
+    def __init__(self, steps: List) -> None:
+        """Constructor
+        """
+        self.steps = steps
+
+    @classmethod
+    def compile(cls, mods: List) -> Union['ModPlan', None]:
+        """Compiles a mod list, reusing the plan of a previous list with the
+        same shape
+
+        Args:
+            mods (List): list of mod configs
+
+        Returns:
+            Union[ModPlan, None]: compiled plan, None if the mod list is invalid
+        """
+        key = shape_hash(mods)
+        with _PLANS_LOCK:
+            if key in _PLANS:
+                return _PLANS[key]
+
+        steps = []
+        for mod in mods:
+            if not hasattr(OpenFoamMods, mod['func']):
+                logger.error(
+                    'Mod {:s} not currently supported.'.format(mod['func'])
+                )
+                return None
+            func = getattr(OpenFoamMods, mod['func'])
+            parallel = getattr(func, 'parallel', False)
+
+            # Check params once for this shape of job
+            kwargs = {'env_dir': ''}
+            if parallel:
+                kwargs['serial'] = False
+            try:
+                inspect.signature(func).bind(**mod['params'], **kwargs)
+            except TypeError as e:
+                logger.error(
+                    'Invalid params for mod {:s}: {}'.format(mod['func'], e)
+                )
+                return None
+            steps.append((mod['func'], func, parallel))
+
+        plan = cls(steps)
+        with _PLANS_LOCK:
+            _PLANS[key] = plan
+        return plan
+
+    def apply(self, mods: List, env_dir: str, serial: bool) -> bool:
+        """Runs the plan with the params of a mod list of the same shape
+
+        Args:
+            mods (List): list of mod configs
+            env_dir (str): Path to OpenFOAM simulation folder
+            serial (bool): Parallel mods edit the serial case
+
+        Returns:
+            bool: Successful modification
+        """
+        cleared = 1
+        for (_, func, parallel), mod in zip(self.steps, mods):
+            kwargs = {'serial': serial} if parallel else {}
+            out = func(**mod['params'], **kwargs, env_dir=env_dir)
+            cleared = cleared * out
+
+        return bool(cleared)
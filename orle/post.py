@@ -1,10 +1,14 @@
 import os
 import re
-from typing import Dict, List, Tuple, Union
+from typing import Callable, Dict, List, Tuple, Union
 
 import numpy as np
 
+from .foamfile import (
+    read_internal_field, read_label_list, read_n_cells, read_texts
+)
 from .jlogger import getLogger
+from .utils import get_collated_folders, get_proc_folders
 
 logger = getLogger(__name__)
 
@@ -12,10 +16,25 @@ FUNCTION_ERROR = None
 FILE_NAMES = {
     'get_forces': 'forces',
     'get_coeff': 'coeff',
-    'get_probes': 'probes'
+    'get_probes': 'probes',
+    'get_field': 'field'
 }
 
 
+def serial_fields(fields: Callable[[Dict], Tuple[float, List[str]]]):
+    """Decorator declaring the serial fields a post function reads, which
+    are reconstructed first if the job reconstructs lazily
+
+    Args:
+        fields (Callable): maps the post params to the time-step and names of the fields
+    """
+    def decorator(func):
+        func.serial_fields = fields
+        return func
+
+    return decorator
+
+
 class OpenFoamPost:
     @classmethod
     def get_forces(cls, function_name: str, time_step: int, *,
@@ -253,3 +272,73 @@ class OpenFoamPost:
                 probes.append(probe_step)
 
         return {'times': np.array(times), 'probes': np.array(probes)}
+
+    @classmethod
+    @serial_fields(lambda params: (params['time_step'], [params['field']]))
+    def get_field(cls, field: str, time_step: int, *,
+                  env_dir: str) -> Union[Dict, None]:
+        """Extracts the internal field values at a time-step. The serial case
+        is read if present, otherwise the processor folders (uncollated or
+        collated) are read and mapped back to the global cell order.
+
+        Args:
+            field (str): Name of the field
+            time_step (int): time-step to read
+            env_dir (str): Path to OpenFOAM simulation folder. Forced keyword.
+
+        Returns:
+            Dict: Dictionary of numpy arrays
+        """
+        logger.info('Getting {:s} field from OpenFOAM simulation.'.format(field))
+
+        time_name = '{:g}'.format(time_step)
+        field_file = os.path.join(env_dir, time_name, field)
+        if os.path.exists(field_file):
+            text = read_texts(field_file)[0]
+            n_cells = None
+            if not 'nonuniform' in text:
+                owner_file = os.path.join(
+                    env_dir, 'constant', 'polyMesh', 'owner'
+                )
+                n_cells = read_n_cells(read_texts(owner_file)[0])
+            return {
+                'time': time_step,
+                'field': read_internal_field(text, n_cells)
+            }
+
+        # Pair field and cell addressing of each processor
+        parts = []
+        proc_folders = get_collated_folders(env_dir)
+        if len(proc_folders) == 0:
+            proc_folders = get_proc_folders(env_dir)
+        for proc_f in proc_folders:
+            field_file = os.path.join(proc_f, time_name, field)
+            addr_file = os.path.join(
+                proc_f, 'constant', 'polyMesh', 'cellProcAddressing'
+            )
+            if os.path.exists(field_file) and os.path.exists(addr_file):
+                parts.extend(
+                    zip(read_texts(field_file), read_texts(addr_file))
+                )
+
+        if len(parts) == 0:
+            logger.error(
+                'Could not find {:s} field at time-step {:s}.'.format(
+                    field, time_name
+                )
+            )
+            return FUNCTION_ERROR
+
+        addressing = [read_label_list(addr) for _, addr in parts]
+        values = [
+            read_internal_field(text, len(addr))
+            for (text, _), addr in zip(parts, addressing)
+        ]
+        output = np.zeros(
+            (sum([len(addr) for addr in addressing]), values[0].shape[1])
+        )
+        for addr, value in zip(addressing, values):
+            output[addr] = value
+
+        return {'time': time_step, 'field': output}
+
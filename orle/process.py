@@ -1,20 +1,33 @@
+import logging
 import os
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Union
 
+import yaml
 from filelock import FileLock, Timeout
 
+from .affinity import get_allocator
 from .builders import EnvironmentBuilder
 from .cleaners import EnvironmentCleaner
 from .collectors import EnvironmentCollector
-from .foam import FOAMRunner
-from .jlogger import getLogger
+from .decomposition import DecompositionCache
+from .foam import STOPPED, FOAMRunner, run_batch
+from .jlogger import RootJobLogger, RootLog, getLogger, redirect
+from .pruners import DiskPruner
+from .replay import ReplayRunner
+from .surrogate import SurrogateRunner
+from .tuning import choose_np
+from .utils import env_lock
 
 logger = getLogger(__name__)
 
 Config = Union[Dict, List, Tuple]
 
+# Runners answering jobs without OpenFOAM, selected with params/backend
+BACKENDS = {'surrogate': SurrogateRunner, 'replay': ReplayRunner}
+
 
 class OrleProcess(object):
     """A ORLE process for running environments
@@ -30,6 +43,27 @@ class OrleProcess(object):
         self.job_file = None
         self.job_config = None
         self.env_dir = None
+        self.env_lock = None
+        # Wall clock start of the current job, for its deadline
+        self.job_start = None
+
+        # Clean up runs in the background after the job result is published.
+        # Pending clean ups hold their environment's lock until finished
+        self.clean_pool = ThreadPoolExecutor(max_workers=1)
+        self.pending_cleans = {}
+        # Decomposed meshes shared by the environments of the world
+        self.decompose_cache = None
+        if self.config.get('decompose_cache', True):
+            self.decompose_cache = DecompositionCache.of_world(self.config)
+
+        # Background pruner enforcing the world's disk quota
+        self.pruner = None
+        if 'disk_quota' in self.config.keys():
+            self.pruner = DiskPruner(
+                self.config,
+                self.config['disk_quota'],
+                interval=self.config.get('prune_interval', 30.)
+            )
 
     def start(self, dt: int = 0.1) -> None:
         """Start the process's activity
@@ -37,12 +71,31 @@ class OrleProcess(object):
         Args:
             dt (int, optional): Sleep interval between . Defaults to 0.1.
         """
+        if not self.pruner is None:
+            logger.info(
+                'Starting disk pruner with {:g} GB quota.'.format(
+                    self.config['disk_quota']
+                )
+            )
+            self.pruner.start()
+
         logger.info('Starting surveillance for job configs.')
         while True:
             # Sleep process before checking for config file again
             time.sleep(dt + 0.001 * random.random())
+            # Release environments whose clean up has finished
+            self.finish_cleans()
             # Check to see if job is available
             if self.search():
+                jobs = self.search_batch()
+                if len(jobs) > 1:
+                    # Run compatible jobs in one mpirun
+                    self.run_batch(jobs)
+                    logger.info(
+                        'Done processing batch of {:d} jobs, resuming surveillance.'
+                        .format(len(jobs))
+                    )
+                    continue
                 # Run job
                 self.run()
                 # Clean up
@@ -85,32 +138,232 @@ class OrleProcess(object):
 
         return False
 
+    def search_batch(self) -> List[Tuple[str, FileLock]]:
+        """Gathers queued jobs that can run in one MPMD mpirun with the
+        acquired job, up to the world's batch_size. Batched jobs run the same
+        solver with the same arguments in parallel in different
+        environments.
+
+        Returns:
+            List[Tuple[str, FileLock]]: job file and lock of each job of the batch, starting with the acquired job
+        """
+        jobs = [(self.job_file, self.lock)]
+        batch_size = self.config.get('batch_size', 1)
+        if batch_size < 2:
+            return jobs
+
+        config = self.peek_job(self.job_file)
+        key = self.batch_key(config)
+        if key is None:
+            return jobs
+        env_ids = [config['id']]
+
+        filenames = sorted(
+            f for f in os.listdir(self.config['job_dir'])
+            if f.endswith('.yml')
+        )
+        for filename in filenames:
+            if len(jobs) >= batch_size:
+                break
+            file_path = os.path.join(self.config['job_dir'], filename)
+            if file_path == self.job_file:
+                continue
+            config = self.peek_job(file_path)
+            if self.batch_key(config) != key or config['id'] in env_ids:
+                continue
+
+            lock = FileLock(file_path + '.lock')
+            try:
+                lock.acquire(timeout=0.1)
+            except Timeout:
+                continue
+            # Job may have been finished by another process meanwhile
+            if not os.path.exists(file_path):
+                lock.release()
+                continue
+            logger.info('Batched job config {:s}'.format(filename))
+            jobs.append((file_path, lock))
+            env_ids.append(config['id'])
+
+        return jobs
+
+    def peek_job(self, file_path: str) -> Union[Config, None]:
+        """Reads a job config without setting up its environment
+
+        Args:
+            file_path (str): path to job config
+
+        Returns:
+            Union[Config, None]: job config, None if it can not be read
+        """
+        try:
+            with open(file_path, 'r') as stream:
+                config = yaml.safe_load(stream)
+        except (OSError, yaml.YAMLError):
+            return None
+        if not isinstance(config, dict) or not 'id' in config:
+            return None
+        return config
+
+    def batch_key(self, config: Config) -> Union[Tuple, None]:
+        """Key of the jobs a job can be batched with
+
+        Args:
+            config (Config): job config
+
+        Returns:
+            Union[Tuple, None]: batch key, None if the job can not be batched
+        """
+        if config is None or not isinstance(config.get('params', None), dict):
+            return None
+        params = config['params']
+        # Serial runs and other backends are not launched through mpirun
+        # here
+        if not isinstance(params.get('np', None), int) or params['np'] < 2 \
+                or params.get('backend', 'foam') != 'foam':
+            return None
+        return (
+            params.get('solver', None), params.get('args', ''),
+            params.get('file_handler', None), params.get('foam_bashrc', None)
+        )
+
     def run(self) -> None:
         """Set up and run environment job
         """
         # Reset output file logger
         logger.clean()
+        self.job_start = time.time()
 
         output_flag = self.job_setup()
         if not output_flag:
             logger.error('Failed job set up, terminating run.')
             return
+        if self.job_stop():
+            return
 
         output_flag = self.job_sim()
         if not output_flag:
             logger.error('Failed job execution, terminating run.')
             return
+        if self.job_stop():
+            return
 
         output_flag = self.job_post()
         if not output_flag:
             logger.error('Failed post processing, terminating run.')
             return
 
+        # Result is published, clean up in the background
         output_flag = self.job_clean()
         if not output_flag:
             logger.error('Failed clean up, terminating run.')
             return
 
+    def run_batch(self, jobs: List[Tuple[str, FileLock]]) -> None:
+        """Sets up and runs a batch of environment jobs. Every job is set up,
+        post processed and recorded on its own, only the solver runs are
+        launched together in one MPMD mpirun. Jobs left incomplete by the
+        batch are restarted on their own. If a job of the batch is cancelled
+        or times out, the batch is stopped and its other jobs are put back in
+        the queue.
+
+        Args:
+            jobs (List[Tuple[str, FileLock]]): job file and lock of each job
+        """
+        logger.clean()
+        batch = []
+        for job_file, lock in jobs:
+            self.job_file, self.lock = job_file, lock
+            self.job_config, self.env_dir, self.env_lock = None, None, None
+            log = RootLog(status=0)
+            with redirect(log):
+                self.job_start = time.time()
+                ready = self.job_setup()
+                if not ready:
+                    logger.error('Failed job set up, terminating run.')
+                elif self.job_stop():
+                    ready = False
+            batch.append([self.job_state(), log, ready, None])
+
+        # Decompose every environment, then launch the batch
+        for job in batch:
+            state, log, ready, _ = job
+            if not ready:
+                continue
+            self.load_job(state)
+            with redirect(log):
+                job[3] = self.make_runner()
+                self.pin_cores(job[3])
+                job[3].decompose()
+
+        runners = [job[3] for job in batch if not job[3] is None]
+        returncode = None
+        if len(runners) > 0:
+            states = [job[0] for job in batch if not job[3] is None]
+            with redirect(batch[0][1]):
+                returncode = run_batch(
+                    runners, watch=lambda: self.check_batch_stop(states)
+                )
+
+        for state, log, ready, runner in batch:
+            self.load_job(state)
+            if ready and returncode == STOPPED and self.check_stop() is None:
+                # Stopped for another job of the batch, run again later
+                self.requeue()
+                continue
+            with redirect(log):
+                if ready:
+                    self.job_finish(runner, returncode)
+            self.clean()
+
+    def job_finish(self, runner: FOAMRunner, returncode: int) -> None:
+        """Completes a job of a batch after the batched solver run
+
+        Args:
+            runner (FOAMRunner): runner of the job
+            returncode (int): return code of the batch
+        """
+        logger.add_stat('batch', True)
+        runner.solve(
+            retries=self.job_config['params'].get('retries', 2),
+            backoff=self.job_config['params'].get('retry_backoff', 5.),
+            returncode=returncode
+        )
+        self.unpin_cores()
+        self.record_sim(runner)
+        if self.job_stop():
+            return
+
+        if not self.job_post():
+            logger.error('Failed post processing, terminating run.')
+            return
+        if not self.job_clean():
+            logger.error('Failed clean up, terminating run.')
+
+    def job_state(self) -> Dict:
+        """State of the current job, to switch between the jobs of a batch
+
+        Returns:
+            Dict: job state
+        """
+        return {
+            'lock': self.lock,
+            'job_file': self.job_file,
+            'job_config': self.job_config,
+            'env_dir': self.env_dir,
+            'env_lock': self.env_lock,
+            'job_start': self.job_start
+        }
+
+    def load_job(self, state: Dict) -> None:
+        """Makes a job of a batch the current job
+
+        Args:
+            state (Dict): job state
+        """
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def clean(self) -> None:
         """Cleans up configs
         """
@@ -124,6 +377,36 @@ class OrleProcess(object):
 
         os.rename(self.job_file, self.job_file + ".old.{:d}".format(old_count))
 
+        # Remove cancel marker of the job
+        cancel_file = self.cancel_file()
+        if not cancel_file is None and os.path.exists(cancel_file):
+            os.remove(cancel_file)
+
+        self.release()
+
+    def requeue(self) -> None:
+        """Puts the current job back in the queue without recording it, its
+        job file is left in place for the next search
+        """
+        # Plain logger, the job record is not written
+        logging.getLogger(__name__).warning(
+            'Batch stopped, job {:s} put back in the queue.'.format(
+                str(self.job_config['hash'])
+            )
+        )
+        self.unpin_cores()
+        self.release()
+
+    def release(self) -> None:
+        """Releases the environment and the job file of the current job
+        """
+        # Release the environment for other processes and the pruner
+        if not self.env_lock is None:
+            self.env_lock.release()
+            self.env_lock = None
+        if not self.pruner is None:
+            self.pruner.wake()
+
         # Now release lock
         # Need to force because of double acquire
         self._lock_counter = 1
@@ -146,29 +429,232 @@ class OrleProcess(object):
         self.env_dir = env_builder.env_dir
         self.job_config = env_builder.config
 
+        # Wait for clean up of the previous job in this environment
+        self.finish_clean(self.env_dir, wait=True)
+
+        # Hold the environment so it is not pruned or edited while running
+        self.env_lock = env_lock(self.env_dir)
+        self.env_lock.acquire()
+
         # Make sure necessary params are in the config
         if not env_builder.validate_config():
             return False
+        if self.job_config['params']['np'] == 'auto':
+            self.auto_np()
 
         logger.info(
             'Valid job config file file loaded. Setting up environment folder.'
         )
         return env_builder.setup_env()
 
+    def auto_np(self) -> None:
+        """Sets the number of processes and decomposition method of a job
+        with np: auto from the efficiency curve of its mesh, picking the
+        best throughput for the cores that are currently free
+        """
+        params = self.job_config['params']
+        free = get_allocator().free_cores()
+        choice = choose_np(self.config['world_dir'], self.env_dir, free)
+        if choice is None:
+            logger.warning(
+                'Mesh of environment is not tuned, running on 1 process.'
+            )
+            params['np'] = 1
+        else:
+            params['np'], method = choice
+            if not method is None:
+                params['decompose_method'] = method
+        logger.add_stat(
+            'np', {
+                'auto': True,
+                'free': free,
+                'np': params['np'],
+                'method': params.get('decompose_method', None)
+            }
+        )
+
     def job_sim(self) -> bool:
         """Runs openfoam simulation
 
         Returns:
             bool: Successful setup
         """
-        runner = FOAMRunner(self.job_config, self.env_dir)
+        backend = self.job_config['params'].get('backend', 'foam')
+        if backend != 'foam':
+            return self.job_backend(backend)
+
+        # Commands are killed if the job is cancelled or times out
+        runner = self.make_runner()
+        self.pin_cores(runner)
         # Decompose domain
         runner.decompose()
-        # Run simulation
+        # Run simulation, restarting incomplete runs from the latest
+        # complete time-step
+        runner.solve(
+            retries=self.job_config['params'].get('retries', 2),
+            backoff=self.job_config['params'].get('retry_backoff', 5.)
+        )
+        # Serial fields are reconstructed later, only if something reads them
+        self.unpin_cores()
+        self.record_sim(runner)
+
+        return True
+
+    def job_backend(self, backend: str) -> bool:
+        """Answers the job with a backend other than OpenFOAM
+
+        Args:
+            backend (str): name of the backend
+
+        Returns:
+            bool: Successful setup
+        """
+        if not backend in BACKENDS:
+            logger.error('Backend {:s} not supported.'.format(backend))
+            return False
+
+        logger.add_stat('backend', backend)
+        runner = BACKENDS[backend](self.job_config, self.env_dir, self.config)
         runner.run()
-        # Reconstruct domain if needed
-        runner.reconstruct()
+        self.record_sim(runner)
+        return True
+
+    def make_runner(self) -> FOAMRunner:
+        """Runner of the current job
+
+        Returns:
+            FOAMRunner: runner of the job
+        """
+        return FOAMRunner(
+            self.job_config,
+            self.env_dir,
+            watch=self.check_stop,
+            cache=self.decompose_cache
+        )
+
+    def pin_cores(self, runner: FOAMRunner) -> None:
+        """Assigns CPUs not used by other jobs of the node to the job, if the
+        world pins cores. The assignment is added to the job record.
+
+        Args:
+            runner (FOAMRunner): runner of the job
+        """
+        if not self.config.get('pin_cores', False):
+            return
+        runner.cpus = get_allocator().acquire(
+            self.core_owner(), self.job_config['params']['np']
+        )
+        logger.add_stat('cpus', runner.cpus)
+
+    def unpin_cores(self) -> None:
+        """Frees the CPUs of the job
+        """
+        if not self.config.get('pin_cores', False):
+            return
+        get_allocator().release(self.core_owner())
+
+    def core_owner(self) -> str:
+        """Name the CPUs of the current environment are held under
+
+        Returns:
+            str: <pid>:<env_dir>
+        """
+        return '{:d}:{:s}'.format(os.getpid(), os.path.abspath(self.env_dir))
+
+    def record_sim(self, runner: FOAMRunner) -> None:
+        """Adds the return codes and logs of a runner to the job record
+
+        Args:
+            runner (FOAMRunner): runner of the job
+        """
+        # Failed commands are recorded, post processing still writes the
+        # job record
+        logger.add_stat('returncodes', runner.returncodes)
+        logger.add_stat('logs', runner.logs)
+        for stage, returncode in runner.returncodes.items():
+            if not returncode in [0, STOPPED]:
+                logger.error(
+                    'Stage {:s} failed with return code {:d}.'.format(
+                        stage, returncode
+                    )
+                )
+
+    def cancel_file(self, job_config: Config = None) -> Union[str, None]:
+        """Path of the marker file an agent creates to cancel the job
+
+        Args:
+            job_config (Config, optional): job config. Defaults to the current job.
+
+        Returns:
+            Union[str, None]: <job_dir>/<hash>.cancel, None if no job is loaded
+        """
+        job_config = self.job_config if job_config is None else job_config
+        if job_config is None or not 'hash' in job_config:
+            return None
+        return os.path.join(
+            self.config['job_dir'], '{:s}.cancel'.format(
+                str(job_config['hash'])
+            )
+        )
+
+    def check_stop(self, state: Dict = None) -> Union[str, None]:
+        """Checks if the current job should be stopped, either because it
+        was cancelled or because it passed the deadline in its params
+
+        Args:
+            state (Dict, optional): state of a job of a batch. Defaults to the current job.
+
+        Returns:
+            Union[str, None]: cancelled or timeout, None if the job can continue
+        """
+        state = self.job_state() if state is None else state
+        cancel_file = self.cancel_file(state['job_config'])
+        if not cancel_file is None and os.path.exists(cancel_file):
+            return 'cancelled'
+
+        if state['job_config'] is None:
+            return None
+        deadline = state['job_config']['params'].get('deadline', None)
+        if not deadline is None and time.time(
+        ) - state['job_start'] > deadline:
+            return 'timeout'
+        return None
+
+    def check_batch_stop(self, states: List[Dict]) -> Union[str, None]:
+        """Checks if a batch should be stopped, as soon as any job of it
+        should be. The other jobs are put back in the queue after the batch.
+
+        Args:
+            states (List[Dict]): states of the jobs of the batch
+
+        Returns:
+            Union[str, None]: cancelled or timeout, None if the batch can continue
+        """
+        for state in states:
+            reason = self.check_stop(state)
+            if not reason is None:
+                return reason
+        return None
+
+    def job_stop(self) -> bool:
+        """Ends the job if it should be stopped, writing its completion record
+        without post processing or clean up
 
+        Returns:
+            bool: Job was stopped
+        """
+        reason = self.check_stop()
+        if reason is None:
+            return False
+
+        logger.set_state(reason)
+        logger.error('Job {:s}, terminating run.'.format(reason))
+        logger.write(
+            os.path.join(
+                self.config['output_dir'],
+                'output.{:s}.yml'.format(str(self.job_config['hash']))
+            )
+        )
         return True
 
     def job_post(self) -> bool:
@@ -178,8 +664,18 @@ class OrleProcess(object):
             bool: Successful setup
         """
 
+        if not self.pruner is None:
+            logger.add_stat('disk_usage', self.pruner.report(self.env_dir))
+
+        # Post functions reading serial fields reconstruct them on demand
+        reconstruct = None
+        if self.job_config['params']['reconstruct']:
+            reconstruct = self.make_runner().reconstruct
         collector = EnvironmentCollector(
-            self.job_config, self.env_dir, self.config['output_dir']
+            self.job_config,
+            self.env_dir,
+            self.config['output_dir'],
+            reconstruct=reconstruct
         )
 
         # Collect data
@@ -188,15 +684,78 @@ class OrleProcess(object):
         return out
 
     def job_clean(self) -> bool:
-        """Cleans openfoam simulation
+        """Queues clean up of the openfoam simulation. The job result is
+        already published, so clean up runs in the background and holds the
+        environment until it is done. Its log is kept out of the job record
+        and written to clean.<hash>.yml if it fails.
 
         Returns:
-            bool: Successful clean up
+            bool: Clean up queued
         """
-
         cleaner = EnvironmentCleaner(self.job_config, self.env_dir)
+        future = self.clean_pool.submit(self._clean, cleaner)
+        self.pending_cleans[self.env_dir] = (
+            future, self.env_lock, self.job_config['hash']
+        )
+        # Lock is released once the clean up finishes
+        self.env_lock = None
 
-        # Collect data
-        out = cleaner.clean()
+        return True
 
-        return out
+    def _clean(self, cleaner: EnvironmentCleaner) -> RootLog:
+        """Runs a clean up on the background executor
+
+        Args:
+            cleaner (EnvironmentCleaner): environment cleaner of the job
+
+        Returns:
+            RootLog: log of the clean up
+        """
+        log = RootLog(status=0)
+        with redirect(log):
+            try:
+                out = cleaner.clean()
+            except Exception as e:
+                logger.error('Exception during clean up: {}'.format(e))
+                out = False
+        if not out:
+            log.status = 1
+        return log
+
+    def finish_clean(self, env_dir: str, wait: bool = False) -> None:
+        """Releases the environment of a pending clean up once it has
+        finished
+
+        Args:
+            env_dir (str): Path to environment
+            wait (bool, optional): Block until the clean up is done. Defaults to False.
+        """
+        if not env_dir in self.pending_cleans:
+            return
+
+        future, lock, job_hash = self.pending_cleans[env_dir]
+        if not wait and not future.done():
+            return
+
+        log = future.result()
+        del self.pending_cleans[env_dir]
+        if not lock is None:
+            lock.release()
+
+        if log.status != 0:
+            # Plain logger, the failure is not part of the current job
+            logging.getLogger(__name__).warning(
+                'Clean up of job {:s} failed.'.format(str(job_hash))
+            )
+            RootJobLogger(log).write(
+                os.path.join(
+                    self.config['output_dir'],
+                    'clean.{:s}.yml'.format(str(job_hash))
+                )
+            )
+
+    def finish_cleans(self) -> None:
+        """Releases the environments of all finished clean ups
+        """
+        for env_dir in list(self.pending_cleans.keys()):
+            self.finish_clean(env_dir)
@@ -0,0 +1,459 @@
+import logging
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree
+from typing import Dict, List, Tuple, Union
+
+from filelock import FileLock, Timeout
+
+from .utils import env_lock, get_proc_folders, get_time_folders
+
+# The pruner runs in a background thread, so it uses a plain logger to avoid
+# adding its warnings to the record of whatever job is currently running.
+logger = logging.getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+GB = 1024**3
+
+# Folder of a case that deleted data is moved to before it is reaped
+TRASH_DIR = '.trash'
+_REAPER = None
+_REAPER_LOCK = threading.Lock()
+
+
+class DiskPruner(threading.Thread):
+    """Background thread that enforces a disk budget on a world folder.
+    Once the world exceeds its quota the oldest time-step, postProcessing
+    and log entries of idle environments are evicted until usage drops below
+    the low water mark. The initial and latest time-step of every
+    environment are always kept so simulations can restart.
+
+    Args:
+        world_config (Config): Initialized world configuration
+        quota (float): Disk budget of the world in GB
+        interval (float, optional): Seconds between pruning passes. Defaults to 30.
+        low_water (float, optional): Fraction of the quota to prune down to. Defaults to 0.9.
+    """
+    def __init__(
+        self,
+        world_config: Config,
+        quota: float,
+        interval: float = 30.,
+        low_water: float = 0.9
+    ) -> None:
+        """Constructor
+        """
+        super().__init__(daemon=True)
+        self.config = world_config
+        self.quota = int(quota * GB)
+        self.interval = interval
+        self.low_water = low_water
+
+        self.env_dirs = [
+            os.path.join(world_config['world_dir'], env['name'])
+            for env in world_config['envs']
+        ]
+        self.lock = FileLock(
+            os.path.join(world_config['world_dir'], '.pruner.lock')
+        )
+        # Sizes of directories that no longer change, keyed by path
+        self._sizes = {}
+        self._usage = {}
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        """Thread activity, prunes the world every interval or when woken
+        """
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.prune()
+            except OSError as e:
+                logger.error('Disk pruning pass failed: {}'.format(e))
+
+    def wake(self) -> None:
+        """Requests an immediate pruning pass
+        """
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Stops the pruning thread
+        """
+        self._stopped.set()
+        self._wake.set()
+
+    def usage(self) -> int:
+        """Total world disk usage from the last pruning pass
+
+        Returns:
+            int: Usage in bytes
+        """
+        return sum(self._usage.values())
+
+    def report(self, env_dir: str) -> Dict:
+        """Disk usage summary for a job record
+
+        Args:
+            env_dir (str): Path to environment the job ran in
+
+        Returns:
+            Dict: Usage of the environment and world, and the world quota in bytes
+        """
+        self._usage[env_dir] = self.env_usage(env_dir)
+        return {
+            'env': self._usage[env_dir],
+            'world': self.usage(),
+            'quota': self.quota
+        }
+
+    def prune(self) -> int:
+        """Updates disk usage and evicts old data if the world is over quota.
+        Only one process of a world prunes at a time and environments that
+        are locked by a running job are skipped.
+
+        Returns:
+            int: Number of bytes freed
+        """
+        world_dir = self.config['world_dir']
+        if not os.path.exists(world_dir):
+            return 0
+
+        for entry in os.scandir(world_dir):
+            if not entry.path in self.env_dirs:
+                self._usage[entry.path] = self._tree_size(entry.path)
+        for env_dir in self.env_dirs:
+            self._usage[env_dir] = self.env_usage(env_dir)
+
+        total = self.usage()
+        if total <= self.quota:
+            return 0
+
+        try:
+            self.lock.acquire(timeout=0)
+        except Timeout:
+            return 0
+
+        freed = 0
+        try:
+            logger.info(
+                'World using {:.2f} GB of {:.2f} GB quota, pruning.'.format(
+                    total / GB, self.quota / GB
+                )
+            )
+            freed = self._evict(total - int(self.low_water * self.quota))
+        finally:
+            self.lock.release()
+
+        logger.info('Pruned {:.2f} GB from world.'.format(freed / GB))
+        return freed
+
+    def env_usage(self, env_dir: str) -> int:
+        """Disk usage of an environment. Finished time-step folders and
+        finished postProcessing output are cached so only new or changing
+        data is rescanned.
+
+        Args:
+            env_dir (str): Path to environment
+
+        Returns:
+            int: Usage in bytes
+        """
+        if not os.path.exists(env_dir):
+            return 0
+
+        proc_folders = get_proc_folders(env_dir)
+        total = 0
+        for case_dir in [env_dir] + proc_folders:
+            # Only time-steps before the latest one are finished
+            finished = set(get_time_folders(case_dir)[:-1])
+            for entry in os.scandir(case_dir):
+                if entry.path in proc_folders:
+                    continue
+                if not entry.is_dir(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+                elif entry.name == 'postProcessing':
+                    total += self._post_usage(entry.path)
+                else:
+                    # The cache only sees the folder's own mtime, other
+                    # folders (e.g. logs, meshes) can be rewritten in place
+                    total += self._tree_size(
+                        entry.path, cache=entry.name in finished
+                    )
+
+        return total
+
+    def _post_usage(self, post_dir: str) -> int:
+        """Disk usage of the postProcessing folder of an environment. Only
+        the latest time-step folder of each function object is rescanned,
+        the earlier ones are finished.
+
+        Args:
+            post_dir (str): Path to postProcessing folder
+
+        Returns:
+            int: Usage in bytes
+        """
+        total = 0
+        for fo in os.scandir(post_dir):
+            if not fo.is_dir(follow_symlinks=False):
+                total += fo.stat(follow_symlinks=False).st_size
+                continue
+            finished = set(get_time_folders(fo.path)[:-1])
+            for entry in os.scandir(fo.path):
+                if entry.is_dir(follow_symlinks=False):
+                    total += self._tree_size(
+                        entry.path, cache=entry.name in finished
+                    )
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+
+        return total
+
+    def _tree_size(self, path: str, cache: bool = False) -> int:
+        """Recursive size of a directory
+
+        Args:
+            path (str): Directory path
+            cache (bool, optional): Cache the size keyed by the directory mtime. Defaults to False.
+
+        Returns:
+            int: Size in bytes
+        """
+        mtime = os.stat(path).st_mtime_ns
+        if cache and path in self._sizes and self._sizes[path][0] == mtime:
+            return self._sizes[path][1]
+
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for f in filenames:
+                try:
+                    size += os.lstat(os.path.join(dirpath, f)).st_size
+                except OSError:
+                    pass
+
+        if cache:
+            self._sizes[path] = (mtime, size)
+        return size
+
+    def _candidates(self, env_dir: str) -> List[Tuple[float, List[str]]]:
+        """Lists data of an environment that can be evicted. Time-steps are
+        grouped across the serial case and processor folders.
+
+        Args:
+            env_dir (str): Path to environment
+
+        Returns:
+            List[Tuple[float, List[str]]]: modification time and paths of each candidate
+        """
+        proc_folders = get_proc_folders(env_dir)
+        serial_times = get_time_folders(env_dir)
+
+        # Keep the initial state and the latest complete restart state
+        keep = set()
+        if len(serial_times) > 0:
+            keep.update([serial_times[0], serial_times[-1]])
+        if len(proc_folders) > 0:
+            proc_times = [set(get_time_folders(f)) for f in proc_folders]
+            common = sorted(set.intersection(*proc_times), key=float)
+            if len(common) > 0:
+                keep.update([common[0], common[-1]])
+        else:
+            proc_times = []
+
+        groups = {}
+        for time_step in set(serial_times).union(*proc_times):
+            if time_step in keep:
+                continue
+            groups[time_step] = [
+                os.path.join(case_dir, time_step)
+                for case_dir in [env_dir] + proc_folders
+                if os.path.isdir(os.path.join(case_dir, time_step))
+            ]
+
+        candidates = []
+        for paths in groups.values():
+            candidates.append((max(os.stat(p).st_mtime for p in paths), paths))
+
+        # Post-processing output, keeping the latest of each function object
+        post_dir = os.path.join(env_dir, 'postProcessing')
+        if os.path.exists(post_dir):
+            for fo in os.scandir(post_dir):
+                if not fo.is_dir():
+                    continue
+                for time_step in get_time_folders(fo.path)[:-1]:
+                    path = os.path.join(fo.path, time_step)
+                    candidates.append((os.stat(path).st_mtime, [path]))
+
+        # Solver logs
+        log_dir = os.path.join(env_dir, 'logs')
+        if os.path.exists(log_dir):
+            for f in os.scandir(log_dir):
+                if f.is_file():
+                    candidates.append((f.stat().st_mtime, [f.path]))
+
+        return candidates
+
+    def _evict(self, target: int) -> int:
+        """Deletes the oldest candidates of idle environments
+
+        Args:
+            target (int): Number of bytes to free
+
+        Returns:
+            int: Number of bytes freed
+        """
+        locks = []
+        candidates = []
+        for env_dir in self.env_dirs:
+            if not os.path.exists(env_dir):
+                continue
+            lock = env_lock(env_dir)
+            try:
+                lock.acquire(timeout=0)
+            except Timeout:
+                logger.info(
+                    'Environment {:s} busy, not pruning.'.format(env_dir)
+                )
+                continue
+            locks.append(lock)
+            candidates.extend(self._candidates(env_dir))
+
+        freed = 0
+        try:
+            for _, paths in sorted(candidates, key=lambda c: c[0]):
+                if freed >= target:
+                    break
+                for path in paths:
+                    if os.path.isdir(path):
+                        size = self._tree_size(path)
+                        rmtree(path, ignore_errors=True)
+                        self._sizes.pop(path, None)
+                    else:
+                        size = os.lstat(path).st_size
+                        os.remove(path)
+                    logger.info('Pruned {:s}.'.format(path))
+                    freed += size
+        finally:
+            for lock in locks:
+                lock.release()
+
+        for env_dir in self.env_dirs:
+            self._usage[env_dir] = self.env_usage(env_dir)
+
+        return freed
+
+
+class TrashReaper(threading.Thread):
+    """Background thread deleting the contents of trash folders. Jobs move
+    data they no longer need into a trash folder with an atomic rename and
+    hand the folder to the reaper, so the slow recursive delete runs in
+    parallel off the job's critical path. Use get_reaper to obtain the
+    shared reaper of the process.
+
+    Args:
+        max_workers (int, optional): Number of concurrent deletes. Defaults to 4.
+    """
+    def __init__(self, max_workers: int = 4) -> None:
+        """Constructor
+        """
+        super().__init__(daemon=True)
+        self.max_workers = max_workers
+        self._queue = queue.Queue()
+
+    def run(self) -> None:
+        """Thread activity, empties trash folders as they are queued
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                trash_dir = self._queue.get()
+                try:
+                    paths = [
+                        entry.path for entry in os.scandir(trash_dir)
+                    ] if os.path.isdir(trash_dir) else []
+                    errors = pool.map(self._delete, paths)
+                    for path, error in zip(paths, errors):
+                        if not error is None:
+                            logger.error(
+                                'Failed reaping {:s}: {}'.format(path, error)
+                            )
+                finally:
+                    self._queue.task_done()
+
+    def reap(self, trash_dir: str) -> None:
+        """Queues a trash folder to be emptied
+
+        Args:
+            trash_dir (str): Path to trash folder
+        """
+        self._queue.put(trash_dir)
+
+    def wait(self) -> None:
+        """Blocks until every queued trash folder has been emptied
+        """
+        self._queue.join()
+
+    @staticmethod
+    def _delete(path: str) -> Union[OSError, None]:
+        """Deletes a file or directory
+
+        Args:
+            path (str): Path to delete
+
+        Returns:
+            Union[OSError, None]: Error raised while deleting, if any
+        """
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            return e
+        return None
+
+
+def get_reaper() -> TrashReaper:
+    """Shared trash reaper of the process, started on first use
+
+    Returns:
+        TrashReaper: trash reaper
+    """
+    global _REAPER
+    with _REAPER_LOCK:
+        if _REAPER is None:
+            _REAPER = TrashReaper()
+            _REAPER.start()
+    return _REAPER
+
+
+def move_to_trash(case_dir: str, names: List[str]) -> str:
+    """Atomically renames entries of a case into the case's trash folder.
+    The entries disappear from the case immediately, deleting them is left
+    to the reaper.
+
+    Args:
+        case_dir (str): Path to OpenFOAM case or processor folder
+        names (List[str]): Names of entries in the case folder
+
+    Returns:
+        str: Path to trash folder
+    """
+    trash_dir = os.path.join(case_dir, TRASH_DIR)
+    os.makedirs(trash_dir, exist_ok=True)
+    for name in names:
+        # Unique name in case the same entry is trashed again before reaping
+        os.rename(
+            os.path.join(case_dir, name),
+            os.path.join(
+                trash_dir, '{:s}.{:s}'.format(name, uuid.uuid4().hex[:8])
+            )
+        )
+    return trash_dir
@@ -0,0 +1,303 @@
+import os
+import threading
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from .backends import (
+    POST_KEYS, BackendRunner, action_tables, archive_jobs, channel_key,
+    start_time, table_at, write_post
+)
+from .casemeta import CaseMeta
+from .jlogger import getLogger
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Indexes loaded by this process, keyed by dataset folders, environment and
+# quantum
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+class ReplayIndex(object):
+    """Recorded jobs of an environment, keyed by start time and action
+    schedule. Times of the schedule are taken relative to the start time and
+    times and values are rounded to a quantum, so jobs with the same actions
+    find each other despite float noise in the configs.
+
+    Args:
+        jobs (List[Dict]): archived jobs, see archive_jobs
+        quantum (float, optional): Resolution of times and actions. Defaults to 1e-6.
+    """
+    def __init__(self, jobs: List[Dict], quantum: float = 1e-6) -> None:
+        """Constructor
+        """
+        self.quantum = quantum
+        self.entries = []
+        self.exact = {}
+        # Config files already settled and folder times of the last refresh
+        self.seen = set()
+        self.mtimes = None
+        self.add(jobs)
+
+    def add(self, jobs: List[Dict]) -> None:
+        """Adds recorded jobs to the index
+
+        Args:
+            jobs (List[Dict]): archived jobs, see archive_jobs
+        """
+        for job in jobs:
+            outputs = {}
+            for post, out in zip(job['config'].get('post', []), job['outputs']):
+                if post['func'] in POST_KEYS and not out is None:
+                    outputs[channel_key(post)] = out
+            if len(outputs) == 0:
+                continue
+
+            t0 = start_time(job['config'])
+            entry = {
+                'hash': job['config']['hash'],
+                'start': t0,
+                'tables': action_tables(job['config']),
+                'outputs': outputs
+            }
+            self.entries.append(entry)
+            # Later jobs replace earlier recordings of the same actions
+            self.exact[self.key(t0, entry['tables'])] = entry
+
+    @classmethod
+    def of_world(cls, world_config: Config, env_id: int) -> 'ReplayIndex':
+        """Index of an environment, kept by the process and updated with the
+        jobs recorded since its last use. The dataset is the world's own
+        archive, or the one in replay_job_dir and replay_output_dir if set.
+
+        Args:
+            world_config (Config): Initialized world configuration
+            env_id (int): Environment id
+
+        Returns:
+            ReplayIndex: index of the environment
+        """
+        dataset = {
+            'job_dir': world_config.get(
+                'replay_job_dir', world_config['job_dir']
+            ),
+            'output_dir': world_config.get(
+                'replay_output_dir', world_config['output_dir']
+            )
+        }
+        quantum = float(world_config.get('replay_quantum', 1e-6))
+        key = (dataset['job_dir'], dataset['output_dir'], env_id, quantum)
+        with _INDEXES_LOCK:
+            if not key in _INDEXES:
+                _INDEXES[key] = cls([], quantum)
+            index = _INDEXES[key]
+            index.refresh(dataset, env_id)
+            return index
+
+    def refresh(self, dataset: Config, env_id: int) -> None:
+        """Indexes the jobs recorded in a dataset since the last refresh, if
+        its folders changed
+
+        Args:
+            dataset (Config): job_dir and output_dir of the dataset
+            env_id (int): Environment id
+        """
+        try:
+            mtimes = tuple(
+                os.stat(dataset[k]).st_mtime_ns
+                for k in ['job_dir', 'output_dir']
+            )
+        except OSError:
+            return
+        if mtimes == self.mtimes:
+            return
+        self.mtimes = mtimes
+
+        count = len(self.entries)
+        self.add(archive_jobs(dataset, env_id, seen=self.seen))
+        if len(self.entries) > count:
+            logger.info(
+                'Indexed {:d} recorded jobs for replay.'.format(
+                    len(self.entries) - count
+                )
+            )
+
+    def quantize(self, value) -> Tuple:
+        """Rounds a number or list of numbers to the quantum
+
+        Args:
+            value: number or list
+
+        Returns:
+            Tuple: integer multiples of the quantum
+        """
+        return tuple(
+            int(v) for v in np.round(
+                np.ravel(np.asarray(value, dtype=float)) / self.quantum
+            )
+        )
+
+    def key(self, t0: float, tables: Dict[str, List]) -> Tuple:
+        """Lookup key of a job
+
+        Args:
+            t0 (float): start time
+            tables (Dict[str, List]): action tables, see action_tables
+
+        Returns:
+            Tuple: quantized start time and schedule
+        """
+        schedule = tuple(
+            (
+                name,
+                tuple(
+                    (self.quantize(row[0] - t0), self.quantize(row[1]))
+                    for row in tables[name]
+                )
+            ) for name in sorted(tables)
+        )
+        return self.quantize(t0), schedule
+
+    def distance(self, t0: float, tables: Dict[str, List],
+                 entry: Dict) -> float:
+        """Distance between the actions of a job and a recorded one, both
+        evaluated at the times of either schedule relative to their start
+
+        Args:
+            t0 (float): start time of the job
+            tables (Dict[str, List]): action tables of the job
+            entry (Dict): recorded job
+
+        Returns:
+            float: root mean square difference of the actions, inf if the tables differ in size
+        """
+        error, count = 0., 0
+        for name in set(tables) | set(entry['tables']):
+            if not name in tables or not name in entry['tables']:
+                return np.inf
+            ours = [[row[0] - t0, row[1]] for row in tables[name]]
+            theirs = [[row[0] - entry['start'], row[1]]
+                      for row in entry['tables'][name]]
+            times = np.union1d([row[0] for row in ours],
+                               [row[0] for row in theirs])
+            a, b = table_at(ours, times), table_at(theirs, times)
+            if a.shape != b.shape:
+                return np.inf
+            error += float(np.sum((a - b)**2))
+            count += a.size
+        return np.sqrt(error / max(count, 1))
+
+    def match(
+        self,
+        t0: float,
+        tables: Dict[str, List],
+        max_offset: float = None,
+        max_distance: float = None
+    ) -> Tuple[Union[Dict, None], bool]:
+        """Recorded job with the same start time and actions, otherwise the
+        one with the closest start time and, among those, the closest actions
+
+        Args:
+            t0 (float): start time of the job
+            tables (Dict[str, List]): action tables of the job
+            max_offset (float, optional): Largest start time difference of a nearest match. Defaults to None, no limit.
+            max_distance (float, optional): Largest action distance of a nearest match, see distance. Defaults to None, no limit.
+
+        Returns:
+            Tuple[Union[Dict, None], bool]: recorded job (None if there is none within the limits) and if it is an exact match
+        """
+        entry = self.exact.get(self.key(t0, tables), None)
+        if not entry is None:
+            return entry, True
+        if len(self.entries) == 0:
+            return None, False
+
+        step = self.quantize(t0)
+        closest = min(abs(self.quantize(e['start'])[0] - step[0])
+                      for e in self.entries)
+        if not max_offset is None and closest > self.quantize(max_offset)[0]:
+            return None, False
+        candidates = [
+            e for e in self.entries
+            if abs(self.quantize(e['start'])[0] - step[0]) == closest
+        ]
+        distances = [self.distance(t0, tables, e) for e in candidates]
+        index = int(np.argmin(distances))
+        if not max_distance is None and distances[index] > max_distance:
+            return None, False
+        return candidates[index], False
+
+
+class ReplayRunner(BackendRunner):
+    """Answers jobs with the outputs of a recorded job of their environment
+    with the same start time and action schedule, or the nearest one if
+    there is none. Outputs are shifted to the start time of the job. How far
+    a nearest job may be is set by replay_max_offset (start time, defaults to
+    0) and replay_max_distance (actions, no limit by default) of the world,
+    jobs with no recording within them fail.
+
+    Args:
+        config (Config): environment job config
+        foam_dir (str): directory path to OpenFOAM simulation
+        world_config (Config): Initialized world configuration
+    """
+    def run(self) -> int:
+        """Writes the recorded outputs of the job as postProcessing files
+
+        Returns:
+            int: return code, 0 on success
+        """
+        index = ReplayIndex.of_world(self.world_config, self.config['id'])
+        t0 = CaseMeta.get(self.dir).start_time
+        max_distance = self.world_config.get('replay_max_distance', None)
+        entry, exact = index.match(
+            t0,
+            action_tables(self.config),
+            max_offset=float(self.world_config.get('replay_max_offset', 0.)),
+            max_distance=None if max_distance is None else float(max_distance)
+        )
+        if entry is None:
+            if len(index.entries) == 0:
+                logger.error('No recorded jobs to replay.')
+            else:
+                logger.error(
+                    'No recorded job close enough to the actions at time '
+                    '{:g} (see replay_max_offset and replay_max_distance).'.
+                    format(t0)
+                )
+            self.returncodes['replay'] = 1
+            return 1
+
+        if not exact:
+            logger.warning(
+                'No recorded job with these actions at time {:g}, '
+                'replaying the nearest one ({:s} at time {:g}).'.format(
+                    t0, str(entry['hash']), entry['start']
+                )
+            )
+        logger.add_stat(
+            'replay', {
+                'hash': str(entry['hash']),
+                'exact': exact
+            }
+        )
+
+        returncode = 0
+        for post in self.config.get('post', []):
+            output = entry['outputs'].get(channel_key(post), None)
+            if output is None:
+                logger.error(
+                    'Recorded job has no output of {:s}.'.format(post['func'])
+                )
+                returncode = 1
+                continue
+            output = dict(output)
+            output['times'] = np.asarray(output['times']) + (t0 - entry['start'])
+            if not write_post(self.dir, post, output):
+                returncode = 1
+
+        self.returncodes['replay'] = returncode
+        return returncode
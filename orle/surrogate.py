@@ -0,0 +1,462 @@
+import json
+import os
+import threading
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from .backends import (
+    POST_KEYS, BackendRunner, action_tables, archive_jobs, channel_key,
+    start_time, table_at, write_post
+)
+from .casemeta import CaseMeta
+from .jlogger import getLogger
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Folder of the world holding the fitted models, one per environment
+SURROGATE_DIR = 'surrogates'
+# Surrogate state of an environment at the end of its last job
+STATE_FILE = '.orle.surrogate.npz'
+# Models loaded by this process, keyed by model file
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+
+class SurrogateModel(object):
+    """Reduced-order model of the outputs of an environment. Outputs of all
+    post functions are stacked into one state, projected on its POD modes
+    and advanced with a linear map driven by the actions (DMD with control):
+    a[k+1] = A a[k] + B u[k].
+
+    Args:
+        meta (Dict): channels (key and shape of each output), inputs (key and size of each action table), dt and the states at the start and end times of the archive
+        arrays (Dict[str, np.ndarray]): mean, scale, modes, A, B
+    """
+    def __init__(self, meta: Dict, arrays: Dict[str, np.ndarray]) -> None:
+        """Constructor
+        """
+        self.meta = meta
+        self.mean = arrays['mean']
+        self.scale = arrays['scale']
+        self.modes = arrays['modes']
+        self.A = arrays['A']
+        self.B = arrays['B']
+        self.dt = meta['dt']
+
+    @classmethod
+    def fit(
+        cls,
+        jobs: List[Dict],
+        energy: float = 0.999,
+        rank: int = None
+    ) -> Union['SurrogateModel', None]:
+        """Fits a model to archived jobs of an environment
+
+        Args:
+            jobs (List[Dict]): archived jobs, see archive_jobs
+            energy (float, optional): Fraction of the variance kept by the POD modes. Defaults to 0.999.
+            rank (int, optional): Number of POD modes, overrides energy. Defaults to None.
+
+        Returns:
+            Union[SurrogateModel, None]: fitted model, None if there is not enough data
+        """
+        # Outputs of each job keyed by channel
+        samples = []
+        for job in jobs:
+            outputs = {}
+            for post, out in zip(job['config'].get('post', []), job['outputs']):
+                if post['func'] in POST_KEYS and not out is None and len(
+                    out['times']
+                ) > 1:
+                    outputs[channel_key(post)] = out
+            if len(outputs) > 0:
+                samples.append((job['config'], outputs))
+        if len(samples) == 0:
+            logger.error('No archived outputs to fit a surrogate to.')
+            return None
+
+        keys = sorted(samples[0][1].keys())
+        samples = [s for s in samples if all(k in s[1] for k in keys)]
+        channels = [{
+            'key': k,
+            'shape': list(
+                np.asarray(samples[0][1][k][POST_KEYS[json.loads(k)[0]]]
+                           ).shape[1:]
+            )
+        } for k in keys]
+        inputs = {}
+        for config, _ in samples:
+            for k, table in action_tables(config).items():
+                inputs[k] = int(np.ravel(table[0][1]).size)
+        inputs = [{'key': k, 'size': inputs[k]} for k in sorted(inputs)]
+
+        dt = float(
+            np.median(
+                np.concatenate([
+                    np.diff(outputs[keys[0]]['times'])
+                    for _, outputs in samples
+                ])
+            )
+        )
+
+        # Trajectories resampled on a uniform grid of the time-step
+        trajectories = []
+        for config, outputs in samples:
+            t0 = start_time(config)
+            t1 = float(outputs[keys[0]]['times'][-1])
+            n = int(np.floor((t1 - t0) / dt + 1e-6))
+            if n < 2:
+                continue
+            times = t0 + dt * np.arange(1, n + 1)
+            states = np.concatenate([
+                cls._resample(outputs[k], json.loads(k)[0], times)
+                for k in keys
+            ],
+                                    axis=1)
+            trajectories.append(
+                (t0, times, states, cls._inputs(inputs, config, times))
+            )
+        if len(trajectories) == 0:
+            logger.error('Archived outputs are too short to fit a surrogate.')
+            return None
+
+        # POD of the scaled states
+        snapshots = np.concatenate([t[2] for t in trajectories], axis=0)
+        mean = snapshots.mean(axis=0)
+        scale = snapshots.std(axis=0)
+        scale[scale < 1e-12] = 1.
+        _, sigma, vt = np.linalg.svd((snapshots - mean) / scale,
+                                     full_matrices=False)
+        if rank is None:
+            cumulative = np.cumsum(sigma**2) / max(np.sum(sigma**2), 1e-30)
+            rank = int(np.searchsorted(cumulative, energy) + 1)
+        rank = max(1, min(rank, len(sigma)))
+        modes = vt[:rank].T
+
+        # Least squares fit of the reduced dynamics over all trajectories
+        z, y = [], []
+        for _, _, states, u in trajectories:
+            a = ((states - mean) / scale) @ modes
+            z.append(np.concatenate([a[:-1], u[:-1]], axis=1))
+            y.append(a[1:])
+        z = np.concatenate(z, axis=0)
+        y = np.concatenate(y, axis=0)
+        ridge = 1e-8 * np.trace(z.T @ z) / z.shape[1]
+        g = np.linalg.solve(z.T @ z + ridge * np.eye(z.shape[1]), z.T @ y)
+        A = g[:rank].T
+        B = g[rank:].T
+
+        # Known states at the start and end times of the archive
+        starts, ends = {}, {}
+        for t0, times, states, _ in trajectories:
+            starts.setdefault('{:g}'.format(t0), []).append(states[0])
+            ends.setdefault('{:g}'.format(times[-1]), []).append(states[-1])
+        meta = {
+            'channels': channels,
+            'inputs': inputs,
+            'dt': dt,
+            'rank': rank,
+            'jobs': len(trajectories),
+            'starts': {k: np.mean(v, axis=0).tolist()
+                       for k, v in starts.items()},
+            'ends': {k: np.mean(v, axis=0).tolist()
+                     for k, v in ends.items()}
+        }
+        logger.info(
+            'Fitted surrogate with {:d} modes to {:d} jobs.'.format(
+                rank, len(trajectories)
+            )
+        )
+        return cls(
+            meta, {
+                'mean': mean,
+                'scale': scale,
+                'modes': modes,
+                'A': A,
+                'B': B
+            }
+        )
+
+    @staticmethod
+    def _resample(output: Dict, func: str, times: np.ndarray) -> np.ndarray:
+        """Output of a post function interpolated at the given times
+
+        Args:
+            output (Dict): output of the post function
+            func (str): name of the post function
+            times (np.ndarray): times to evaluate
+
+        Returns:
+            np.ndarray: flattened values, [n_times, n_values]
+        """
+        values = np.asarray(output[POST_KEYS[func]], dtype=float)
+        values = values.reshape(values.shape[0], -1)
+        return np.stack([
+            np.interp(times, output['times'], values[:, i])
+            for i in range(values.shape[1])
+        ],
+                        axis=1)
+
+    @staticmethod
+    def _inputs(inputs: List[Dict], config: Config,
+                times: np.ndarray) -> np.ndarray:
+        """Actions of a job at the given times
+
+        Args:
+            inputs (List[Dict]): key and size of each action table
+            config (Config): environment job config
+            times (np.ndarray): times to evaluate
+
+        Returns:
+            np.ndarray: actions, [n_times, n_inputs]
+        """
+        tables = action_tables(config)
+        columns = [np.zeros((len(times), 0))]
+        for entry in inputs:
+            if entry['key'] in tables:
+                columns.append(table_at(tables[entry['key']], times))
+            else:
+                columns.append(np.zeros((len(times), entry['size'])))
+        return np.concatenate(columns, axis=1)
+
+    def initial_state(self, time_step: float) -> np.ndarray:
+        """State of the archive closest to a start time, preferring the end
+        of a job over the start of one
+
+        Args:
+            time_step (float): start time
+
+        Returns:
+            np.ndarray: state
+        """
+        candidates = [(float(k), v) for k, v in self.meta['ends'].items()]
+        candidates += [(float(k), v) for k, v in self.meta['starts'].items()]
+        distance = min(abs(t - time_step) for t, _ in candidates)
+        if distance > 0.5 * self.dt:
+            logger.warning(
+                'No archived state at time {:g}, using the closest one.'.
+                format(time_step)
+            )
+        for t, state in candidates:
+            if abs(t - time_step) == distance:
+                return np.array(state)
+
+    def rollout(
+        self, state: np.ndarray, config: Config, t0: float, t1: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Advances a state over the window of a job
+
+        Args:
+            state (np.ndarray): state at the start time
+            config (Config): environment job config
+            t0 (float): start time
+            t1 (float): end time
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: output times and states
+        """
+        n = max(1, int(round((t1 - t0) / self.dt)))
+        times = t0 + self.dt * np.arange(0, n + 1)
+        u = self._inputs(self.meta['inputs'], config, times)
+
+        a = ((state - self.mean) / self.scale) @ self.modes
+        reduced = []
+        for k in range(n):
+            a = self.A @ a + self.B @ u[k]
+            reduced.append(a)
+        states = np.array(reduced) @ self.modes.T * self.scale + self.mean
+        return times[1:], states
+
+    def output(self, post: Config, times: np.ndarray,
+               states: np.ndarray) -> Union[Dict, None]:
+        """Output of a post function from the predicted states
+
+        Args:
+            post (Config): post function config
+            times (np.ndarray): output times
+            states (np.ndarray): predicted states
+
+        Returns:
+            Union[Dict, None]: output in the format of the post function, None if the model does not predict it
+        """
+        key = channel_key(post)
+        start = 0
+        for channel in self.meta['channels']:
+            size = int(np.prod(channel['shape']))
+            if channel['key'] == key:
+                values = states[:, start:start + size].reshape(
+                    [len(times)] + channel['shape']
+                )
+                return {'times': times, POST_KEYS[post['func']]: values}
+            start += size
+        return None
+
+    def save(self, file_path: str) -> None:
+        """Writes the model
+
+        Args:
+            file_path (str): path to model file
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_file = file_path + '.tmp.npz'
+        np.savez(
+            tmp_file,
+            meta=json.dumps(self.meta),
+            mean=self.mean,
+            scale=self.scale,
+            modes=self.modes,
+            A=self.A,
+            B=self.B
+        )
+        os.replace(tmp_file, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'SurrogateModel':
+        """Reads a model
+
+        Args:
+            file_path (str): path to model file
+
+        Returns:
+            SurrogateModel: model
+        """
+        with np.load(file_path) as data:
+            arrays = {k: data[k] for k in ['mean', 'scale', 'modes', 'A', 'B']}
+            meta = json.loads(str(data['meta']))
+        return cls(meta, arrays)
+
+
+def model_file(world_config: Config, env_dir: str) -> str:
+    """Path of the surrogate model of an environment
+
+    Args:
+        world_config (Config): Initialized world configuration
+        env_dir (str): Path to environment folder
+
+    Returns:
+        str: <world_dir>/surrogates/<env name>.npz
+    """
+    return os.path.join(
+        world_config['world_dir'], SURROGATE_DIR,
+        os.path.basename(os.path.normpath(env_dir)) + '.npz'
+    )
+
+
+def fit_surrogates(world_config: Config) -> int:
+    """Fits the surrogate of every environment of a world to its archive
+
+    Args:
+        world_config (Config): Initialized world configuration
+
+    Returns:
+        int: number of fitted models
+    """
+    fitted = 0
+    for env in world_config['envs']:
+        env_dir = os.path.join(world_config['world_dir'], env['name'])
+        model = SurrogateModel.fit(archive_jobs(world_config, env['id']))
+        if model is None:
+            continue
+        file_path = model_file(world_config, env_dir)
+        model.save(file_path)
+        with _MODELS_LOCK:
+            _MODELS[file_path] = model
+        fitted += 1
+    return fitted
+
+
+class SurrogateRunner(BackendRunner):
+    """Answers jobs with the surrogate model of their environment, fitted to
+    the archive on first use. The state at the end of each job is kept in
+    the environment, so jobs continuing an episode start from it.
+
+    Args:
+        config (Config): environment job config
+        foam_dir (str): directory path to OpenFOAM simulation
+        world_config (Config): Initialized world configuration
+    """
+    def model(self) -> Union[SurrogateModel, None]:
+        """Surrogate model of the environment, loaded or fitted once
+
+        Returns:
+            Union[SurrogateModel, None]: model, None if it can not be fitted
+        """
+        file_path = model_file(self.world_config, self.dir)
+        with _MODELS_LOCK:
+            if file_path in _MODELS:
+                return _MODELS[file_path]
+
+        if os.path.exists(file_path):
+            model = SurrogateModel.load(file_path)
+        else:
+            logger.info('Fitting surrogate of environment.')
+            model = SurrogateModel.fit(
+                archive_jobs(self.world_config, self.config['id'])
+            )
+            if model is None:
+                return None
+            model.save(file_path)
+
+        with _MODELS_LOCK:
+            _MODELS[file_path] = model
+        return model
+
+    def run(self) -> int:
+        """Predicts the outputs of the job and writes them as postProcessing
+        files
+
+        Returns:
+            int: return code, 0 on success
+        """
+        model = self.model()
+        if model is None:
+            self.returncodes['surrogate'] = 1
+            return 1
+
+        meta = CaseMeta.get(self.dir)
+        t0, t1 = meta.start_time, meta.end_time
+        times, states = model.rollout(self.start_state(model, t0),
+                                      self.config, t0, t1)
+
+        returncode = 0
+        for post in self.config.get('post', []):
+            if not post['func'] in POST_KEYS:
+                continue
+            output = model.output(post, times, states)
+            if output is None or not write_post(self.dir, post, output):
+                logger.error(
+                    'Surrogate does not predict {:s}.'.format(post['func'])
+                )
+                returncode = 1
+
+        np.savez(
+            os.path.join(self.dir, STATE_FILE),
+            time=times[-1],
+            state=states[-1]
+        )
+        self.returncodes['surrogate'] = returncode
+        return returncode
+
+    def start_state(self, model: SurrogateModel,
+                    time_step: float) -> np.ndarray:
+        """State the job starts from, the end of the previous surrogate job
+        of the environment if it ended at the start time, otherwise the
+        closest state of the archive
+
+        Args:
+            model (SurrogateModel): surrogate model
+            time_step (float): start time
+
+        Returns:
+            np.ndarray: state
+        """
+        state_file = os.path.join(self.dir, STATE_FILE)
+        if os.path.exists(state_file):
+            with np.load(state_file) as data:
+                if abs(float(data['time']) - time_step) <= 0.5 * model.dt \
+                        and data['state'].shape == model.mean.shape:
+                    return data['state']
+        return model.initial_state(time_step)
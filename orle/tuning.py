@@ -0,0 +1,261 @@
+import os
+import time
+from shutil import copytree, ignore_patterns, rmtree
+from typing import Dict, List, Tuple, Union
+
+import yaml
+from filelock import FileLock
+
+from .casemeta import CaseMeta
+from .foam import FOAMRunner
+from .jlogger import getLogger
+from .mods import OpenFoamMods
+
+logger = getLogger(__name__)
+
+Config = Union[Dict, List, Tuple]
+
+# Efficiency curves of the world's meshes, keyed by mesh hash
+TUNING_FILE = 'tuning.yml'
+# Scratch folder of the calibration runs
+TUNING_DIR = '.tuning'
+
+
+def read_tuning(world_dir: str) -> Dict:
+    """Reads the efficiency curves of a world
+
+    Args:
+        world_dir (str): Path to world folder
+
+    Returns:
+        Dict: curves keyed by mesh hash, empty if the world is not tuned
+    """
+    tuning_file = os.path.join(world_dir, TUNING_FILE)
+    if not os.path.exists(tuning_file):
+        return {}
+    with open(tuning_file, 'r') as stream:
+        tuning = yaml.safe_load(stream)
+    return tuning if isinstance(tuning, dict) else {}
+
+
+def choose_np(
+    world_dir: str, env_dir: str, free: int
+) -> Union[Tuple[int, Union[str, None]], None]:
+    """Picks the number of processes and decomposition method with the best
+    throughput for the mesh of an environment that fits in the free cores.
+    If none fits, the smallest calibrated setting is used.
+
+    Args:
+        world_dir (str): Path to world folder
+        env_dir (str): Path to environment folder
+        free (int): Number of free cores
+
+    Returns:
+        Union[Tuple[int, Union[str, None]], None]: np and method, None if the mesh is not tuned
+    """
+    mesh_hash = CaseMeta.get(env_dir).mesh_hash
+    tuning = read_tuning(world_dir).get(mesh_hash, None)
+    if tuning is None or len(tuning['curve']) == 0:
+        return None
+
+    curve = tuning['curve']
+    fits = [point for point in curve if point['np'] <= max(free, 1)]
+    if len(fits) > 0:
+        point = max(fits, key=lambda p: p['throughput'])
+    else:
+        point = min(curve, key=lambda p: p['np'])
+    return point['np'], point['method']
+
+
+class Autotuner(object):
+    """Measures the parallel scaling of the meshes of a world. A short
+    calibration window of each distinct mesh is run at every number of
+    processes and decomposition method, in a scratch copy of the first
+    environment using it. The throughput (simulated seconds per wall
+    second) and parallel efficiency of each setting are stored in the
+    world's tuning.yml, where jobs with np: auto look up their setting.
+
+    Args:
+        world_config (Config): Initialized world configuration
+        np_values (List[int], optional): Numbers of processes to calibrate. Defaults to [1, 2, 4, 8].
+        methods (List[str], optional): Decomposition methods to calibrate. Defaults to ['scotch'].
+        steps (int, optional): Time-steps of each calibration window. Defaults to 20.
+        solver (str, optional): Solver to run. Defaults to the application in the controlDict.
+        args (str, optional): Solver arguments. Defaults to ''.
+    """
+    def __init__(
+        self,
+        world_config: Config,
+        np_values: List[int] = None,
+        methods: List[str] = None,
+        steps: int = 20,
+        solver: str = None,
+        args: str = ''
+    ) -> None:
+        """Constructor
+        """
+        self.config = world_config
+        if np_values is None:
+            np_values = [1, 2, 4, 8]
+        self.np_values = sorted(set(np_values))
+        self.methods = ['scotch'] if methods is None else list(methods)
+        self.steps = steps
+        self.solver = solver
+        self.args = args
+        self.tuning_file = os.path.join(world_config['world_dir'], TUNING_FILE)
+
+    def tune(self, overwrite: bool = False) -> Dict:
+        """Calibrates every mesh of the world
+
+        Args:
+            overwrite (bool, optional): Calibrate meshes that already have a curve. Defaults to False.
+
+        Returns:
+            Dict: curves keyed by mesh hash
+        """
+        tuning = read_tuning(self.config['world_dir'])
+        for env in self.config['envs']:
+            env_dir = os.path.join(self.config['world_dir'], env['name'])
+            mesh_hash = CaseMeta.get(env_dir).mesh_hash
+            if mesh_hash is None:
+                logger.warning(
+                    'Environment {:s} has no mesh to tune.'.format(env['name'])
+                )
+                continue
+
+            if mesh_hash in tuning and not overwrite:
+                if not env['name'] in tuning[mesh_hash]['envs']:
+                    tuning[mesh_hash]['envs'].append(env['name'])
+                continue
+
+            logger.info(
+                'Calibrating mesh {:s} of environment {:s}.'.format(
+                    mesh_hash[:8], env['name']
+                )
+            )
+            tuning[mesh_hash] = {
+                'envs': [env['name']],
+                'curve': self.calibrate(env_dir)
+            }
+            self.write(tuning)
+
+        self.write(tuning)
+        return tuning
+
+    def calibrate(self, env_dir: str) -> List[Dict]:
+        """Runs the calibration windows of a case
+
+        Args:
+            env_dir (str): Path to case
+
+        Returns:
+            List[Dict]: np, method, wall time, throughput and efficiency of each setting
+        """
+        scratch = os.path.join(self.config['world_dir'], TUNING_DIR)
+        solver = self.solver
+        if solver is None:
+            solver = CaseMeta.get(env_dir).control_prop('application')
+
+        curve = []
+        for np in self.np_values:
+            for method in (self.methods if np > 1 else [None]):
+                if os.path.exists(scratch):
+                    rmtree(scratch)
+                copytree(
+                    env_dir,
+                    scratch,
+                    symlinks=True,
+                    ignore=ignore_patterns('processor*', 'logs', '.*')
+                )
+
+                wall, window = self.run_window(scratch, solver, np, method)
+                if wall is None:
+                    continue
+                logger.info(
+                    'np {:d} ({:s}): {:.3g} s for {:g} simulated s.'.format(
+                        np, str(method), wall, window
+                    )
+                )
+                curve.append({
+                    'np': np,
+                    'method': method,
+                    'wall': wall,
+                    'throughput': window / wall
+                })
+
+        if os.path.exists(scratch):
+            rmtree(scratch)
+
+        # Speed up per process relative to the smallest calibrated np
+        if len(curve) > 0:
+            base = min(curve, key=lambda p: p['np'])
+            for point in curve:
+                point['efficiency'] = (
+                    point['throughput'] / base['throughput']
+                ) / (point['np'] / base['np'])
+        return curve
+
+    def run_window(self, case_dir: str, solver: str, np: int,
+                   method: Union[str, None]) -> Tuple[float, float]:
+        """Runs one calibration window, decomposition is not timed
+
+        Args:
+            case_dir (str): Path to scratch case
+            solver (str): Solver to run
+            np (int): Number of processes
+            method (Union[str, None]): Decomposition method
+
+        Returns:
+            Tuple[float, float]: wall seconds (None if the run failed) and simulated seconds
+        """
+        config = {
+            'hash': 'tuning',
+            'params': {
+                'solver': solver,
+                'np': np,
+                'args': self.args,
+                'decompose': True,
+                'reconstruct': False
+            }
+        }
+        if not method is None:
+            config['params']['decompose_method'] = method
+        runner = FOAMRunner(config, case_dir)
+
+        start_time = runner.get_start_timestep()
+        window = self.steps * float(runner.get_control_prop('deltaT'))
+        OpenFoamMods.set_control_dict(
+            {'endTime': '{:g}'.format(start_time + window)}, env_dir=case_dir
+        )
+
+        if runner.decompose() != 0:
+            logger.warning(
+                'Failed to decompose for np {:d} ({:s}).'.format(
+                    np, str(method)
+                )
+            )
+            return None, window
+
+        start = time.time()
+        returncode = runner.run()
+        wall = time.time() - start
+        if returncode != 0:
+            logger.warning(
+                'Calibration run for np {:d} ({:s}) failed.'.format(
+                    np, str(method)
+                )
+            )
+            return None, window
+        return wall, window
+
+    def write(self, tuning: Dict) -> None:
+        """Writes the efficiency curves to the world
+
+        Args:
+            tuning (Dict): curves keyed by mesh hash
+        """
+        with FileLock(self.tuning_file + '.lock'):
+            tmp_file = self.tuning_file + '.tmp'
+            with open(tmp_file, 'w') as stream:
+                yaml.safe_dump(tuning, stream)
+            os.replace(tmp_file, self.tuning_file)
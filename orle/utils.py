@@ -1,7 +1,10 @@
 import errno
 import os
+import re
 from typing import Dict, List, Tuple, Union
 
+from filelock import FileLock
+
 from .jlogger import getLogger
 
 logger = getLogger(__name__)
@@ -11,6 +14,8 @@ Config = Union[Dict, List, Tuple]
 # Since $WORLD may depend on $LOCAL place it first.
 CONFIG_VARS = {"$WORLD": os.getcwd(), "$LOCAL": os.getcwd()}
 
+ENV_LOCK_FILE = '.orle.lock'
+
 
 def clean_config(config: Config) -> Config:
     """Cleans up configuration file replacing any defined variables
@@ -56,3 +61,98 @@ def mkdirs(self, *directories) -> None:
         except OSError as e:
             if e.errno != errno.EEXIST:
                 raise
+
+
+def get_time_folders(directory: str) -> List[str]:
+    """Gets the numeric time-step folders of an OpenFOAM case
+
+    Args:
+        directory (str): path to OpenFOAM case or processor folder
+
+    Returns:
+        List[str]: time-step folder names sorted by numeric value
+    """
+    if not os.path.exists(directory):
+        return []
+
+    times = []
+    for f in os.listdir(directory):
+        try:
+            value = float(f)
+        except ValueError:
+            continue
+        if os.path.isdir(os.path.join(directory, f)):
+            times.append((value, f))
+
+    return [f for _, f in sorted(times)]
+
+
+def get_proc_folders(directory: str) -> List[str]:
+    """Gets the decomposed processor folders of an OpenFOAM case
+
+    Args:
+        directory (str): path to OpenFOAM case
+
+    Returns:
+        List[str]: paths to processor folders sorted by processor index
+    """
+    if not os.path.exists(directory):
+        return []
+
+    procs = []
+    for f in os.listdir(directory):
+        if re.fullmatch(r'processor\d+', f) and os.path.isdir(
+            os.path.join(directory, f)
+        ):
+            procs.append((int(f[len('processor'):]), f))
+
+    return [os.path.join(directory, f) for _, f in sorted(procs)]
+
+
+def get_collated_folders(directory: str) -> List[str]:
+    """Gets the collated processor folders (processors<N>) of an OpenFOAM case
+
+    Args:
+        directory (str): path to OpenFOAM case
+
+    Returns:
+        List[str]: paths to collated processor folders
+    """
+    if not os.path.exists(directory):
+        return []
+
+    return [
+        os.path.join(directory, f) for f in sorted(os.listdir(directory))
+        if re.fullmatch(r'processors\d+', f)
+        and os.path.isdir(os.path.join(directory, f))
+    ]
+
+
+def env_lock(env_dir: str) -> FileLock:
+    """Lock guarding an environment folder. Held by the process running a
+    job in the environment and by any background task editing its files.
+
+    Args:
+        env_dir (str): path to environment folder
+
+    Returns:
+        FileLock: environment lock
+    """
+    return FileLock(os.path.join(env_dir, ENV_LOCK_FILE))
+
+
+def split_domains(np: int) -> Tuple[int, int, int]:
+    """Splits a number of subdomains into the most even x, y, z counts of a
+    2D decomposition, as needed by the simple and hierarchical methods
+
+    Args:
+        np (int): number of subdomains
+
+    Returns:
+        Tuple[int, int, int]: subdomains in each direction
+    """
+    nx = 1
+    for n in range(1, int(np**0.5) + 1):
+        if np % n == 0:
+            nx = n
+    return (np // nx, nx, 1)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Tests import the orle package of this checkout
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
@@ -0,0 +1,59 @@
+import pytest
+
+from orle.affinity import CoreAllocator, binding_args
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    """Allocator of a node with two NUMA nodes of four cores with two
+    hardware threads each
+    """
+    allocator = CoreAllocator(str(tmp_path / 'cores.json'))
+    allocator.cores = [{
+        'cpus': [core, core + 8],
+        'package': core // 4,
+        'node': core // 4
+    } for core in range(8)]
+    return allocator
+
+
+def test_select_packs_one_node(allocator):
+    assert allocator._select(set(), 4) == [0, 1, 2, 3]
+    # The smallest node that fits is used
+    assert allocator._select({0}, 3) == [1, 2, 3]
+    assert allocator._select({0}, 4) == [4, 5, 6, 7]
+
+
+def test_select_spreads_over_nodes(allocator):
+    assert allocator._select({0}, 6) == [4, 5, 6, 7, 1, 2]
+
+
+def test_select_shares_cores(allocator):
+    # More processes than physical cores use the sibling threads
+    assert allocator._select(set(), 10) == [0, 8, 1, 9, 2, 10, 3, 11, 4, 12]
+    assert allocator._select({0, 8}, 14) == [
+        1, 9, 2, 10, 3, 11, 4, 12, 5, 13, 6, 14, 7, 15
+    ]
+    assert allocator._select({0}, 16) is None
+
+
+def test_acquire_release(allocator):
+    first = allocator.acquire('job1', 4)
+    second = allocator.acquire('job2', 4)
+    assert first == [0, 1, 2, 3]
+    assert second == [4, 5, 6, 7]
+    # Jobs keep their CPUs when acquiring again
+    assert allocator.acquire('job1', 4) == first
+    assert allocator.free_cores() == 0
+    assert allocator.acquire('job3', 1) == [8]
+
+    # The core of job3's thread is not free
+    allocator.release('job1')
+    assert allocator.free_cores() == 3
+    assert allocator.acquire('job4', 2) == [1, 2]
+
+
+def test_binding_args():
+    assert binding_args([2, 3]) == [
+        '--cpu-set', '2,3', '--bind-to', 'hwthread'
+    ]
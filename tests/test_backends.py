@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from orle.backends import POST_KEYS, write_post
+from orle.post import OpenFoamPost
+
+
+@pytest.mark.parametrize(
+    'func, params, shape', [
+        ('get_forces', {
+            'function_name': 'forces',
+            'time_step': 1
+        }, (2, 2, 3)),
+        ('get_coeff', {
+            'function_name': 'forceCoeffs',
+            'time_step': 1
+        }, (5, )),
+        ('get_probes', {
+            'function_name': 'probes',
+            'field': 'p',
+            'time_step': 1
+        }, (4, )),
+        ('get_probes', {
+            'function_name': 'probes',
+            'field': 'U',
+            'time_step': 1.5
+        }, (4, 3)),
+    ]
+)
+def test_write_post_round_trip(tmp_path, func, params, shape):
+    key = POST_KEYS[func]
+    rng = np.random.default_rng(0)
+    data = {
+        'times': np.array([1.01, 1.02, 1.03]),
+        key: rng.random((3, ) + shape)
+    }
+    assert write_post(str(tmp_path), {'func': func, 'params': params}, data)
+
+    output = getattr(OpenFoamPost, func)(**params, env_dir=str(tmp_path))
+    np.testing.assert_allclose(output['times'], data['times'])
+    np.testing.assert_allclose(output[key], data[key])
@@ -0,0 +1,103 @@
+import os
+import shutil
+
+import pytest
+import yaml
+
+from orle.builders import EnvironmentBuilder
+from orle.foamdict import read_dict
+from orle.mods import OpenFoamMods
+
+CASE = os.path.join(
+    os.path.dirname(__file__), '..', 'base_files', 'cylinder_jets'
+)
+
+
+@pytest.fixture
+def world(tmp_path):
+    """World with one environment built from the example case, deltaT is
+    0.0001 and the case writes every 100 time-steps
+    """
+    world_dir = str(tmp_path / 'world')
+    shutil.copytree(
+        CASE,
+        os.path.join(world_dir, 'base_files'),
+        ignore=shutil.ignore_patterns('polyMesh')
+    )
+    shutil.copytree(
+        os.path.join(world_dir, 'base_files'), os.path.join(world_dir, 'env0')
+    )
+    return {'world_dir': world_dir, 'envs': [{'id': 0, 'name': 'env0'}]}
+
+
+def plan(world, tmp_path, start, end, interval, save_times=None):
+    """Builder of a job running from start to end and keeping time-steps on
+    interval, after plan_writes
+    """
+    config = {
+        'id':
+        0,
+        'name':
+        'cylinder',
+        'hash':
+        'test',
+        'params': {
+            'solver': 'pimpleFoam',
+            'np': 1
+        },
+        'clean': [
+            {
+                'func': 'set_saved_field_times',
+                'params': {
+                    'save_interval': interval,
+                    'save_times': [] if save_times is None else save_times
+                }
+            }
+        ]
+    }
+    config_file = str(tmp_path / 'job.yml')
+    with open(config_file, 'w') as file:
+        yaml.dump(config, file)
+
+    builder = EnvironmentBuilder(config_file, world)
+    OpenFoamMods.set_control_dict(
+        {
+            'startTime': start,
+            'endTime': end
+        }, env_dir=builder.env_dir
+    )
+    assert builder.plan_writes()
+    return read_dict(os.path.join(builder.env_dir, 'system', 'controlDict'))
+
+
+def test_write_interval_of_kept_times(world, tmp_path):
+    control = plan(world, tmp_path, 0, 1, 0.5)
+    assert control['writeControl'] == 'timeStep'
+    assert control['writeInterval'] == '5000'
+
+
+def test_end_time_is_written(world, tmp_path):
+    control = plan(world, tmp_path, 1, 1.0125, 0.5)
+    assert control['writeInterval'] == '125'
+
+
+def test_interval_is_never_shortened(world, tmp_path):
+    # Kept times 1.25 and 1.5 are 0.0025 apart at the start, shorter than
+    # the case's own interval of 0.01
+    control = plan(world, tmp_path, 1.2475, 1.5, 0.25)
+    assert control['writeControl'] == 'timeStep'
+    assert control['writeInterval'] == '100'
+
+
+def test_earlier_plan_is_restored(world, tmp_path):
+    assert plan(world, tmp_path, 0, 1, 0.5)['writeInterval'] == '5000'
+    control = plan(world, tmp_path, 1, 1.0051, 0.5)
+    assert control['writeInterval'] == '100'
+
+
+def test_purge_write_is_kept(world, tmp_path):
+    env_dir = os.path.join(world['world_dir'], 'env0')
+    OpenFoamMods.set_control_dict({'purgeWrite': 3}, env_dir=env_dir)
+    control = plan(world, tmp_path, 0, 1, 0.5)
+    assert control['writeInterval'] == '5000'
+    assert control['purgeWrite'] == '3'
@@ -0,0 +1,150 @@
+import os
+import threading
+
+import pytest
+
+from orle.foamdict import (
+    DictTransaction, FoamDict, active_transaction, read_dict, write_dict
+)
+
+CASE = os.path.join(
+    os.path.dirname(__file__), '..', 'base_files', 'cylinder_jets'
+)
+
+
+def read_text(path: str) -> str:
+    with open(path, 'rb') as file:
+        return file.read().decode('latin-1')
+
+
+@pytest.mark.parametrize(
+    'name', [
+        'system/controlDict', 'system/fvSchemes', 'system/fvSolution',
+        'system/decomposeParDict', 'constant/transportProperties', '0/U', '0/p'
+    ]
+)
+def test_round_trip(name):
+    text = read_text(os.path.join(CASE, name))
+    assert FoamDict.parse(text).render() == text
+
+
+def test_get_set_keeps_formatting():
+    text = read_text(os.path.join(CASE, 'system', 'controlDict'))
+    control = FoamDict.parse(text)
+    assert control['endTime'] == '5.0'
+    assert control['writeControl'] == 'timeStep'
+
+    control['endTime'] = 6.5
+    rendered = control.render()
+    assert 'endTime         6.5;' in rendered
+    # Only the edited value changes
+    assert rendered.replace('6.5;', '5.0;', 1) == text
+
+
+def test_boundary_edit():
+    field = FoamDict.parse(read_text(os.path.join(CASE, '0', 'U')))
+    field[['boundaryField', 'jet1']] = {
+        'type': 'uniformFixedValue',
+        'uniformValue': 'tableFile'
+    }
+    field = FoamDict.parse(field.render())
+    assert field['boundaryField/jet1/type'] == 'uniformFixedValue'
+    assert field['boundaryField/jet1/uniformValue'] == 'tableFile'
+    assert field['boundaryField/jet2/type'] == 'fixedValue'
+
+
+def test_hidden_semicolons():
+    text = (
+        'a 1;\n'
+        'b "x;y";\n'
+        'c 2 /* ; */ 3;\n'
+        'd 4 // ;\n 5;\n'
+        'e #{ int i; #};\n'
+        'f (1 2 3);\n'
+    )
+    parsed = FoamDict.parse(text)
+    assert parsed['a'] == '1'
+    assert parsed['b'] == '"x;y"'
+    assert parsed['c'] == '2 /* ; */ 3'
+    assert parsed['d'] == '4 // ;\n 5'
+    assert parsed['e'] == '#{ int i; #}'
+    assert parsed['f'] == '(1 2 3)'
+    assert parsed.render() == text
+
+
+def test_missing_semicolon():
+    with pytest.raises(ValueError):
+        FoamDict.parse('a 1;\nb 2\n')
+
+
+def test_copy_is_independent():
+    field = FoamDict.parse(read_text(os.path.join(CASE, '0', 'U')))
+    text = field.render()
+    copy = field.copy()
+    copy['boundaryField/jet1/type'] = 'zeroGradient'
+    copy.remove('boundaryField/wall')
+    assert field.render() == text
+    assert field['boundaryField/jet1/type'] == 'fixedValue'
+    assert 'boundaryField/wall' in field
+
+
+@pytest.fixture
+def control_file(tmp_path):
+    path = tmp_path / 'controlDict'
+    path.write_bytes(
+        open(os.path.join(CASE, 'system', 'controlDict'), 'rb').read()
+    )
+    return str(path)
+
+
+def test_transaction_writes_once(control_file):
+    with DictTransaction() as transaction:
+        for end_time in [6, 7, 8]:
+            control = read_dict(control_file)
+            control['endTime'] = end_time
+            write_dict(control_file, control)
+        # Edits are pending until the transaction closes
+        assert read_dict(control_file)['endTime'] == '8'
+        assert FoamDict.parse(read_text(control_file))['endTime'] == '5.0'
+
+    assert transaction.written == 1
+    assert FoamDict.parse(read_text(control_file))['endTime'] == '8'
+
+
+def test_transaction_skips_unchanged(control_file):
+    stat = os.stat(control_file)
+    with DictTransaction() as transaction:
+        control = read_dict(control_file)
+        control['endTime'] = '5.0'
+        write_dict(control_file, control)
+
+    assert transaction.written == 0
+    assert transaction.unchanged == 1
+    assert os.stat(control_file).st_mtime_ns == stat.st_mtime_ns
+
+
+def test_nested_transaction_joins(control_file):
+    with DictTransaction() as outer:
+        with DictTransaction() as inner:
+            assert inner is outer
+            control = read_dict(control_file)
+            control['endTime'] = 9
+            write_dict(control_file, control)
+        # Inner exit does not flush
+        assert FoamDict.parse(read_text(control_file))['endTime'] == '5.0'
+    assert FoamDict.parse(read_text(control_file))['endTime'] == '9'
+
+
+def test_transaction_is_per_thread(control_file):
+    seen = []
+
+    def other():
+        seen.append(active_transaction())
+
+    with DictTransaction() as transaction:
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        assert active_transaction() is transaction
+    assert seen == [None]
+    assert active_transaction() is None
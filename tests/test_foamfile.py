@@ -0,0 +1,109 @@
+import os
+
+import numpy as np
+
+from orle.foamdict import FoamDict, edit_dict
+from orle.foamfile import (
+    binary_spans, convert_file, is_collated_file, parse_blocks, read_blocks,
+    read_header, read_internal_field, read_texts, render_blocks
+)
+
+CASE = os.path.join(
+    os.path.dirname(__file__), '..', 'base_files', 'cylinder_jets'
+)
+HEADER = (
+    b'FoamFile\n{\n    version     2.0;\n    format      ascii;\n'
+    b'    class       decomposedBlockData;\n    location    "0";\n'
+    b'    object      U;\n}'
+)
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def write_collated(path: str, blocks) -> None:
+    with open(path, 'wb') as file:
+        file.write(render_blocks(HEADER, blocks))
+
+
+def test_collated_round_trip(tmp_path):
+    field = read_bytes(os.path.join(CASE, '0', 'U'))
+    blocks = [field, field.replace(b'(0 0 0)', b'(1 0 0)')]
+    data = render_blocks(HEADER, blocks)
+
+    header, parsed, trailer = parse_blocks(data)
+    assert header == HEADER
+    assert parsed == blocks
+    assert render_blocks(header, parsed, trailer) == data
+
+    path = str(tmp_path / 'U')
+    write_collated(path, blocks)
+    assert is_collated_file(path)
+    assert not is_collated_file(os.path.join(CASE, '0', 'U'))
+    assert read_texts(path) == [block.decode('latin-1') for block in blocks]
+
+
+def test_collated_edit(tmp_path):
+    field = read_bytes(os.path.join(CASE, '0', 'U'))
+    path = str(tmp_path / 'U')
+    write_collated(path, [field, field])
+
+    def edit(field_dict: FoamDict) -> bool:
+        field_dict['boundaryField/jet1/type'] = 'zeroGradient'
+        return True
+
+    assert edit_dict(path, edit)
+    header, blocks, _ = read_blocks(path)
+    assert header == HEADER
+    assert len(blocks) == 2
+    for block in blocks:
+        field_dict = FoamDict.parse(block.decode('latin-1'))
+        assert field_dict['boundaryField/jet1/type'] == 'zeroGradient'
+        assert field_dict['boundaryField/jet2/type'] == 'fixedValue'
+
+
+def nonuniform_field(path: str, values: np.ndarray) -> None:
+    """Copies the example U field with a nonuniform internal field"""
+    text = read_bytes(os.path.join(CASE, '0', 'U')).decode('latin-1')
+    rows = '\n'.join('({} {} {})'.format(*row) for row in values.tolist())
+    text = text.replace(
+        'internalField   uniform (0 0 0);',
+        'internalField   nonuniform List<vector> \n{:d}\n(\n{:s}\n)\n;'.
+        format(len(values), rows)
+    )
+    with open(path, 'wb') as file:
+        file.write(text.encode('latin-1'))
+
+
+def test_binary_round_trip(tmp_path):
+    # Payload bytes that look like ';', '"', '/' and '#' to the parser
+    tricky = np.frombuffer(b';;;;;;;;"/#"/#"/#{#{#{#{', dtype='<f8')
+    values = np.concatenate([
+        np.random.RandomState(0).rand(7, 3),
+        tricky.reshape(1, 3)
+    ])
+    path = str(tmp_path / 'U')
+    nonuniform_field(path, values)
+
+    assert convert_file(path, 'binary')
+    text = read_bytes(path).decode('latin-1')
+    assert read_header(text)['format'] == 'binary'
+    assert len(binary_spans(text)) == 1
+    np.testing.assert_array_equal(read_internal_field(text), values)
+
+    # Binary payloads are skipped by the parser and kept byte for byte
+    field = FoamDict.parse(text)
+    assert field.render() == text
+    field['boundaryField/jet1/type'] = 'zeroGradient'
+    text = field.render()
+    np.testing.assert_array_equal(read_internal_field(text), values)
+    assert FoamDict.parse(text)['boundaryField/jet1/type'] == 'zeroGradient'
+
+    with open(path, 'wb') as file:
+        file.write(text.encode('latin-1'))
+    assert convert_file(path, 'ascii')
+    text = read_bytes(path).decode('latin-1')
+    assert read_header(text)['format'] == 'ascii'
+    np.testing.assert_array_equal(read_internal_field(text), values)
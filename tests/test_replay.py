@@ -0,0 +1,60 @@
+import pytest
+
+from orle.replay import ReplayIndex
+
+
+def recording(index, t0, value, name='recorded'):
+    """Adds a job that held the jet at a value for 0.1 from t0"""
+    entry = {
+        'hash': name,
+        'start': t0,
+        'tables': {
+            'U.jet1': [[t0, value], [t0 + 0.1, value]]
+        },
+        'outputs': {}
+    }
+    index.entries.append(entry)
+    index.exact[index.key(t0, entry['tables'])] = entry
+    return entry
+
+
+def table(t0, value):
+    return {'U.jet1': [[t0, value], [t0 + 0.1, value]]}
+
+
+@pytest.fixture
+def index():
+    return ReplayIndex([])
+
+
+def test_key_ignores_float_noise(index):
+    assert index.key(1., table(1., 0.5)) == index.key(
+        1. + 1e-9, table(1. + 1e-9, 0.5 + 1e-9)
+    )
+    assert index.key(1., table(1., 0.5)) != index.key(1., table(1., 0.6))
+    # Schedules are relative to the start time
+    assert index.key(1., table(1., 0.5))[1] == index.key(2., table(2., 0.5))[1]
+
+
+def test_match_exact(index):
+    entry = recording(index, 1., 0.5)
+    recording(index, 1., 0.6)
+    assert index.match(1., table(1., 0.5)) == (entry, True)
+
+
+def test_match_nearest(index):
+    recording(index, 1., 0.5, 'far')
+    near = recording(index, 1.2, 0.1, 'near')
+    closest = recording(index, 1.2, 0.4, 'closest')
+    # The closest start time wins over the closest actions
+    assert index.match(1.25, table(1.25, 0.5)) == (closest, False)
+    assert index.match(1.25, table(1.25, 0.)) == (near, False)
+    assert ReplayIndex([]).match(1., table(1., 0.5)) == (None, False)
+
+
+def test_match_limits(index):
+    entry = recording(index, 1., 0.5)
+    assert index.match(1.1, table(1.1, 0.5), max_offset=0.2) == (entry, False)
+    assert index.match(1.1, table(1.1, 0.5), max_offset=0.) == (None, False)
+    assert index.match(1., table(1., 0.6), max_distance=0.2) == (entry, False)
+    assert index.match(1., table(1., 0.6), max_distance=0.05) == (None, False)